@@ -0,0 +1,375 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import REGISTRY
+from protocol import FIELDS
+
+log = logging.getLogger(__name__)
+
+# Local session archive. While an active session runs, every parsed reading
+# is appended to <archive_dir>/<oven>/<session>.oar in a compact column
+# layout, so exports and post-run analysis can read just the columns and time
+# range they need instead of pulling the session back from the server.
+#
+#   file:      MAGIC | u32 header length | header JSON
+#   row group: GROUP_HEADER | column data | footer JSON | u32 CRC-32 of footer
+#
+# The header names the columns and their array typecodes. A row group holds
+# each column's values back to back (fixed width, header byte order) and its
+# footer gives every column's offset, min, max and CRC-32, plus the board
+# names the board column indexes into. Groups are only ever appended, so a
+# file cut short by a crash loses at most the group being written.
+
+MAGIC = b"OVENARC1"
+LENGTH = struct.Struct("<I")
+GROUP_HEADER = struct.Struct("<4sIII")  # b"RGRP", rows, data bytes, footer bytes
+GROUP_MAGIC = b"RGRP"
+SUFFIX = ".oar"
+
+# timestamp: epoch seconds, board: index into the group's boards, a float32
+# per field (NaN where missing), failed: bit i set when fields[i] was outside
+# its control limits. fields are records.board_fields, protocol.FIELDS unless
+# the configured sequence names others.
+def archive_columns(fields=FIELDS):
+    return (("timestamp", "d"), ("board", "H")) + tuple((key, "f") for key in fields) + (("failed", "H" if len(fields) <= 16 else "Q"),)
+
+
+# Session ids sort by start time
+def session_id(started=None):
+    return datetime.fromtimestamp(time.time() if started is None else started).strftime("%Y%m%d-%H%M%S")
+
+
+def archive_path(archive_dir, oven_name, session):
+    return os.path.join(archive_dir, oven_name, session + SUFFIX)
+
+
+# Min and max of a column, leaving out NaN; None for an empty column
+def column_range(values):
+    values = [value for value in values if not math.isnan(value)]
+    if not values:
+        return None, None
+    return min(values), max(values)
+
+
+# Appends readings to a session archive. Rows are buffered per column and
+# written out as a row group once group_rows have built up or the group is
+# flush_interval seconds old when the next readings come in. Each group is
+# fsynced on a sync thread, so append() doesn't wait for the disk on the
+# engine's event loop.
+class ArchiveWriter:
+    def __init__(self, path, oven_name, session, group_rows=4096, flush_interval=30.0, labels=None, fields=FIELDS):
+        self.path = path
+        self.fields = fields
+        self.column_types = archive_columns(fields)
+        self.group_rows = group_rows
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'ab')
+        self.syncer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-sync")
+        if self.file.tell() == 0:
+            header = json.dumps({"oven": oven_name, "session": session, "created": time.time(),
+                                 "byteorder": sys.byteorder, "columns": self.column_types}).encode('utf-8')
+            self.file.write(MAGIC + LENGTH.pack(len(header)) + header)
+        self._new_group()
+        self.rows = 0
+        self.groups = 0
+        self.bytes_written = 0
+        labels = labels or {}
+        REGISTRY.counter_function("archive_rows_total", "Readings written to the session archive", lambda: self.rows, **labels)
+        REGISTRY.counter_function("archive_groups_total", "Row groups written to the session archive", lambda: self.groups, **labels)
+        REGISTRY.counter_function("archive_bytes_written_total", "Bytes written to the session archive", lambda: self.bytes_written, **labels)
+
+    def _new_group(self):
+        self.columns = {name: array(typecode) for name, typecode in self.column_types}
+        self.boards = {}
+        self.group_started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Buffer a batch of BoardRecords; readings without a log timestamp get
+    # the time they were archived
+    def append(self, records, now=None):
+        if not records:
+            return
+        now = time.time() if now is None else now
+        while records:
+            room = self.group_rows - len(self.columns["timestamp"])
+            self._buffer(records[:room], now)
+            records = records[room:]
+            if len(self.columns["timestamp"]) >= self.group_rows:
+                self.flush()
+        if time.monotonic() - self.group_started >= self.flush_interval:
+            self.flush()
+
+    def _buffer(self, records, now):
+        columns = self.columns
+        timestamps, boards, failed = columns["timestamp"], columns["board"], columns["failed"]
+        fields = [(key, columns[key].append) for key in self.fields]
+        bits = {key: 1 << i for i, key in enumerate(self.fields)}
+        for record in records:
+            timestamps.append(now if math.isnan(record.timestamp) else record.timestamp)
+            code = self.boards.get(record.board)
+            if code is None:
+                code = self.boards[record.board] = len(self.boards)
+            boards.append(code)
+            values = record.values
+            for key, append in fields:
+                append(values.get(key, math.nan))
+            mask = 0
+            for key in record.failed:
+                mask |= bits.get(key, 0)
+            failed.append(mask)
+
+    # Write the buffered rows out as one row group
+    def flush(self):
+        rows = len(self.columns["timestamp"])
+        if not rows:
+            return
+        data = []
+        footer = {"boards": list(self.boards), "columns": {}}
+        offset = 0
+        for name, typecode in self.column_types:
+            column = self.columns[name]
+            chunk = column.tobytes()
+            if typecode in "df":
+                low, high = column_range(column)
+            else:
+                low, high = min(column), max(column)
+            footer["columns"][name] = {"offset": offset, "min": low, "max": high, "crc": zlib.crc32(chunk)}
+            data.append(chunk)
+            offset += len(chunk)
+        footer = json.dumps(footer).encode('utf-8')
+        group = b"".join([GROUP_HEADER.pack(GROUP_MAGIC, rows, offset, len(footer))] + data + [footer, LENGTH.pack(zlib.crc32(footer))])
+        self.file.write(group)
+        self.file.flush()
+        self.syncer.submit(self._fsync, self.file)
+        self.rows += rows
+        self.groups += 1
+        self.bytes_written += len(group)
+        self._new_group()
+
+    # Runs on the sync thread, where an error would otherwise go unseen
+    def _fsync(self, file, close=False):
+        try:
+            os.fsync(file.fileno())
+        except OSError as e:
+            log.warning("Could not sync %s: %s", self.path, e)
+        if close:
+            file.close()
+
+    # Waits for the sync thread, so the archive is on disk once this returns
+    def close(self):
+        if self.file:
+            self.flush()
+            self.syncer.submit(self._fsync, self.file, True)
+            self.syncer.shutdown(wait=True)
+            self.file = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "rows": self.rows,
+            "groups": self.groups,
+            "bytes_written": self.bytes_written
+        }
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# Reads a session archive. Opening it walks the row group headers and
+# footers only; read() then seeks to the columns it was asked for in the
+# groups whose timestamp range overlaps the query.
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self._read_header()
+            self.groups = list(self._read_groups())
+        except Exception:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def _read_header(self):
+        start = self.file.read(len(MAGIC) + LENGTH.size)
+        if len(start) < len(MAGIC) + LENGTH.size or not start.startswith(MAGIC):
+            raise ArchiveError(f"{self.path} is not a session archive")
+        (length,) = LENGTH.unpack_from(start, len(MAGIC))
+        self.header = json.loads(self.file.read(length))
+        self.typecodes = dict(self.header["columns"])
+        self.swap = self.header["byteorder"] != sys.byteorder
+
+    # Yield (rows, data offset, footer) per intact row group, stopping at a
+    # torn or corrupt one
+    def _read_groups(self):
+        size = os.fstat(self.file.fileno()).st_size
+        pos = self.file.tell()
+        while pos + GROUP_HEADER.size <= size:
+            self.file.seek(pos)
+            magic, rows, data_bytes, footer_bytes = GROUP_HEADER.unpack(self.file.read(GROUP_HEADER.size))
+            end = pos + GROUP_HEADER.size + data_bytes + footer_bytes + LENGTH.size
+            if magic != GROUP_MAGIC or end > size:
+                log.warning("%s: torn row group at byte %d, ignoring the rest", self.path, pos)
+                return
+            self.file.seek(pos + GROUP_HEADER.size + data_bytes)
+            footer = self.file.read(footer_bytes)
+            (crc,) = LENGTH.unpack(self.file.read(LENGTH.size))
+            if crc != zlib.crc32(footer):
+                log.warning("%s: corrupt row group footer at byte %d, ignoring the rest", self.path, pos)
+                return
+            yield rows, pos + GROUP_HEADER.size, json.loads(footer)
+            pos = end
+
+    @property
+    def rows(self):
+        return sum(rows for rows, _, _ in self.groups)
+
+    def _read_column(self, name, rows, data_offset, footer):
+        typecode = self.typecodes[name]
+        info = footer["columns"][name]
+        self.file.seek(data_offset + info["offset"])
+        chunk = self.file.read(rows * array(typecode).itemsize)
+        if zlib.crc32(chunk) != info["crc"]:
+            raise ArchiveError(f"{self.path}: column {name} failed its CRC check")
+        column = array(typecode, chunk)
+        if self.swap:
+            column.byteswap()
+        return column
+
+    # Read columns (all by default) for the rows with start <= timestamp < end,
+    # optionally only for the given boards. Returns {name: list}, with the
+    # board column as board names.
+    def read(self, columns=None, start=None, end=None, boards=None):
+        columns = list(columns or self.typecodes)
+        for name in columns:
+            if name not in self.typecodes:
+                raise ArchiveError(f"Unknown column {name!r}, expected one of {', '.join(self.typecodes)}")
+        boards = set(boards) if boards else None
+        result = {name: [] for name in columns}
+        for rows, data_offset, footer in self.groups:
+            times = footer["columns"]["timestamp"]
+            if start is not None and times["max"] is not None and times["max"] < start:
+                continue
+            if end is not None and times["min"] is not None and times["min"] >= end:
+                continue
+            if boards is not None and not boards.intersection(footer["boards"]):
+                continue
+
+            needed = set(columns)
+            if start is not None or end is not None:
+                needed.add("timestamp")
+            if boards is not None:
+                needed.add("board")
+            data = {name: self._read_column(name, rows, data_offset, footer) for name in needed}
+            if "board" in data:
+                names = footer["boards"]
+                data["board"] = [names[code] for code in data["board"]]
+
+            keep = range(rows)
+            if start is not None or end is not None:
+                timestamps = data["timestamp"]
+                keep = [i for i in keep if (start is None or timestamps[i] >= start) and (end is None or timestamps[i] < end)]
+            if boards is not None:
+                keep = [i for i in keep if data["board"][i] in boards]
+            for name in columns:
+                column = data[name]
+                result[name].extend(column if len(keep) == rows else [column[i] for i in keep])
+        return result
+
+    # Per-column min/max over the whole file, from the group footers
+    def summary(self):
+        ranges = {}
+        for name, typecode in self.header["columns"]:
+            if name == "board":
+                continue
+            lows = [footer["columns"][name]["min"] for _, _, footer in self.groups]
+            highs = [footer["columns"][name]["max"] for _, _, footer in self.groups]
+            lows = [value for value in lows if value is not None]
+            highs = [value for value in highs if value is not None]
+            ranges[name] = (min(lows) if lows else None, max(highs) if highs else None)
+        boards = sorted({board for _, _, footer in self.groups for board in footer["boards"]})
+        return {"oven": self.header["oven"], "session": self.header["session"], "rows": self.rows,
+                "groups": len(self.groups), "boards": boards, "ranges": ranges}
+
+
+# "2024-06-25 13:20:00" (local time) or epoch seconds
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Inspect and export session archives written by the transmitter.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="Show the sessions, rows and column ranges of archive files")
+    info.add_argument("paths", nargs="+")
+    export = commands.add_parser("export", help="Write rows of an archive as CSV")
+    export.add_argument("path")
+    export.add_argument("--columns", help="Comma separated columns to export (default: all)")
+    export.add_argument("--start", type=parse_time, help="First time to export, epoch seconds or YYYY-MM-DD HH:MM:SS")
+    export.add_argument("--end", type=parse_time, help="Export up to (not including) this time")
+    export.add_argument("--board", action="append", help="Only this board (can be repeated)")
+    export.add_argument("--output", help="CSV file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "info":
+            for path in args.paths:
+                with ArchiveReader(path) as reader:
+                    summary = reader.summary()
+                print(f"{path}: oven {summary['oven']}, session {summary['session']}, {summary['rows']} row(s) in {summary['groups']} group(s)")
+                print(f"  boards: {' '.join(summary['boards'])}")
+                for name, (low, high) in summary["ranges"].items():
+                    print(f"  {name:<10} min {low}  max {high}")
+            return 0
+
+        columns = args.columns.split(",") if args.columns else None
+        with ArchiveReader(args.path) as reader:
+            data = reader.read(columns, args.start, args.end, args.board)
+    except (OSError, ArchiveError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(list(data))
+        writer.writerows(zip(*data.values()))
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
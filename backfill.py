@@ -0,0 +1,217 @@
+import argparse
+import logging
+import math
+import mmap
+import os
+import sys
+import time
+
+from logparser import LogParser
+from merge import SnapshotBuilder, merge_streams
+from tailer import LOG_EXTENSIONS
+
+log = logging.getLogger(__name__)
+
+# How much of a mapped file is parsed at a time; memory use stays around this
+BLOCK_SIZE = 1 << 20
+
+# Smaller blocks when merging, as every file has one block parsed at a time
+MERGE_BLOCK_SIZE = 64 << 10
+
+# Upper bound on waiting for the transmitter to reply to a command
+COMMAND_TIMEOUT = 30
+
+# Upper bound on waiting for the last rows to be acknowledged at the end; at
+# 9600 baud a full uplink queue takes well under a minute
+DRAIN_TIMEOUT = 120
+
+
+# Yield the contents of path in blocks of roughly block_size bytes, each
+# ending on a line boundary, straight out of a read-only memory map
+def iter_mapped_blocks(path, block_size=BLOCK_SIZE):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            size = len(mapped)
+            while start < size:
+                end = min(start + block_size, size)
+                if end < size:
+                    newline = mapped.rfind(b"\n", start, end)
+                    if newline < 0:
+                        # A single line longer than a block, take all of it
+                        newline = mapped.find(b"\n", end)
+                        end = size if newline < 0 else newline + 1
+                    else:
+                        end = newline + 1
+                yield mapped[start:end]
+                start = end
+
+
+# Sleeps so that rows come out at `speed` times the rate they were logged.
+# speed=None replays as fast as possible.
+class ReplayClock:
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.first_timestamp = None
+        self.started = None
+
+    def wait_for(self, timestamp):
+        if not self.speed or math.isnan(timestamp):
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+            self.started = time.monotonic()
+            return
+        due = self.started + (timestamp - self.first_timestamp) / self.speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Replay one historical log file, calling emit(record) with a BoardRecord
+# for every row
+def backfill_file(path, sequence, is_treebeard, emit, speed=1.0, block_size=BLOCK_SIZE):
+    clock = ReplayClock(speed)
+    count = 0
+    for record in iter_file_records(path, sequence, is_treebeard, block_size):
+        clock.wait_for(record.timestamp)
+        emit(record)
+        count += 1
+    return count
+
+
+# Yield the BoardRecords of one log file in order, a block at a time
+def iter_file_records(path, sequence, is_treebeard, block_size=BLOCK_SIZE):
+    parser = LogParser(os.path.basename(path), sequence, is_treebeard)
+    for data in iter_mapped_blocks(path, block_size):
+        yield from parser.parse_bytes(data).to_records()
+
+
+# Replay several log files as one time-ordered stream. With snapshot_period
+# set, emit_snapshot(snapshot) is also called with each rack snapshot.
+def backfill_merged(paths, sequence, is_treebeard, emit, speed=1.0, snapshot_period=0.0, emit_snapshot=None):
+    clock = ReplayClock(speed)
+    snapshots = SnapshotBuilder(snapshot_period) if snapshot_period and emit_snapshot else None
+    count = 0
+    for record in merge_streams([iter_file_records(path, sequence, is_treebeard, MERGE_BLOCK_SIZE) for path in paths]):
+        clock.wait_for(record.timestamp)
+        emit(record)
+        count += 1
+        if snapshots:
+            snapshot = snapshots.add(record)
+            if snapshot:
+                emit_snapshot(snapshot)
+    if snapshots:
+        snapshot = snapshots.flush()
+        if snapshot:
+            emit_snapshot(snapshot)
+    return count
+
+
+# Replay a single file or every log file in a folder, one file after another
+# or (merge) all of them together in time order
+def backfill(path, sequence, is_treebeard, emit, speed=1.0, merge=False, snapshot_period=0.0, emit_snapshot=None):
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(LOG_EXTENSIONS))
+    else:
+        paths = [path]
+
+    if merge:
+        started = time.monotonic()
+        total = backfill_merged(paths, sequence, is_treebeard, emit, speed, snapshot_period, emit_snapshot)
+        log.info("Backfilled %d rows from %d file(s) in %.1f s", total, len(paths), time.monotonic() - started)
+        return total
+
+    total = 0
+    for file_path in paths:
+        started = time.monotonic()
+        count = backfill_file(file_path, sequence, is_treebeard, emit, speed)
+        total += count
+        log.info("Backfilled %d rows from %s in %.1f s", count, file_path, time.monotonic() - started)
+    return total
+
+
+def parse_speed(value):
+    if value.lower() in ("max", "0"):
+        return None
+    return float(value.rstrip("xX"))
+
+
+# Command line entry point, used by "Transmitter.py backfill ..."
+def main(argv, config):
+    board_data = config["board_data"]
+    arg_parser = argparse.ArgumentParser(prog="Transmitter backfill", description="Replay historical Modbus/Treebeard log files")
+    arg_parser.add_argument("path", help="log file or folder of log files to replay")
+    arg_parser.add_argument("--speed", type=parse_speed, default=1.0, help="replay speed-up, e.g. 1, 100 or max (default: 1)")
+    arg_parser.add_argument("--port", help="send the rows to the transmitter on this serial port instead of printing them")
+    arg_parser.add_argument("--oven", help="with --port, the oven name to connect to the transmitter as")
+    arg_parser.add_argument("--sequence", default=board_data["sequence"], help="field sequence for normal Modbus logs")
+    arg_parser.add_argument("--treebeard", action=argparse.BooleanOptionalAction, default=board_data["is_treebeard"], help="files are in the Treebeard layout (default: from the config)")
+    arg_parser.add_argument("--merge", action="store_true", help="replay all the files together in time order instead of one after another")
+    arg_parser.add_argument("--snapshot-period", type=float, default=0.0, help="with --merge, also show rack snapshots of the boards sampled within this many seconds")
+    args = arg_parser.parse_args(argv)
+    if args.port and not args.oven:
+        arg_parser.error("--port needs --oven")
+
+    engine = connect_transmitter(args.port, args.oven, config) if args.port else None
+    if engine:
+        # Every row goes through the spool and the paced uplink like live
+        # data; without a key nothing is coalesced away
+        def emit(record):
+            engine.send_threadsafe(record)
+    else:
+        def emit(record):
+            print(record.message)
+
+    # Snapshots aren't something the transmitter understands, so they are
+    # only printed or logged
+    def emit_snapshot(snapshot):
+        if engine:
+            log.info("%s", snapshot.message)
+        else:
+            print(snapshot.message)
+
+    try:
+        backfill(args.path, args.sequence, args.treebeard, emit, args.speed, args.merge, args.snapshot_period, emit_snapshot)
+    finally:
+        if engine:
+            disconnect_transmitter(engine)
+
+
+# Connect to the transmitter the way a live session does: CONNECT, the JSON
+# config and ACTIVE. Backfilled rows are spooled apart from the live ones.
+def connect_transmitter(port, oven_name, config):
+    from engine import TransmitterEngine
+    from monitor import TRANSMITTER_ONLY_KEYS
+    from spool import Spool
+
+    json_data = {key: value for key, value in config.items() if key not in TRANSMITTER_ONLY_KEYS}
+    spool = Spool(os.path.join(config["spool_dir"], oven_name, "backfill"))
+    engine = TransmitterEngine(port, protocol=config["uplink_protocol"], spool=spool, labels={"oven": oven_name})
+    engine.start()
+    try:
+        engine.run(engine.connect(oven_name, json_data), COMMAND_TIMEOUT)
+        engine.run(engine.activate(), COMMAND_TIMEOUT)
+    except Exception:
+        engine.stop()
+        raise
+    return engine
+
+
+# Wait (up to DRAIN_TIMEOUT) for everything queued to be acknowledged, then
+# idle and disconnect. Rows still unacknowledged stay in the backfill spool
+# and go out first the next time this oven is backfilled.
+def disconnect_transmitter(engine):
+    try:
+        engine.run(engine.uplink.drain(timeout=DRAIN_TIMEOUT), DRAIN_TIMEOUT + COMMAND_TIMEOUT)
+        engine.run(engine.idle(), COMMAND_TIMEOUT)
+        engine.run(engine.disconnect(), COMMAND_TIMEOUT)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+    finally:
+        unacked = len(engine.spool.outstanding)
+        engine.stop()
+        if unacked:
+            print(f"Warning: {unacked} row(s) not acknowledged by the transmitter, kept in {engine.spool.directory}", file=sys.stderr)
@@ -0,0 +1,536 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import metrics
+import protocol
+from burnsys import crc16
+from burnsysTest import create_custom_binary_data, generate_fake_data
+from engine import LoopThread, READY_LINE
+from logparser import TREEBEARD_POSITIONS
+from metrics import Histogram, REGISTRY
+from monitor import OvenMonitor, load_config, save_config
+from timestamps import LOCAL, now_ms
+
+try:
+    import pty
+    import tty
+except ImportError:  # Windows
+    pty = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# Hardware-free benchmark of the acquisition and uplink pipeline. Every oven
+# gets an emulated ESP32 bridge on a pseudo-terminal, and its boards are
+# either a folder of synthetic Modbus/Treebeard logs (in the data.txt format)
+# or a Burnsys feeder writing frames built by burnsysTest.py to a second
+# pseudo-terminal. The real OvenMonitor, parsers, spool and uplink run in
+# between, so the numbers show what the code does on this machine.
+#
+#   python bench.py --boards 16 --rate 1 --duration 30
+#   python bench.py --source burnsys --boards 8 --rate 2
+#   python bench.py --ovens 4 --baud 0 --json run.json --baseline last.json
+#
+# --baud 0 lets the emulated bridge drain as fast as it can, which takes the
+# 9600 baud link out of the picture and measures the Python side alone.
+#
+# Each reading carries a sample number in its Ct field, so the bridge can
+# match what it receives to when the reading was written and report end to
+# end latency. Readings the uplink coalesced away never arrive and are
+# reported as dropped.
+
+# Ct goes over the binary uplink as a signed 16-bit tenth, so sample numbers wrap below that
+SAMPLE_KEYS = 3000
+
+# Latency percentiles in the report
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+# Tracks when each sample was written and how long it took to reach the bridge
+class LatencyTracker:
+    def __init__(self):
+        self.written = {}
+        self.lock = threading.Lock()
+        self.histogram = Histogram("bench_end_to_end_seconds", "Sample written to sample received by the bridge", ())
+        self.generated = 0
+        self.received = 0
+        self.unmatched = 0
+
+    def next_sample(self):
+        with self.lock:
+            sample = self.generated % SAMPLE_KEYS
+            self.generated += 1
+            self.written[sample] = time.monotonic()
+            return sample
+
+    def receive(self, sample):
+        now = time.monotonic()
+        with self.lock:
+            written = self.written.pop(sample, None)
+            if written is None:
+                self.unmatched += 1
+                return
+            self.received += 1
+            self.histogram.observe(now - written)
+
+
+# A pseudo-terminal pair in raw mode; the pipeline opens `port`, the
+# emulator reads and writes the master side
+class VirtualPort:
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+# Emulates ArduinoCode.ino on a pseudo-terminal: echoes every line, answers
+# the lifecycle commands and prints board lines a second time once "sent".
+# With binary=True it also accepts BIN1 frames and acknowledges them with
+# "ACK <seq>". baudrate throttles how fast it drains the link (0: no limit).
+class VirtualBridge:
+    def __init__(self, tracker, baudrate=9600, binary=False):
+        self.tracker = tracker
+        self.baudrate = baudrate
+        self.binary = binary
+        self.port = VirtualPort()
+        self.oven_name = ""
+        self.bytes_received = 0
+        self.lines_received = 0
+        self.frames_received = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="bench-bridge", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.closed = True
+        self.port.close()
+
+    def out(self, text):
+        os.write(self.port.master, (text + "\r\n").encode('utf-8'))
+
+    def _run(self):
+        self.out(READY_LINE)
+        buffer = bytearray()
+        while not self.closed:
+            try:
+                data = os.read(self.port.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            self.bytes_received += len(data)
+            if self.baudrate:
+                # 10 bits per byte on the wire
+                time.sleep(len(data) * 10 / self.baudrate)
+            buffer += data
+            try:
+                self._handle(buffer)
+            except OSError:
+                return
+
+    def _handle(self, buffer):
+        while buffer:
+            if buffer.startswith(protocol.SYNC):
+                header_size = protocol.HEADER.size
+                if len(buffer) < header_size:
+                    return
+                end = header_size + buffer[header_size - 1] + 2
+                if len(buffer) < end:
+                    return
+                frame = bytes(buffer[:end])
+                del buffer[:end]
+                self._handle_frame(frame)
+                continue
+            end = buffer.find(b"\n")
+            if end < 0:
+                return
+            line = buffer[:end].decode('utf-8', errors='replace').strip()
+            del buffer[:end + 1]
+            if line:
+                self._handle_line(line)
+
+    def _handle_frame(self, frame):
+        try:
+            seq, _, values = protocol.decode_frame(frame)
+        except protocol.ProtocolError as e:
+            self.out(f"Bad frame: {e}")
+            return
+        self.frames_received += 1
+        self.out(f"{protocol.ACK_PREFIX}{seq}")
+        if "Ct" in values:
+            self.tracker.receive(round(values["Ct"]))
+
+    def _handle_line(self, line):
+        self.lines_received += 1
+        self.out(line)
+        if line.startswith("Board:"):
+            self.out("Sent board data: {}")
+            self.out(line)
+            for field in line.split():
+                if field.startswith("Ct:"):
+                    try:
+                        self.tracker.receive(round(float(field[3:])))
+                    except ValueError:
+                        pass
+        elif line.startswith("JSON:"):
+            self.out("Starting JSON deserialization...")
+            self.out("Finished JSON deserialization.")
+        elif line.startswith("CONNECT "):
+            self.oven_name = line[len("CONNECT "):]
+            self.out("Connecting to WebSocket server...")
+            self.out(f"Sent CONNECT message: {json.dumps({'type': 'identify', 'ovenId': self.oven_name})}")
+        elif line in ("ACTIVE", "IDLE") and self.oven_name:
+            self.out(f"Sent message: {json.dumps({'type': 'ovenActive', 'ovenId': self.oven_name})}")
+        elif line == "DISCONNECT":
+            self.out("Disconnecting from WebSocket server...")
+            self.oven_name = ""
+        elif line == protocol.NEGOTIATE_COMMAND and self.binary:
+            self.out(protocol.NEGOTIATE_OK)
+        else:
+            self.out(f"Invalid command received or oven name not set: {line}")
+
+
+# One synthetic reading from burnsysTest.generate_fake_data(), in engineering
+# units, with the sample number in Ct
+def fake_reading(sample):
+    raw = generate_fake_data()
+    values = {key: raw[key] / scale for key, scale in zip(protocol.FIELDS, protocol.SCALES)}
+    values["Ct"] = sample
+    return values
+
+
+# A data.txt style row: "<date> <time> <00000>" and the values in sequence order
+def format_modbus_line(values, sequence):
+    return f"{LOCAL.format(now_ms())} <00000> " + "".join(f"{values[key]:>16.6g}" for key in sequence) + "\n"
+
+
+# A Treebeard row: 56 columns with the fields at TREEBEARD_POSITIONS
+def format_treebeard_line(values):
+    columns = ["0"] * (max(TREEBEARD_POSITIONS.values()) + 6)
+    columns[0], columns[1] = LOCAL.format(now_ms()).split()
+    for key, position in TREEBEARD_POSITIONS.items():
+        columns[position] = f"{values[key]:.6g}"
+    return " ".join(columns) + "\n"
+
+
+# Writes boards x rate readings per second, spread evenly over each second
+class BoardFeeder:
+    def __init__(self, tracker, boards, rate):
+        self.tracker = tracker
+        self.boards = boards
+        self.rate = rate
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="bench-feeder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self):
+        interval = 1.0 / (self.boards * self.rate)
+        next_time = time.monotonic()
+        board = 0
+        while not self.stopping.is_set():
+            self.write(board, fake_reading(self.tracker.next_sample()))
+            board = (board + 1) % self.boards
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                self.stopping.wait(delay)
+
+    def write(self, board, values):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# Appends rows to one log file per board in a synthetic Modbus folder
+class ModbusFeeder(BoardFeeder):
+    def __init__(self, tracker, boards, rate, folder_path, sequence, is_treebeard=False):
+        super().__init__(tracker, boards, rate)
+        self.sequence = sequence.split()
+        self.is_treebeard = is_treebeard
+        self.files = []
+        for board in range(1, boards + 1):
+            name = f"Lot_{board:02}_Bench.txt" if is_treebeard else f"Board{board:02}.txt"
+            self.files.append(open(os.path.join(folder_path, name), 'a'))
+
+    def write(self, board, values):
+        file = self.files[board]
+        file.write(format_treebeard_line(values) if self.is_treebeard else format_modbus_line(values, self.sequence))
+        file.flush()
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+
+# Writes Burnsys E6 frames from burnsysTest.py to a pseudo-terminal that the
+# pipeline opens as its COM port, one slave address per board
+class BurnsysFeeder(BoardFeeder):
+    def __init__(self, tracker, boards, rate):
+        super().__init__(tracker, boards, rate)
+        self.port = VirtualPort()
+
+    def write(self, board, values):
+        raw = {key: int(round(values[key] * scale)) for key, scale in zip(protocol.FIELDS, protocol.SCALES)}
+        frame = create_custom_binary_data(raw)
+        frame[0] = board + 1
+        # Address changed, so redo the CRC
+        frame[-2:] = crc16(frame[:-2]).to_bytes(2, byteorder='little')
+        os.write(self.port.master, frame)
+
+    def close(self):
+        self.port.close()
+
+
+# One emulated oven: bridge, board feeder and the real OvenMonitor
+class BenchOven:
+    def __init__(self, name, workdir, args, loop):
+        self.name = name
+        self.tracker = LatencyTracker()
+        self.bridge = VirtualBridge(self.tracker, args.baud, binary=args.protocol == "binary")
+        oven_dir = os.path.join(workdir, name)
+        os.makedirs(oven_dir)
+
+        config_file = os.path.join(oven_dir, "oven_config.json")
+        config = load_config(config_file)
+        config["log_board_data"] = True
+        config["transmitter_com"] = self.bridge.port.port
+        config["uplink_protocol"] = args.protocol
+        config["spool_dir"] = os.path.join(oven_dir, "spool")
+        config["archive_dir"] = os.path.join(oven_dir, "archive")
+        config["index_dir"] = os.path.join(oven_dir, "index")
+        config["parse_workers"] = args.parse_workers
+        board_data = config["board_data"]
+        if args.source == "burnsys":
+            self.feeder = BurnsysFeeder(self.tracker, args.boards, args.rate)
+            board_data["modbus_burnsys"] = "Burnsys"
+            board_data["com_port"] = self.feeder.port.port
+        else:
+            folder_path = os.path.join(oven_dir, "logs")
+            os.makedirs(folder_path)
+            self.feeder = ModbusFeeder(self.tracker, args.boards, args.rate, folder_path, board_data["sequence"], args.source == "treebeard")
+            board_data["modbus_burnsys"] = "Modbus"
+            board_data["is_treebeard"] = args.source == "treebeard"
+            board_data["folder_path"] = folder_path
+        save_config(config, config_file)
+        self.monitor = OvenMonitor(config, config_file, loop=loop)
+
+    def start(self):
+        self.bridge.start()
+        self.monitor.establish_connection(self.name)
+        self.monitor.start_active_session()
+        if isinstance(self.feeder, BurnsysFeeder):
+            # Opening the port flushes its input, so wait for that before feeding
+            deadline = time.monotonic() + 5
+            while not self.burnsys_connected() and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+    def stop(self):
+        if self.monitor.connected:
+            self.monitor.end_connection()
+        self.feeder.close()
+        self.bridge.stop()
+
+    def burnsys_connected(self):
+        metric = REGISTRY.metrics.get(("burnsys_connected", (("oven", self.name),)))
+        return bool(metric and metric.value)
+
+    def drained(self):
+        return self.tracker.received + self.coalesced() >= self.tracker.generated
+
+    def coalesced(self):
+        engine = self.monitor.engine
+        return engine.uplink.coalesced if engine else 0
+
+    def result(self):
+        tracker = self.tracker
+        stats = self.monitor.status()
+        return {
+            "oven": self.name,
+            "generated": tracker.generated,
+            "received": tracker.received,
+            "dropped": tracker.generated - tracker.received,
+            "coalesced": stats.get("uplink", {}).get("coalesced", 0),
+            "ack_timeouts": stats.get("uplink", {}).get("ack_timeouts", 0),
+            "bridge_bytes": self.bridge.bytes_received
+        }
+
+
+def stage_percentiles(name):
+    merged = None
+    for metric in list(REGISTRY.metrics.values()):
+        if metric.name == name and isinstance(metric, Histogram):
+            if merged is None:
+                merged = Histogram(name, metric.help, ())
+            merged.counts = [a + b for a, b in zip(merged.counts, metric.counts)]
+            merged.count += metric.count
+    if merged is None or not merged.count:
+        return None
+    return {f"p{quantile * 100:g}": round(value, 6) for quantile, value in merged.percentiles(QUANTILES).items()}
+
+
+def memory_usage():
+    usage = {}
+    if resource:
+        usage["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/statm") as file:
+            usage["rss_kb"] = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    loop = LoopThread("bench-loop")
+    loop.start()
+    ovens = [BenchOven(f"Bench{index + 1:02}", workdir, args, loop) for index in range(args.ovens)]
+    try:
+        for oven in ovens:
+            oven.start()
+
+        log.info("Feeding %d oven(s) x %d board(s) at %g reading(s)/s for %gs", args.ovens, args.boards, args.rate, args.duration)
+        cpu_started = time.process_time()
+        started = time.monotonic()
+        for oven in ovens:
+            oven.feeder.start()
+        time.sleep(args.duration)
+        for oven in ovens:
+            oven.feeder.stop()
+
+        # Give the uplink a moment to deliver what is still queued
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline and not all(oven.drained() for oven in ovens):
+            time.sleep(0.1)
+        elapsed = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+        results = [oven.result() for oven in ovens]
+    finally:
+        for oven in ovens:
+            oven.stop()
+        loop.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latency = Histogram("bench_end_to_end_seconds", "", ())
+    for oven in ovens:
+        latency.counts = [a + b for a, b in zip(latency.counts, oven.tracker.histogram.counts)]
+        latency.count += oven.tracker.histogram.count
+    generated = sum(result["generated"] for result in results)
+    received = sum(result["received"] for result in results)
+    return {
+        "source": args.source,
+        "protocol": args.protocol,
+        "ovens": args.ovens,
+        "boards": args.boards,
+        "rate": args.rate,
+        "baud": args.baud,
+        "duration": round(elapsed, 3),
+        "generated": generated,
+        "received": received,
+        "dropped": generated - received,
+        "throughput": round(received / elapsed, 1) if elapsed else 0.0,
+        "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+        "latency": {f"p{quantile * 100:g}": round(value, 6) for quantile, value in latency.percentiles(QUANTILES).items()},
+        "stages": {name: stage_percentiles(name) for name in
+                   ("tailer_detect_seconds", "parse_batch_seconds", "uplink_queue_seconds", "uplink_ack_seconds", "uplink_record_seconds")},
+        "memory": memory_usage(),
+        "ovens_detail": results
+    }
+
+
+# Compare against an earlier run; returns a list of regressions
+def compare(result, baseline, tolerance):
+    regressions = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput']} < {baseline['throughput']} readings/s")
+    for key in ("p50", "p99"):
+        now, before = result["latency"][key], baseline["latency"][key]
+        if before and now > before * (1 + tolerance):
+            regressions.append(f"{key} latency {now * 1000:.1f} ms > {before * 1000:.1f} ms")
+    return regressions
+
+
+def print_report(result):
+    print(f"{result['ovens']} oven(s) x {result['boards']} board(s) at {result['rate']}/s, "
+          f"{result['source']} source, {result['protocol']} uplink, baud {result['baud'] or 'unlimited'}")
+    print(f"  readings:   {result['generated']} generated, {result['received']} received, {result['dropped']} dropped")
+    print(f"  throughput: {result['throughput']} readings/s over {result['duration']}s, CPU {result['cpu_percent']}%")
+    print("  latency:    " + "  ".join(f"{key} {value * 1000:.1f} ms" for key, value in result["latency"].items()))
+    for name, percentiles in result["stages"].items():
+        if percentiles:
+            print(f"    {name:<24}" + "  ".join(f"{key} {value * 1000:.2f} ms" for key, value in percentiles.items()))
+    print("  memory:     " + "  ".join(f"{key} {value}" for key, value in result["memory"].items()))
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog="bench.py", description="Benchmark the pipeline against emulated boards and bridges")
+    arg_parser.add_argument("--source", choices=("modbus", "treebeard", "burnsys"), default="modbus", help="board data source (default: modbus)")
+    arg_parser.add_argument("--ovens", type=int, default=1, help="ovens sharing one event loop (default: 1)")
+    arg_parser.add_argument("--boards", type=int, default=8, help="boards per oven (default: 8)")
+    arg_parser.add_argument("--rate", type=float, default=1.0, help="readings per second per board (default: 1)")
+    arg_parser.add_argument("--duration", type=float, default=20.0, help="seconds to feed readings (default: 20)")
+    arg_parser.add_argument("--drain", type=float, default=10.0, help="seconds to wait for queued readings afterwards (default: 10)")
+    arg_parser.add_argument("--baud", type=int, default=9600, help="emulated bridge drain rate, 0 for unlimited (default: 9600)")
+    arg_parser.add_argument("--protocol", choices=("ascii", "binary"), default="ascii", help="uplink protocol (default: ascii)")
+    arg_parser.add_argument("--parse-workers", type=int, default=0, help="parser processes per oven (default: 0)")
+    arg_parser.add_argument("--seed", type=int, help="seed the synthetic readings")
+    arg_parser.add_argument("--json", default="", help="write the results to this file")
+    arg_parser.add_argument("--baseline", default="", help="fail if worse than the results in this file")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against --baseline (default: 0.2)")
+    arg_parser.add_argument("--log-level", default="WARNING", help="DEBUG, INFO, WARNING or ERROR (default: WARNING)")
+    args = arg_parser.parse_args(argv)
+    metrics.setup_logging(args.log_level)
+
+    if pty is None:
+        print("The benchmark needs pseudo-terminals (Linux or macOS)")
+        return 1
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import serial
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# Modbus function codes the Burnsys cards answer with
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+SUPPORTED_FUNCTIONS = (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS)
+EXCEPTION_FLAG = 0x80
+
+# address + function + byte count, and the two CRC bytes at the end
+HEADER_SIZE = 3
+CRC_SIZE = 2
+MAX_BYTE_COUNT = 250
+
+# The first 8 registers of an E6 card frame and how to scale them
+E6_FIELDS = ("P1", "P2", "T1", "T2", "Vx", "Vz", "Ct", "Vt")
+E6_SCALES = (10, 10, 10, 10, 1000, 1000, 10, 10)
+E6_LAYOUT = struct.Struct(">8H")
+
+# A decoded Modbus-RTU response. payload is the register block (without the
+# byte count and CRC), raw is the whole frame as received. received (epoch
+# seconds) and captured (time.monotonic()) are when its last byte was read.
+Frame = namedtuple("Frame", ["address", "function", "payload", "raw", "received", "captured"], defaults=(float("nan"), float("nan")))
+
+
+def _make_crc_table():
+    table = []
+    for value in range(256):
+        crc = value
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _make_crc_table()
+
+
+# CRC-16/MODBUS over data[start:end]
+def crc16(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for i in range(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ data[i]) & 0xFF]
+    return crc
+
+
+# Return the frame with its CRC appended (little endian, as Modbus sends it)
+def with_crc(data):
+    return bytes(data) + crc16(data).to_bytes(2, byteorder='little')
+
+
+def is_e6_frame(frame):
+    return not frame.function & EXCEPTION_FLAG and len(frame.payload) >= E6_LAYOUT.size
+
+
+# Decode the P1..Vt registers of an E6 card frame into engineering units
+def decode_e6(frame):
+    values = E6_LAYOUT.unpack_from(frame.payload, 0)
+    return {key: value / scale for key, value, scale in zip(E6_FIELDS, values, E6_SCALES)}
+
+
+# Streaming Modbus-RTU response decoder. Bytes from the serial port are fed in
+# as they arrive, in whatever chunks the driver hands over; complete frames
+# with a valid CRC come out in order. When the bytes at the head of the buffer
+# aren't a valid frame the decoder drops one byte and tries again (a resync).
+class FrameDecoder:
+    def __init__(self, max_buffer=4096):
+        self.buffer = bytearray()
+        self.start = 0
+        self.max_buffer = max_buffer
+        self.frames = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+        self.bytes_discarded = 0
+
+    @property
+    def pending(self):
+        return len(self.buffer) - self.start
+
+    # Length of the frame starting at pos, 0 if we need more bytes to tell,
+    # or -1 if this can't be the start of a frame
+    def _frame_length(self, pos):
+        buffer = self.buffer
+        available = len(buffer) - pos
+        if available < HEADER_SIZE:
+            return 0
+        address = buffer[pos]
+        function = buffer[pos + 1]
+        if not 1 <= address <= 247:
+            return -1
+        if function & EXCEPTION_FLAG:
+            if function & ~EXCEPTION_FLAG not in SUPPORTED_FUNCTIONS:
+                return -1
+            # address, function, exception code, CRC
+            return HEADER_SIZE + CRC_SIZE
+        if function not in SUPPORTED_FUNCTIONS:
+            return -1
+        byte_count = buffer[pos + 2]
+        if byte_count == 0 or byte_count % 2 or byte_count > MAX_BYTE_COUNT:
+            return -1
+        return HEADER_SIZE + byte_count + CRC_SIZE
+
+    def _skip(self, count):
+        self.start += count
+        self.bytes_discarded += count
+
+    # Feed newly received bytes and return the list of complete frames
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        buffer = self.buffer
+        while True:
+            length = self._frame_length(self.start)
+            if length == 0:
+                break
+            if length < 0:
+                self.resyncs += 1
+                self._skip(1)
+                continue
+            end = self.start + length
+            if end > len(buffer):
+                break
+            crc = buffer[end - 2] | buffer[end - 1] << 8
+            if crc16(buffer, self.start, end - 2) != crc:
+                self.crc_errors += 1
+                self.resyncs += 1
+                self._skip(1)
+                continue
+            raw = bytes(buffer[self.start:end])
+            if raw[1] & EXCEPTION_FLAG:
+                payload = raw[2:3]
+            else:
+                payload = memoryview(raw)[HEADER_SIZE:length - CRC_SIZE]
+            frames.append(Frame(raw[0], raw[1], payload, raw))
+            self.frames += 1
+            self.start = end
+
+        # Compact the buffer once the consumed part dominates it
+        if self.start and self.start * 2 >= len(buffer):
+            del buffer[:self.start]
+            self.start = 0
+        if len(buffer) > self.max_buffer:
+            self._skip(len(buffer) - self.start - self.max_buffer)
+            del buffer[:self.start]
+            self.start = 0
+        return frames
+
+    # Drop a partial frame that will never be completed (e.g. after a long
+    # silence on the line)
+    def reset(self):
+        if self.pending:
+            self._skip(self.pending)
+        del self.buffer[:]
+        self.start = 0
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "crc_errors": self.crc_errors,
+            "resyncs": self.resyncs,
+            "bytes_discarded": self.bytes_discarded,
+            "pending": self.pending
+        }
+
+
+# Owns the Burnsys COM port for the whole logging session. A reader thread
+# keeps the port open, feeds everything it reads through a FrameDecoder and
+# puts the decoded frames on a queue. If the device goes away the thread
+# closes the port and reconnects with exponential backoff.
+class BurnsysSession:
+    # labels (e.g. {"oven": name}) tag the session's metrics
+    def __init__(self, port, baudrate=9600, read_timeout=0.1, idle_reset=1.0, max_backoff=30.0, queue_size=1000, labels=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.read_timeout = read_timeout
+        self.idle_reset = idle_reset
+        self.max_backoff = max_backoff
+        self.frames = queue.Queue(maxsize=queue_size)
+        # Set up by the first next_frame() call so the reader thread can wake
+        # the consuming event loop
+        self.loop = None
+        self.frame_ready = None
+        self.decoder = FrameDecoder()
+        self.ser = None
+        self.running = False
+        self.thread = None
+        self.connects = 0
+        self.disconnects = 0
+        self.frames_dropped = 0
+        self.bytes_read = 0
+        self._register_metrics(labels or {})
+
+    def _register_metrics(self, labels):
+        decoder = self.decoder
+        REGISTRY.counter_function("burnsys_frames_total", "Burnsys frames decoded with a valid CRC", lambda: decoder.frames, **labels)
+        REGISTRY.counter_function("burnsys_crc_errors_total", "Burnsys frames rejected for a bad CRC", lambda: decoder.crc_errors, **labels)
+        REGISTRY.counter_function("burnsys_resyncs_total", "Times the Burnsys decoder dropped a byte to find the next frame", lambda: decoder.resyncs, **labels)
+        REGISTRY.counter_function("burnsys_bytes_read_total", "Bytes read from the Burnsys COM port", lambda: self.bytes_read, **labels)
+        REGISTRY.counter_function("burnsys_frames_dropped_total", "Frames dropped because the consumer fell behind", lambda: self.frames_dropped, **labels)
+        REGISTRY.gauge_function("burnsys_connected", "1 while the Burnsys COM port is open", lambda: int(self.connected), **labels)
+
+    @property
+    def connected(self):
+        return self.ser is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"burnsys-{self.port}", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        self._close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Next decoded frame, or None if nothing arrived within timeout seconds
+    def get_frame(self, timeout=None):
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # Awaitable get_frame() for code running on an asyncio loop. Waiting
+    # happens on the loop itself, so many sessions can share one loop.
+    async def next_frame(self, timeout=None):
+        if self.loop is None:
+            self.frame_ready = asyncio.Event()
+            self.loop = asyncio.get_running_loop()
+        self.frame_ready.clear()
+        frame = self.get_frame(0)
+        if frame is not None:
+            return frame
+        try:
+            await asyncio.wait_for(self.frame_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.get_frame(0)
+
+    def _open(self):
+        ser = serial.serial_for_url(self.port, self.baudrate, timeout=self.read_timeout)
+        ser.reset_input_buffer()
+        self.ser = ser
+        self.connects += 1
+        log.info("Opened %s", self.port)
+
+    def _close(self):
+        ser, self.ser = self.ser, None
+        if ser is not None:
+            try:
+                ser.close()
+            except serial.SerialException:
+                pass
+
+    def _put(self, frame):
+        # Keep the newest frames if the consumer falls behind
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                break
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.frame_ready.set)
+            except RuntimeError:
+                # The consuming loop has been closed
+                self.loop = None
+
+    def _run(self):
+        backoff = 1.0
+        while self.running:
+            if self.ser is None:
+                try:
+                    self._open()
+                    backoff = 1.0
+                except (serial.SerialException, OSError) as e:
+                    log.warning("Could not open %s: %s, retrying in %.0f s", self.port, e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+
+            last_byte_time = time.monotonic()
+            try:
+                while self.running:
+                    data = self.ser.read(self.ser.in_waiting or 1)
+                    now = time.monotonic()
+                    if data:
+                        self.bytes_read += len(data)
+                        last_byte_time = now
+                        received = time.time()
+                        for frame in self.decoder.feed(data):
+                            self._put(frame._replace(received=received, captured=now))
+                    elif self.decoder.pending and now - last_byte_time > self.idle_reset:
+                        # A frame that stopped half way will never complete
+                        self.decoder.reset()
+            except (serial.SerialException, OSError) as e:
+                log.warning("Lost %s: %s", self.port, e)
+                self.disconnects += 1
+                self.decoder.reset()
+                self._close()
+
+    def stats(self):
+        stats = self.decoder.stats()
+        stats.update({
+            "connected": self.connected,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "frames_dropped": self.frames_dropped,
+            "bytes_read": self.bytes_read,
+            "queued": self.frames.qsize()
+        })
+        return stats
@@ -1,6 +1,7 @@
 import serial
 import time
 import random
+from burnsys import crc16
 
 # Define the COM port and the baud rate (adjust these as needed)
 COM_PORT = 'COM16'  # Replace with your actual COM port
@@ -45,46 +46,54 @@ def create_custom_binary_data(fake_data):
     binary_data[15:17] = fake_data['Ct'].to_bytes(2, byteorder='big')
     binary_data[17:19] = fake_data['Vt'].to_bytes(2, byteorder='big')
 
+    # Recalculate the CRC so the transmitter's frame decoder accepts the frame
+    binary_data[-2:] = crc16(binary_data[:-2]).to_bytes(2, byteorder='little')
+
     return binary_data
 
-# Open the serial port
-try:
-    ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=1)
-    time.sleep(2)  # Wait for the serial connection to establish
+# Send frames to the COM port until interrupted
+def main():
+    ser = None
+    try:
+        ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=1)
+        time.sleep(2)  # Wait for the serial connection to establish
+
+        # Time tracking for sending intervals
+        last_time_5s = time.time()
+        last_time_10s = time.time()
 
-    # Time tracking for sending intervals
-    last_time_5s = time.time()
-    last_time_10s = time.time()
+        while True:
+            current_time = time.time()
 
-    while True:
-        current_time = time.time()
+            # Check if 5 seconds have passed to send the first binary data
+            if current_time - last_time_5s >= 560:
+                ser.write(binary_data_5s)
+                print(f"Sent binary data 5s: {binary_data_5s.hex()}")
+                last_time_5s = current_time
 
-        # Check if 5 seconds have passed to send the first binary data
-        if current_time - last_time_5s >= 560:
-            ser.write(binary_data_5s)
-            print(f"Sent binary data 5s: {binary_data_5s.hex()}")
-            last_time_5s = current_time
+            # Check if 10 seconds have passed to send the custom binary data
+            if current_time - last_time_10s >= 15:
+                # Generate fake data
+                fake_data = generate_fake_data()
 
-        # Check if 10 seconds have passed to send the custom binary data
-        if current_time - last_time_10s >= 15:
-            # Generate fake data
-            fake_data = generate_fake_data()
+                # Create custom binary data with the generated fake data
+                custom_binary_data = create_custom_binary_data(fake_data)
 
-            # Create custom binary data with the generated fake data
-            custom_binary_data = create_custom_binary_data(fake_data)
+                # Send the custom binary data
+                ser.write(custom_binary_data)
+                print(f"Sent custom binary data 10s: {custom_binary_data.hex()}")
+                last_time_10s = current_time
 
-            # Send the custom binary data
-            ser.write(custom_binary_data)
-            print(f"Sent custom binary data 10s: {custom_binary_data.hex()}")
-            last_time_10s = current_time
+            # Small sleep to prevent high CPU usage
+            time.sleep(0.1)
 
-        # Small sleep to prevent high CPU usage
-        time.sleep(0.1)
+    except serial.SerialException as e:
+        print(f"Error: {e}")
 
-except serial.SerialException as e:
-    print(f"Error: {e}")
+    finally:
+        # Close the serial port
+        if ser is not None and ser.is_open:
+            ser.close()
 
-finally:
-    # Close the serial port
-    if ser.is_open:
-        ser.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+import protocol
+from metrics import REGISTRY
+from uplink import UplinkScheduler
+
+log = logging.getLogger(__name__)
+
+# What the ESP32 prints at the end of setup() after the port resets it
+READY_LINE = "Ready to receive commands."
+
+# Replies the ESP32 bridge sends for each command (see ArduinoCode.ino)
+CONNECT_OK = ("Sent CONNECT message", "Already connected to WebSocket server")
+CONNECT_ERRORS = ("Failed to connect to WebSocket server",)
+JSON_OK = ("Finished JSON deserialization.",)
+JSON_ERRORS = ("Failed to parse JSON",)
+STATE_OK = ("Sent message:",)
+STATE_ERRORS = ("Invalid command received or oven name not set",)
+DISCONNECT_OK = ("Disconnecting from WebSocket server", "Not connected to WebSocket server")
+
+
+class CommandError(Exception):
+    pass
+
+
+# asyncio front end for a blocking pyserial port. A reader thread turns the
+# incoming bytes into lines for the event loop; writes go through a single
+# worker thread so they never block the loop and never interleave.
+class SerialStream:
+    def __init__(self, ser, loop):
+        self.ser = ser
+        self.loop = loop
+        self.lines = asyncio.Queue()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="uplink-write")
+        self.closed = False
+        self.reader = threading.Thread(target=self._read_loop, name="uplink-read", daemon=True)
+        self.reader.start()
+
+    @classmethod
+    async def open(cls, port, baudrate=9600):
+        loop = asyncio.get_running_loop()
+        ser = await loop.run_in_executor(None, lambda: serial.serial_for_url(port, baudrate, timeout=0.1))
+        return cls(ser, loop)
+
+    def _read_loop(self):
+        buffer = bytearray()
+        while not self.closed:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if not self.closed:
+                    error = e if isinstance(e, (serial.SerialException, OSError)) else serial.SerialException(str(e))
+                    self.loop.call_soon_threadsafe(self.lines.put_nowait, error)
+                return
+            if not data:
+                continue
+            buffer += data
+            while True:
+                end = buffer.find(b"\n")
+                if end < 0:
+                    break
+                line = buffer[:end].decode('utf-8', errors='replace').strip()
+                del buffer[:end + 1]
+                self.loop.call_soon_threadsafe(self.lines.put_nowait, line)
+
+    # Next line from the device; raises if the port has gone away
+    async def readline(self):
+        line = await self.lines.get()
+        if isinstance(line, Exception):
+            raise line
+        return line
+
+    async def write(self, data):
+        await self.loop.run_in_executor(self.writer, self.ser.write, data)
+
+    def close(self):
+        self.closed = True
+        self.writer.shutdown(wait=False)
+        try:
+            self.ser.close()
+        except serial.SerialException:
+            pass
+
+
+# An asyncio event loop running forever on its own thread
+class LoopThread:
+    def __init__(self, name="engine-loop"):
+        self.name = name
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        ready = threading.Event()
+
+        def run_loop():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run_loop, name=self.name, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def stop(self, timeout=5.0):
+        if not self.thread:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.thread = None
+
+
+# Owns the uplink serial port to the ESP32 bridge and runs an asyncio event
+# loop on its own thread. Producers hand outbound lines to an UplinkScheduler
+# whose writer task batches and paces them, a reader task consumes everything
+# the ESP32 prints, and commands (CONNECT, ACTIVE, IDLE, DISCONNECT) wait for
+# the bridge's actual reply instead of sleeping. With a Spool, records are
+# written to disk first; if the link drops the engine reconnects, repeats the
+# handshake and replays whatever the bridge hadn't acknowledged.
+class TransmitterEngine:
+    # protocol is "ascii", "binary" (BIN1, falling back to ASCII if the bridge
+    # doesn't support it) or "auto" (same as binary)
+    # loop is a LoopThread shared with other engines (see supervisor.py); by
+    # default each engine runs its own. labels tag the engine's metrics.
+    def __init__(self, port, baudrate=9600, queue_size=500, boot_timeout=2.0, reply_timeout=5.0, protocol="ascii", spool=None, max_backoff=30.0, loop=None, labels=None):
+        self.port = port
+        self.labels = labels or {}
+        self.baudrate = baudrate
+        self.protocol = protocol
+        self.spool = spool
+        self.max_backoff = max_backoff
+        self.oven_name = None
+        self.config = None
+        self.state = "Disconnected"
+        self.reconnect_task = None
+        self.reconnects = 0
+        self.replaying = False
+        self.queue_size = queue_size
+        self.boot_timeout = boot_timeout
+        self.reply_timeout = reply_timeout
+        self.loop_thread = loop
+        self.own_loop = loop is None
+        self.loop = None
+        self.stream = None
+        self.uplink = None
+        self.tasks = []
+        self.waiters = []
+
+    # Start the event loop thread; the rest of the API can be used after this
+    def start(self):
+        if self.loop:
+            return
+        if self.own_loop:
+            self.loop_thread = LoopThread(f"engine-{self.port}")
+            self.loop_thread.start()
+        self.loop = self.loop_thread.loop
+        self.uplink = UplinkScheduler(self._write, self.baudrate, queue_size=self.queue_size, on_ack=self._on_ack, labels=self.labels)
+        REGISTRY.counter_function("transmitter_reconnects_total", "Times the serial link to the transmitter was re-established", lambda: self.reconnects, **self.labels)
+        if self.spool:
+            spool = self.spool
+            REGISTRY.counter_function("spool_appended_total", "Records written to the spool", lambda: spool.appended, **self.labels)
+            REGISTRY.counter_function("spool_bytes_written_total", "Bytes written to the spool", lambda: spool.bytes_written, **self.labels)
+            REGISTRY.counter_function("spool_evicted_total", "Unacknowledged records dropped to stay under the disk cap", lambda: spool.evicted, **self.labels)
+            REGISTRY.gauge_function("spool_outstanding", "Spooled records not yet acknowledged", lambda: len(spool.outstanding), **self.labels)
+
+    def stop(self, timeout=5.0):
+        if not self.loop:
+            return
+        try:
+            self.run(self.close(), timeout)
+        finally:
+            if self.own_loop:
+                self.loop_thread.stop(timeout)
+                self.loop_thread = None
+            self.loop = None
+
+    # Run a coroutine on the engine loop from another thread and wait for it
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    # Schedule a coroutine on the engine loop and return its concurrent Future
+    def spawn(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def open(self):
+        self.stream = await SerialStream.open(self.port, self.baudrate)
+        # Opening the port resets the ESP32, give it time to boot
+        ready = self._add_waiter(lambda line: line == READY_LINE)
+        self.tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self.uplink.run())
+        ]
+        try:
+            await asyncio.wait_for(ready, self.boot_timeout)
+        except asyncio.TimeoutError:
+            # The board didn't reset (or was already running), carry on
+            self._remove_waiter(ready)
+
+    async def _close_link(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    async def close(self):
+        self.state = "Disconnected"
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+            await asyncio.gather(self.reconnect_task, return_exceptions=True)
+            self.reconnect_task = None
+        await self._close_link()
+        if self.spool:
+            self.spool.close()
+
+    # Queue a BoardRecord for the ESP32, waiting for room if the queue is full.
+    # key names the board the record is for so a backlog can be coalesced.
+    # With a spool the record is on disk before this returns; while the link
+    # is down it is only spooled and goes out when the link is back.
+    async def send(self, record, key=None):
+        seq = self.spool.append(record) if self.spool else None
+        if self.uplink.paused or self.replaying:
+            return
+        await self.uplink.put(record, key, seq)
+
+    # Same as send() for producers running on other threads
+    def send_threadsafe(self, record, key=None, timeout=None):
+        self.run(self.send(record, key), timeout)
+
+    def _add_waiter(self, matches, errors=()):
+        future = self.loop.create_future()
+        self.waiters.append((matches, errors, future))
+        return future
+
+    def _remove_waiter(self, future):
+        self.waiters = [waiter for waiter in self.waiters if waiter[2] is not future]
+
+    def _dispatch(self, line):
+        handled = False
+        for matches, errors, future in list(self.waiters):
+            if future.done():
+                continue
+            if errors and line.startswith(errors):
+                future.set_exception(CommandError(line))
+                handled = True
+            elif matches(line):
+                future.set_result(line)
+                handled = True
+        self.waiters = [waiter for waiter in self.waiters if not waiter[2].done()]
+        return handled
+
+    async def _reader(self):
+        while True:
+            try:
+                line = await self.stream.readline()
+            except (serial.SerialException, OSError) as e:
+                log.warning("Serial exception on %s: %s", self.port, e)
+                for _, _, future in self.waiters:
+                    if not future.done():
+                        future.set_exception(e)
+                self.waiters = []
+                self._link_lost()
+                return
+            if not line or self.uplink.on_line(line):
+                continue
+            if not self._dispatch(line):
+                log.debug("Arduino response: %s", line)
+
+    async def _write(self, data):
+        try:
+            await self.stream.write(data)
+        except (serial.SerialException, OSError, AttributeError) as e:
+            log.warning("Could not send to Arduino: %s", e)
+            self._link_lost()
+
+    def _on_ack(self, seq):
+        if self.spool:
+            self.spool.ack(seq)
+
+    # Stop writing and start reconnecting, unless we meant to disconnect
+    def _link_lost(self):
+        if self.state == "Disconnected" or self.reconnect_task:
+            return
+        self.uplink.pause()
+        self.uplink.reset()
+        self.reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        backoff = 1.0
+        while True:
+            await self._close_link()
+            try:
+                await self.open()
+                await self._handshake()
+                if self.state == "Active":
+                    await self.command("ACTIVE", STATE_OK, STATE_ERRORS)
+                break
+            except (serial.SerialException, OSError, CommandError) as e:
+                log.warning("Reconnecting to %s failed: %s, retrying in %.0f s", self.port, e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        self.reconnects += 1
+        log.info("Reconnected to %s", self.port)
+        # Anything queued while the link was down is in the spool
+        self.uplink.reset()
+        self.uplink.resume()
+        self.reconnect_task = None
+        await self._replay()
+
+    # Re-send everything the spool holds that wasn't acknowledged. Records sent
+    # meanwhile only go to the spool, and are picked up by the next pass, so
+    # the bridge still gets everything in order.
+    async def _replay(self):
+        if not self.spool or self.replaying:
+            return
+        self.replaying = True
+        count = 0
+        start = 0
+        try:
+            while not self.uplink.paused:
+                end = self.spool.next_seq
+                for seq, record in self.spool.unacked():
+                    if seq >= end or self.uplink.paused:
+                        break
+                    if seq >= start:
+                        await self.uplink.put(record, None, seq)
+                        count += 1
+                start = end
+                if self.spool.next_seq == end:
+                    break
+        finally:
+            self.replaying = False
+        if count:
+            log.info("Replayed %d spooled record(s)", count)
+
+    # Write a command and wait for a reply line starting with one of `ok`.
+    # A reply starting with one of `errors` raises CommandError.
+    async def command(self, line, ok, errors=(), timeout=None):
+        reply = self._add_waiter(lambda text: text.startswith(ok), errors)
+        await self.stream.write((line + '\n').encode('utf-8'))
+        log.debug("Sent: %s", line[:80])
+        try:
+            return await asyncio.wait_for(reply, timeout or self.reply_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(reply)
+            raise CommandError(f"No reply from the transmitter to {line.split()[0][:20]!r}")
+
+    async def connect(self, oven_name, config):
+        self.oven_name = oven_name
+        self.config = config
+        if self.stream is None:
+            await self.open()
+        await self._handshake()
+        self.state = "Idle"
+        # Records left over from a previous run go out first
+        asyncio.create_task(self._replay())
+
+    async def _handshake(self):
+        await self.command(f"CONNECT {self.oven_name}", CONNECT_OK, CONNECT_ERRORS)
+        # Prepend "JSON:" identifier to the JSON string, without the whitespace
+        await self.command(f"JSON:{json.dumps(self.config, separators=(',', ':'))}", JSON_OK, JSON_ERRORS)
+        if self.protocol in ("binary", "auto"):
+            await self.negotiate_binary()
+
+    # Ask the bridge for BIN1 frames; older firmware doesn't answer and the
+    # uplink stays on ASCII lines
+    async def negotiate_binary(self):
+        try:
+            await self.command(protocol.NEGOTIATE_COMMAND, (protocol.NEGOTIATE_OK,), timeout=1.0)
+        except CommandError:
+            log.info("Transmitter doesn't support the binary uplink, using ASCII")
+            self.uplink.use_binary(False)
+            return False
+        log.info("Using the binary uplink protocol")
+        self.uplink.use_binary()
+        return True
+
+    async def activate(self):
+        reply = await self.command("ACTIVE", STATE_OK, STATE_ERRORS)
+        self.state = "Active"
+        return reply
+
+    async def idle(self):
+        reply = await self.command("IDLE", STATE_OK, STATE_ERRORS)
+        self.state = "Idle"
+        return reply
+
+    async def disconnect(self):
+        # Let anything still queued go out first
+        await self.uplink.drain()
+        log.info("Uplink: %s", self.uplink.stats())
+        if self.spool:
+            log.info("Spool: %s", self.spool.stats())
+        self.state = "Disconnected"
+        return await self.command("DISCONNECT", DISCONNECT_OK)
+
+    # Throughput counters for the uplink, the spool and the link itself
+    def stats(self):
+        stats = {"state": self.state, "reconnects": self.reconnects, "uplink": self.uplink.stats() if self.uplink else {}}
+        if self.spool:
+            stats["spool"] = self.spool.stats()
+        return stats
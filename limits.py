@@ -0,0 +1,219 @@
+import logging
+import math
+
+from metrics import REGISTRY
+from protocol import FIELDS
+from records import LogClock, board_fields, summary_record
+
+try:
+    import numpy as np
+except ImportError:  # evaluated row by row instead
+    np = None
+
+log = logging.getLogger(__name__)
+
+# Board control limits evaluated on the transmitter, with the same rules
+# ArduinoCode.ino uses when it builds the websocket message:
+#
+#   P1, P2, Vx, Vz, Ct, Vt   additional_value +/- plus_minus
+#   T1, T2                   low_temp_value or high_temp_value, whichever the
+#                            reading is closer to, +/- plus_minus
+#
+# A parameter only has limits when board_data.allow_control_limits is set and
+# its plus_minus is above 0. As on the ESP32, board temperatures have no ramp
+# envelope: the oven's ramp (temperature_control.ramp_rate) only applies to
+# the oven temperature, so a board that is already hot at the start of a
+# session is checked against high_temp_value straight away.
+#
+# The settings are compiled once into per-field arrays (in the order of
+# records.board_fields, so fields a user-edited sequence adds can have limits
+# too) and a batch of readings is checked in one go with NumPy, or row by row
+# without it.
+
+TEMPERATURE_FIELDS = ("T1", "T2")
+
+# limit_mode: "all" sends every reading, "exceptions" only readings outside
+# their limits plus a per-board summary every limit_summary_interval seconds
+LIMIT_MODES = ("all", "exceptions")
+
+NAN = float("nan")
+
+
+class ControlLimits:
+    def __init__(self, center, plus_minus, low, high, fields=FIELDS):
+        self.fields = fields
+        self.center = center
+        self.plus_minus = plus_minus
+        self.low = low
+        self.high = high
+        self.is_temperature = [key in TEMPERATURE_FIELDS for key in fields]
+        self.enabled = [not math.isnan(value) for value in plus_minus]
+        if np is not None:
+            self.arrays = {name: np.array(getattr(self, name), dtype=float) for name in ("center", "plus_minus", "low", "high")}
+            self.temperature_mask = np.array(self.is_temperature)
+
+    @classmethod
+    def from_config(cls, config):
+        board_data = config.get("board_data", {})
+        allowed = board_data.get("allow_control_limits", False)
+        control_limits = board_data.get("control_limits", {})
+        fields = board_fields(config)
+        center, plus_minus, low, high = [], [], [], []
+        for key in fields:
+            settings = control_limits.get(key, {})
+            margin = float(settings.get("plus_minus") or 0.0)
+            plus_minus.append(margin if allowed and margin > 0 else NAN)
+            center.append(float(settings.get("additional_value") or 0.0))
+            low.append(float(settings.get("low_temp_value") or 0.0))
+            high.append(float(settings.get("high_temp_value") or 0.0))
+        return cls(center, plus_minus, low, high, fields)
+
+    @property
+    def active(self):
+        return any(self.enabled)
+
+    # Limits for a batch of readings. values is a list of rows in fields
+    # order (NaN where missing). Returns (lower, upper, failed): NaN limits
+    # and False where a field has none.
+    def evaluate(self, values):
+        if np is None:
+            return self._evaluate_rows(values)
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.fields))
+        arrays = self.arrays
+
+        # Nearest of low/high for T1/T2, the fixed centre for everything else
+        nearer_low = np.abs(values - arrays["low"]) < np.abs(values - arrays["high"])
+        temperature_center = np.where(nearer_low, arrays["low"], arrays["high"])
+        center = np.where(self.temperature_mask, temperature_center, arrays["center"])
+
+        lower = center - arrays["plus_minus"]
+        upper = center + arrays["plus_minus"]
+        # The ESP32 leaves T1/T2 limits out when the reading is missing
+        missing = self.temperature_mask & np.isnan(values)
+        lower[missing] = np.nan
+        upper[missing] = np.nan
+        with np.errstate(invalid='ignore'):
+            failed = (values < lower) | (values > upper)
+        return lower, upper, failed
+
+    def _evaluate_rows(self, values):
+        lower_rows, upper_rows, failed_rows = [], [], []
+        for row in values:
+            lower, upper, failed = [], [], []
+            for i, value in enumerate(row):
+                margin = self.plus_minus[i]
+                if self.is_temperature[i]:
+                    low, high = self.low[i], self.high[i]
+                    center = low if abs(value - low) < abs(value - high) else high
+                    if math.isnan(value):
+                        margin = NAN
+                else:
+                    center = self.center[i]
+                lower.append(center - margin)
+                upper.append(center + margin)
+                failed.append(value < center - margin or value > center + margin)
+            lower_rows.append(lower)
+            upper_rows.append(upper)
+            failed_rows.append(failed)
+        return lower_rows, upper_rows, failed_rows
+
+
+# Evaluates outgoing records against the compiled limits, attaches the limit
+# values and failed fields to each record and, in "exceptions" mode, holds
+# back readings that are within limits in favour of a periodic per-board
+# summary (the mean of the readings held back). Summaries fall due by the
+# readings' own timestamps; flush() sends the ones due for boards that have
+# gone quiet, and with final=True every one still pending. A reading with
+# none of the tracked fields is sent as it is rather than held back.
+class LimitFilter:
+    def __init__(self, limits, mode="all", summary_interval=60.0, labels=None):
+        if mode not in LIMIT_MODES:
+            raise ValueError(f"Unknown limit_mode {mode!r}, expected one of {', '.join(LIMIT_MODES)}")
+        self.limits = limits
+        self.fields = limits.fields
+        self.mode = mode
+        self.summary_interval = summary_interval
+        self.summaries = {}  # board -> [sums, counts, first held time, last held time]
+        self.clock = LogClock()
+        self.labels = labels or {}
+        self.checked = 0
+        self.failed = 0
+        self.suppressed = 0
+        self.summaries_sent = 0
+        REGISTRY.counter_function("limit_records_checked_total", "Board records checked against the control limits", lambda: self.checked, **self.labels)
+        REGISTRY.counter_function("limit_records_failed_total", "Board records with a value outside its control limits", lambda: self.failed, **self.labels)
+        REGISTRY.counter_function("limit_records_suppressed_total", "Within-limit records held back in exceptions mode", lambda: self.suppressed, **self.labels)
+        REGISTRY.counter_function("limit_summaries_sent_total", "Per-board summaries sent in exceptions mode", lambda: self.summaries_sent, **self.labels)
+
+    @classmethod
+    def from_config(cls, config, labels=None):
+        return cls(ControlLimits.from_config(config), config.get("limit_mode", "all"), config.get("limit_summary_interval", 60.0), labels)
+
+    # Check a batch of records and return the ones to send
+    def process(self, records, now=None):
+        if not records or (not self.limits.active and self.mode == "all"):
+            return records
+        for record in records:
+            self.clock.observe(record.timestamp, now)
+        log_now = self.clock.time(now)
+        fields = self.fields
+        rows = [[record.values.get(key, NAN) for key in fields] for record in records]
+        times = [log_now if math.isnan(record.timestamp) else record.timestamp for record in records]
+        lower, upper, failed = self.limits.evaluate(rows)
+        if np is not None:
+            lower, upper, failed = lower.tolist(), upper.tolist(), failed.tolist()
+
+        enabled = [i for i, on in enumerate(self.limits.enabled) if on]
+        outgoing = []
+        for record, row, at, row_lower, row_upper, row_failed in zip(records, rows, times, lower, upper, failed):
+            record.limits = {fields[i]: (row_lower[i], row_upper[i]) for i in enabled if not math.isnan(row_lower[i])}
+            record.failed = tuple(fields[i] for i in enabled if row_failed[i])
+            self.checked += 1
+            if record.failed:
+                self.failed += 1
+            if self.mode == "all" or record.failed or all(math.isnan(value) for value in row):
+                outgoing.append(record)
+            else:
+                self.suppressed += 1
+                self._hold(record, row, at)
+        outgoing.extend(self.flush(now))
+        return outgoing
+
+    # Summaries that are due by log time, for boards that have gone quiet as
+    # well; final sends every pending summary. now is the wall time.
+    def flush(self, now=None, final=False):
+        if not self.summaries:
+            return []
+        now = self.clock.time(now)
+        return [self._summary(board) for board in list(self.summaries)
+                if final or now - self.summaries[board][2] >= self.summary_interval]
+
+    # The pending summary holding a board's readings back, if any
+    def holding(self, board):
+        return self.summaries.get(board)
+
+    def _hold(self, record, row, at):
+        summary = self.summaries.get(record.board)
+        if summary is None:
+            summary = self.summaries[record.board] = [[0.0] * len(self.fields), [0] * len(self.fields), at, at]
+        summary[3] = at
+        sums, counts = summary[0], summary[1]
+        for i, value in enumerate(row):
+            if not math.isnan(value):
+                sums[i] += value
+                counts[i] += 1
+
+    def _summary(self, board):
+        sums, counts, _, last = self.summaries.pop(board)
+        values = {key: round(total / count, 6) for key, total, count in zip(self.fields, sums, counts) if count}
+        self.summaries_sent += 1
+        return summary_record(board, values, last)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "checked": self.checked,
+            "failed": self.failed,
+            "suppressed": self.suppressed,
+            "summaries_sent": self.summaries_sent
+        }
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import Counter
+
+import metrics
+from metrics import Histogram
+from publish import BatchPublisher, sample_count
+from sequenceEmulator import Profile, message_count, profile_messages, sequence as DEFAULT_SEQUENCE, sequence_seconds, synthesize_profile
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+log = logging.getLogger(__name__)
+
+# Load generator for the ingest server. Hundreds of ovens run as tasks on one
+# event loop, each with its own websocket, and follow the oven profile from
+# sequenceEmulator.py: its `sequence` step list, a JSON file of steps, or a
+# seeded run from synthesize_profile(). Oven time can be compressed, and a
+# target message rate caps what all ovens send together:
+#
+#   python loadgen.py --ovens 200 --speed 1000 --rate 5000 --url ws://host:3000
+#   python loadgen.py --ovens 50 --speed 100 --local     built-in stand-in server
+#   python loadgen.py serve --port 3000                  just the stand-in
+#
+# An oven that falls more than --max-lag seconds behind its schedule skips
+# the seconds it missed and counts their messages as dropped, like a real
+# oven whose socket couldn't keep up. Send latency is the time ws.send()
+# takes, which grows once the server stops draining its socket.
+#
+# --batch packs samples into newOvenDataBatch frames of up to --max-batch
+# samples, flushed after at most --max-latency seconds.
+
+PORT = 3000
+
+
+# Spaces sends out to a total rate shared by all ovens
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        slot = max(self.next_time, now)
+        self.next_time = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Stand-in for server.js that accepts oven connections and counts what they
+# send. delay (seconds per message) emulates the server's database writes.
+class StandInServer:
+    def __init__(self, host="127.0.0.1", port=PORT, delay=0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.received = Counter()
+        self.frames = 0
+        self.samples = 0
+        self.connections = 0
+        self.server = None
+
+    async def handler(self, ws, *args):
+        self.connections += 1
+        async for frame in ws:
+            message = json.loads(frame)
+            self.received[message.get("type", "data")] += 1
+            self.frames += 1
+            self.samples += sample_count(message)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+    async def start(self):
+        self.server = await websockets.serve(self.handler, self.host, self.port, max_size=None)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info("Stand-in server listening on ws://%s:%d", self.host, self.port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def stats(self):
+        return {"connections": self.connections, "frames": self.frames, "samples": self.samples, "by_type": dict(self.received)}
+
+
+class LoadGenerator:
+    # speed: oven seconds per wall second. rate: messages per second across
+    # all ovens (0 for no limit). duration: stop after this many wall seconds
+    # even if the profiles haven't finished (0 to run them to the end).
+    # With a seed every oven gets a synthesized run (seed + oven index), so a
+    # load test can be repeated exactly; profile replays one saved run.
+    # batch packs samples into newOvenDataBatch frames (see publish.py).
+    def __init__(self, url, ovens, steps, speed=1000.0, rate=0.0, duration=0.0, max_lag=1.0, idle_time=20, stagger=1.0, seed=None, profile=None,
+                 batch=False, max_batch=100, max_latency=0.05):
+        self.url = url
+        self.batch = batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.seed = seed
+        self.profile = profile
+        self.ovens = ovens
+        self.steps = steps
+        self.speed = speed
+        self.limiter = RateLimiter(rate) if rate else None
+        self.duration = duration
+        self.max_lag = max_lag
+        self.idle_time = idle_time
+        self.stagger = stagger
+        self.send_latency = Histogram("loadgen_send_seconds", "Time spent in one websocket send", ())
+        self.frames = 0
+        self.lag = Histogram("loadgen_lag_seconds", "How far behind schedule a message was sent", ())
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.connected = 0
+        self.finished = 0
+        self.errors = Counter()
+
+    async def send(self, publisher, message):
+        if self.limiter:
+            await self.limiter.acquire()
+        await publisher.publish(message)
+        self.sent += 1
+
+    def frame_sender(self, ws):
+        async def send_frame(frame):
+            started = time.perf_counter()
+            await ws.send(frame)
+            self.send_latency.observe(time.perf_counter() - started)
+            self.frames += 1
+        return send_frame
+
+    def seconds_for(self, index):
+        if self.profile is not None:
+            return self.profile.seconds()
+        if self.seed is not None:
+            return synthesize_profile(self.steps, self.seed + index, self.idle_time).seconds()
+        return sequence_seconds(self.steps, self.idle_time)
+
+    async def run_oven(self, index, deadline):
+        oven_name = f"Load{index + 1:03}"
+        # Spread connects and profiles out instead of starting every oven in the same instant
+        await asyncio.sleep(self.stagger * index / self.ovens)
+        try:
+            async with websockets.connect(self.url, max_size=None) as ws:
+                self.connected += 1
+                publisher = BatchPublisher(self.frame_sender(ws), self.batch, self.max_batch, self.max_latency)
+                await self.send(publisher, {"type": "identify", "clientId": oven_name})
+                started = time.monotonic()
+                start_time = time.time()
+                for tick, second in enumerate(self.seconds_for(index)):
+                    due = started + tick / self.speed
+                    if deadline and due >= deadline:
+                        await publisher.close()
+                        return
+                    now = time.monotonic()
+                    if due > now:
+                        await asyncio.sleep(due - now)
+                    elif now - due > self.max_lag:
+                        self.dropped += message_count(second)
+                        continue
+                    # Timestamps follow oven time, not wall time
+                    for message in profile_messages(oven_name, second, start_time + tick):
+                        self.lag.observe(max(time.monotonic() - due, 0.0))
+                        await self.send(publisher, message)
+                await self.send(publisher, {"type": "stop", "data": {"ovenId": oven_name}})
+                self.finished += 1
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            self.failed += 1
+            self.errors[type(e).__name__] += 1
+            log.warning("[%s] %s", oven_name, e)
+
+    async def run(self):
+        started = time.monotonic()
+        deadline = started + self.duration if self.duration else 0
+        await asyncio.gather(*(self.run_oven(index, deadline) for index in range(self.ovens)))
+        return time.monotonic() - started
+
+    def report(self, elapsed):
+        return {
+            "url": self.url,
+            "ovens": self.ovens,
+            "connected": self.connected,
+            "finished": self.finished,
+            "failed": self.failed,
+            "speed": self.speed,
+            "elapsed": round(elapsed, 3),
+            "sent": self.sent,
+            "frames": self.frames,
+            "batch": self.batch,
+            "dropped": self.dropped,
+            "messages_per_second": round(self.sent / elapsed, 1) if elapsed else 0.0,
+            "send_latency": {key: round(value, 6) for key, value in self.send_latency.snapshot().items()
+                             if key.startswith("p") or key == "max"},
+            "lag": {key: round(value, 6) for key, value in self.lag.snapshot().items() if key.startswith("p")},
+            "errors": dict(self.errors)
+        }
+
+
+def load_steps(path):
+    if not path:
+        return DEFAULT_SEQUENCE
+    with open(path, 'r') as file:
+        steps = json.load(file)
+    # Either a bare list of steps or an object with a "sequence" key
+    return steps["sequence"] if isinstance(steps, dict) else steps
+
+
+async def run_load(args):
+    server = None
+    url = args.url
+    if args.local:
+        server = StandInServer(port=0, delay=args.server_delay)
+        await server.start()
+        url = server.url
+    profile = Profile.load(args.profile) if args.profile else None
+    generator = LoadGenerator(url, args.ovens, load_steps(args.steps), args.speed, args.rate, args.duration, args.max_lag,
+                              args.idle_time, args.stagger, args.seed, profile, args.batch, args.max_batch, args.max_latency)
+    try:
+        result = generator.report(await generator.run())
+    finally:
+        if server:
+            # Let the server read what is still in flight before counting
+            await asyncio.sleep(0.5)
+            await server.stop()
+    if server:
+        result["server"] = server.stats()
+    return result
+
+
+async def serve(args):
+    server = StandInServer(args.host, args.port, args.server_delay)
+    await server.start()
+    try:
+        while True:
+            await asyncio.sleep(10)
+            log.info("%s", server.stats())
+    finally:
+        await server.stop()
+
+
+def print_report(result):
+    print(f"{result['ovens']} oven(s) at {result['speed']:g}x against {result['url']}: "
+          f"{result['connected']} connected, {result['finished']} finished, {result['failed']} failed")
+    print(f"  sent {result['sent']} in {result['elapsed']}s = {result['messages_per_second']} msgs/s in {result['frames']} frame(s), dropped {result['dropped']}")
+    print("  send latency: " + "  ".join(f"{key} {value * 1000:.2f} ms" for key, value in result["send_latency"].items() if value is not None))
+    print("  schedule lag: " + "  ".join(f"{key} {value * 1000:.1f} ms" for key, value in result["lag"].items()))
+    if "server" in result:
+        server = result["server"]
+        print(f"  stand-in received {server['samples']} sample(s) in {server['frames']} frame(s) over {server['connections']} connection(s)")
+    if result["errors"]:
+        print(f"  errors: {result['errors']}")
+
+
+def main(argv):
+    if argv and argv[0] == "serve":
+        arg_parser = argparse.ArgumentParser(prog="loadgen.py serve", description="Run the stand-in ingest server")
+        arg_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+        arg_parser.add_argument("--port", type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+        arg_parser.add_argument("--server-delay", type=float, default=0.0, help="seconds of simulated work per message")
+        arg_parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR (default: INFO)")
+        args = arg_parser.parse_args(argv[1:])
+        metrics.setup_logging(args.log_level)
+        if websockets is None:
+            print("loadgen.py needs the websockets package (pip install websockets)")
+            return 1
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    arg_parser = argparse.ArgumentParser(prog="loadgen.py", description="Simulate many ovens against the ingest server")
+    arg_parser.add_argument("--url", default=f"ws://127.0.0.1:{PORT}", help=f"ingest server (default: ws://127.0.0.1:{PORT})")
+    arg_parser.add_argument("--local", action="store_true", help="start a stand-in server and test against that")
+    arg_parser.add_argument("--ovens", type=int, default=100, help="simulated ovens (default: 100)")
+    arg_parser.add_argument("--steps", default="", help="JSON file with the sequence steps (default: the Gollum sequence)")
+    arg_parser.add_argument("--seed", type=int, help="synthesize every oven's run from this seed (needs numpy)")
+    arg_parser.add_argument("--profile", default="", help="replay a run saved with sequenceEmulator.py --dump for every oven")
+    arg_parser.add_argument("--speed", type=float, default=1000.0, help="oven seconds per real second (default: 1000)")
+    arg_parser.add_argument("--rate", type=float, default=0.0, help="target messages per second across all ovens (default: no limit)")
+    arg_parser.add_argument("--duration", type=float, default=0.0, help="stop after this many seconds (default: run the profiles to the end)")
+    arg_parser.add_argument("--batch", action="store_true", help="send samples in batch frames instead of one per frame")
+    arg_parser.add_argument("--max-batch", type=int, default=100, help="samples per batch frame (default: 100)")
+    arg_parser.add_argument("--max-latency", type=float, default=0.05, help="seconds a sample may wait for its batch (default: 0.05)")
+    arg_parser.add_argument("--max-lag", type=float, default=1.0, help="seconds behind schedule before an oven skips ahead (default: 1)")
+    arg_parser.add_argument("--idle-time", type=int, default=20, help="oven seconds of idle data before the sequence (default: 20)")
+    arg_parser.add_argument("--stagger", type=float, default=1.0, help="seconds over which the ovens start (default: 1)")
+    arg_parser.add_argument("--server-delay", type=float, default=0.0, help="with --local, seconds of simulated work per message")
+    arg_parser.add_argument("--json", default="", help="write the results to this file")
+    arg_parser.add_argument("--log-level", default="WARNING", help="DEBUG, INFO, WARNING or ERROR (default: WARNING)")
+    args = arg_parser.parse_args(argv)
+    metrics.setup_logging(args.log_level)
+    if websockets is None:
+        print("loadgen.py needs the websockets package (pip install websockets)")
+        return 1
+
+    result = asyncio.run(run_load(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
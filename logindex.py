@@ -0,0 +1,305 @@
+import argparse
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+from logparser import NORMAL_BOARD_RE, TREEBEARD_BOARD_RE
+from timestamps import LOCAL, to_seconds
+
+log = logging.getLogger(__name__)
+
+# Sparse timestamp index for raw board logs. Every `every` lines the index
+# records (timestamp, byte offset of the line), so the lines for a time window
+# can be found with a binary search and read as one slice of a memory map
+# instead of scanning the whole file. The log must be in time order, which
+# the Modbus/Treebeard software writes it in.
+#
+# Indexes are built incrementally from the bytes the tailer reads (feed()),
+# or from the file itself (update()), and kept in a side-car file:
+#
+#   MAGIC | INDEX_HEADER (inode, head length, head CRC-32, every) | entries
+#
+# with each entry an ENTRY (float64 timestamp, uint64 offset). The head
+# checksum ties the index to one log file; if it no longer matches the
+# index is rebuilt.
+
+MAGIC = b"LOGIDX1\n"
+INDEX_HEADER = struct.Struct("<QIII")
+ENTRY = struct.Struct("<dQ")
+SUFFIX = ".idx"
+HEAD_BYTES = 256
+
+# Room for "2024-06-21 08:59:55.879" and the spacing around it
+TIMESTAMP_BYTES = 40
+
+# Index a line every this many lines
+DEFAULT_EVERY = 64
+
+# How much of a file update() scans at a time
+SCAN_BYTES = 4 << 20
+
+
+def index_path(log_path, index_dir=None):
+    return os.path.join(index_dir or os.path.dirname(log_path), os.path.basename(log_path) + SUFFIX)
+
+
+# Epoch seconds of a raw log line, NaN if it doesn't start with a timestamp
+def line_timestamp(line):
+    parts = line[:TIMESTAMP_BYTES].split(None, 2)
+    if len(parts) < 2:
+        return math.nan
+    return to_seconds(LOCAL.parse(parts[0].decode('ascii', 'replace'), parts[1].decode('ascii', 'replace')))
+
+
+# Length and CRC-32 of the first bytes of a log file
+def file_head(file):
+    file.seek(0)
+    data = file.read(HEAD_BYTES)
+    return len(data), zlib.crc32(data)
+
+
+class LogIndex:
+    def __init__(self, log_path, index_dir=None, every=DEFAULT_EVERY):
+        self.log_path = log_path
+        self.path = index_path(log_path, index_dir)
+        self.every = every
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.head = (0, 0)
+        self.inode = 0
+        self.end = 0  # Bytes of the log looked at so far
+        self.partial = b""
+        self.since = 0  # Lines since the last indexed one
+        self.saved = 0  # Entries already in the side-car file
+        self._load()
+
+    # Pick up the side-car file if it still belongs to the log
+    def _load(self):
+        try:
+            with open(self.log_path, 'rb') as file:
+                st = os.fstat(file.fileno())
+                head = file_head(file)
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        start = len(MAGIC) + INDEX_HEADER.size
+        if not data.startswith(MAGIC) or len(data) < start:
+            return
+        inode, head_length, head_crc, every = INDEX_HEADER.unpack_from(data, len(MAGIC))
+        if inode != st.st_ino or every != self.every or head[0] < head_length:
+            return
+        with open(self.log_path, 'rb') as file:
+            if zlib.crc32(file.read(head_length)) != head_crc:
+                return
+        for timestamp, offset in ENTRY.iter_unpack(data[start:start + (len(data) - start) // ENTRY.size * ENTRY.size]):
+            if offset >= st.st_size:
+                break
+            self.times.append(timestamp)
+            self.offsets.append(offset)
+        self.inode = inode
+        self.head = (head_length, head_crc)
+        self.saved = len(self.times)
+        # Carry on from the last indexed line
+        self.end = self.offsets[-1] if self.offsets else 0
+
+    # Start over, for a log that was replaced or truncated
+    def reset(self):
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.head = (0, 0)
+        self.inode = 0
+        self.end = 0
+        self.partial = b""
+        self.since = 0
+        self.saved = 0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    # Index bytes of the log starting at offset, as the tailer reads them.
+    # Bytes before what has been indexed are skipped; a gap is filled from
+    # the file first.
+    def feed(self, data, offset):
+        if offset > self.end:
+            self.update(offset)
+        if offset + len(data) <= self.end:
+            return
+        if offset < self.end:
+            data = data[self.end - offset:]
+        self._scan(data)
+
+    # Index the file itself from where the index stops up to `until` (the
+    # end of the file by default)
+    def update(self, until=None):
+        with open(self.log_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            until = size if until is None else min(until, size)
+            if until <= self.end:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                while self.end < until:
+                    self._scan(mapped[self.end:min(self.end + SCAN_BYTES, until)])
+
+    def _scan(self, data):
+        base = self.end - len(self.partial)
+        if self.partial:
+            data = self.partial + data
+        self.end = base + len(data)
+        times, offsets, every = self.times, self.offsets, self.every
+        since = self.since
+        pos = 0
+        while True:
+            newline = data.find(b"\n", pos)
+            if newline < 0:
+                break
+            if since >= every or not offsets:
+                timestamp = line_timestamp(data[pos:newline])
+                if not math.isnan(timestamp):
+                    times.append(timestamp)
+                    offsets.append(base + pos)
+                    since = 0
+            since += 1
+            pos = newline + 1
+        self.since = since
+        self.partial = data[pos:]
+
+    def _take_head(self):
+        try:
+            with open(self.log_path, 'rb') as file:
+                self.inode = os.fstat(file.fileno()).st_ino
+                self.head = file_head(file)
+        except FileNotFoundError:
+            pass
+
+    # Append the entries added since the last save to the side-car file
+    def save(self):
+        if self.saved == len(self.times):
+            return
+        if not self.head[0]:
+            self._take_head()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        mode = 'ab' if self.saved else 'wb'
+        with open(self.path, mode) as file:
+            if not self.saved:
+                file.write(MAGIC + INDEX_HEADER.pack(self.inode, self.head[0], self.head[1], self.every))
+            file.write(b"".join(ENTRY.pack(t, o) for t, o in zip(self.times[self.saved:], self.offsets[self.saved:])))
+        self.saved = len(self.times)
+
+    # Byte range of the log that holds every line with start <= timestamp < end
+    def byte_range(self, start, end, size):
+        first = 0
+        if start is not None:
+            i = bisect.bisect_right(self.times, start) - 1
+            first = self.offsets[i] if i >= 0 else 0
+        last = size
+        if end is not None:
+            i = bisect.bisect_left(self.times, end)
+            if i < len(self.offsets):
+                last = self.offsets[i]
+        return first, last
+
+    # Lines (as text) logged at start <= timestamp < end; either bound can be None
+    def query(self, start=None, end=None):
+        with open(self.log_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if not size:
+                return []
+            first, last = self.byte_range(start, end, size)
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data = mapped[first:last]
+        lines = []
+        for line in data.splitlines():
+            timestamp = line_timestamp(line)
+            if math.isnan(timestamp):
+                continue
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                lines.append(line.decode('utf-8', errors='replace'))
+        return lines
+
+
+# Board number of a log file, None when the name doesn't carry one
+def board_of(filename, is_treebeard=False):
+    match = (TREEBEARD_BOARD_RE if is_treebeard else NORMAL_BOARD_RE).search(filename)
+    return int(match.group(1)) if match else None
+
+
+# Yield (path, lines) for every log file in folder (for the given board
+# numbers, or all of them) with the lines logged in [start, end). Indexes are
+# brought up to date first and saved unless save is False.
+def query_folder(folder_path, start=None, end=None, boards=None, is_treebeard=False, index_dir=None, every=DEFAULT_EVERY, save=True):
+    from tailer import LOG_EXTENSIONS  # tailer imports this module
+    for name in sorted(os.listdir(folder_path)):
+        if not name.endswith(LOG_EXTENSIONS):
+            continue
+        if boards is not None and board_of(name, is_treebeard) not in boards:
+            continue
+        index = LogIndex(os.path.join(folder_path, name), index_dir, every)
+        index.update()
+        if save:
+            index.save()
+        lines = index.query(start, end)
+        if lines:
+            yield index.log_path, lines
+
+
+# "2024-06-21 09:00" (local time) or epoch seconds
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+# "1-40,45" -> {1, ..., 40, 45}
+def parse_boards(value):
+    boards = set()
+    for part in value.split(","):
+        low, _, high = part.partition("-")
+        boards.update(range(int(low), int(high or low) + 1))
+    return boards
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Pull the rows for a time window out of a folder of raw board logs, using side-car timestamp indexes.")
+    parser.add_argument("folder", help="Folder of Modbus/Treebeard log files")
+    parser.add_argument("--start", type=parse_time, help="First time wanted, epoch seconds or YYYY-MM-DD HH:MM[:SS]")
+    parser.add_argument("--end", type=parse_time, help="Up to (not including) this time")
+    parser.add_argument("--boards", type=parse_boards, help="Board numbers, e.g. 1-40 or 1,3,5")
+    parser.add_argument("--treebeard", action="store_true", help="Treebeard file names")
+    parser.add_argument("--index-dir", help="Where the .idx files are kept (default: next to the logs)")
+    parser.add_argument("--every", type=int, default=DEFAULT_EVERY, help="Lines between index entries")
+    parser.add_argument("--no-save", action="store_true", help="Don't write index files, build them in memory only")
+    parser.add_argument("--count", action="store_true", help="Print the number of rows per file instead of the rows")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    total = 0
+    try:
+        for path, lines in query_folder(args.folder, args.start, args.end, args.boards, args.treebeard, args.index_dir, args.every, not args.no_save):
+            total += len(lines)
+            if args.count:
+                print(f"{os.path.basename(path)}: {len(lines)}")
+            else:
+                for line in lines:
+                    print(line)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"{total} row(s) in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
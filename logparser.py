@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import mmap
+import re
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from records import BoardRecord
+from timestamps import LOCAL
+
+log = logging.getLogger(__name__)
+
+# Where each field sits in a Treebeard log row (split on whitespace)
+TREEBEARD_POSITIONS = {
+    "P1": 21,
+    "P2": 22,
+    "T1": 23,
+    "T2": 24,
+    "Vx": 26,
+    "Vz": 27,
+    "Ct": 50,
+    "Vt": 25
+}
+
+# Treebeard rows always carry the full set of fields in this order
+TREEBEARD_SEQUENCE = ("P1", "P2", "T1", "T2", "Vx", "Vz", "Ct", "Vt")
+
+# Normal Modbus rows are "<date> <time> <00000> value value ..."
+NORMAL_FIRST_VALUE = 3
+
+NORMAL_BOARD_RE = re.compile(r'(\d+)')
+TREEBEARD_BOARD_RE = re.compile(r'_(\d+)_')
+
+NAN = float("nan")
+
+
+def to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return NAN
+
+
+# A block of parsed rows from one board file, stored column-wise, with the
+# ASCII line for each row
+class ParsedBlock:
+    def __init__(self, board_number, fields, board_prefix):
+        self.board_number = board_number
+        self.fields = fields
+        self.board_prefix = board_prefix
+        self.timestamps = array('d')
+        self.columns = {key: array('d') for key in fields}
+        self.messages = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Yield one dict per row, mainly for debugging and tests
+    def rows(self):
+        columns = [self.columns[key] for key in self.fields]
+        for i, timestamp in enumerate(self.timestamps):
+            row = {"timestamp": timestamp, "board_number": self.board_number}
+            for key, column in zip(self.fields, columns):
+                row[key] = column[i]
+            yield row
+
+    # The ASCII "Board: 03 P1:99 P2:98 ..." lines the ESP32 expects. Each
+    # value is the text the log had for it ("0.10" stays "0.10"), as the
+    # transmitter has always sent it.
+    def to_messages(self):
+        return self.messages
+
+    # One BoardRecord per row, carrying both the values and the ASCII line.
+    # messages can be passed in if to_messages() already ran elsewhere;
+    # captured is when the rows were read (time.monotonic()).
+    def to_records(self, messages=None, captured=NAN):
+        if messages is None:
+            messages = self.to_messages()
+        columns = [self.columns[key] for key in self.fields]
+        timestamps = self.timestamps
+        records = []
+        for i, message in enumerate(messages):
+            values = {key: column[i] for key, column in zip(self.fields, columns)}
+            records.append(BoardRecord(self.board_number, values, message, timestamps[i], captured))
+        return records
+
+
+# Parser for one board log file. The board number and the column layout are
+# worked out once when the parser is created, so parsing a block of lines is
+# just a split and a float() per configured field.
+class LogParser:
+    def __init__(self, filename, sequence, is_treebeard=False, debug=False):
+        self.filename = filename
+        self.is_treebeard = is_treebeard
+        self.debug = debug
+
+        if is_treebeard:
+            match = TREEBEARD_BOARD_RE.search(filename)
+            self.fields = TREEBEARD_SEQUENCE
+            self.positions = [TREEBEARD_POSITIONS[key] for key in self.fields]
+            # A row must reach the last field's column (Ct, far out at 50)
+            self.min_parts = max(self.positions) + 1
+        else:
+            match = NORMAL_BOARD_RE.search(filename)
+            self.fields = tuple(sequence.split())
+            self.positions = [NORMAL_FIRST_VALUE + i for i in range(len(self.fields))]
+            self.min_parts = NORMAL_FIRST_VALUE + len(self.fields)
+
+        self.board_number = match.group(1) if match else "Unknown"
+        # Treebeard messages have never had a space after "Board:"
+        if is_treebeard:
+            self.board_prefix = f"Board:{self.board_number} "
+        else:
+            self.board_prefix = f"Board: {self.board_number} "
+
+    def new_block(self):
+        return ParsedBlock(self.board_number, self.fields, self.board_prefix)
+
+    # Parse a list of text lines into a ParsedBlock, skipping rows that are
+    # too short to hold the configured fields. The timestamps are parsed as
+    # one column at the end rather than row by row.
+    def parse_lines(self, lines, block=None):
+        if block is None:
+            block = self.new_block()
+        dates = []
+        times = []
+        add_date = dates.append
+        add_time = times.append
+        appends = [(position, block.columns[key].append) for key, position in zip(self.fields, self.positions)]
+        labels = [(position, f"{key}:") for key, position in zip(self.fields, self.positions)]
+        add_message = block.messages.append
+        board_prefix = self.board_prefix
+        min_parts = self.min_parts
+        is_treebeard = self.is_treebeard
+        skipped = 0
+
+        for line in lines:
+            parts = line.split()
+            if len(parts) < min_parts:
+                skipped += 1
+                continue
+            add_date(parts[0])
+            add_time(parts[1])
+            for position, append in appends:
+                append(to_float(parts[position]))
+            add_message(board_prefix + " ".join([label + parts[position] for position, label in labels]))
+            if self.debug:
+                log.debug("[%s] %s", self.filename, parts)
+
+        block.timestamps.extend(LOCAL.parse_column_seconds(dates, times))
+        if skipped and self.debug:
+            log.debug("[%s] Skipped %d short line(s) (treebeard=%s)", self.filename, skipped, is_treebeard)
+        return block
+
+    # Parse a chunk of raw bytes holding whole lines
+    def parse_bytes(self, data, block=None):
+        return self.parse_lines(bytes(data).decode('utf-8', errors='replace').splitlines(), block)
+
+    # Parse a whole file through a read-only memory map
+    def parse_file(self, path):
+        with open(path, 'rb') as file:
+            try:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return self.parse_bytes(mapped)
+            except ValueError:
+                # Empty files can't be mapped
+                return self.new_block()
+
+
+# Parsers cached per worker process (and the parse thread), so each file's
+# layout is worked out once
+_worker_parsers = {}
+
+
+# Parse one chunk of text lines and format its ASCII messages. Runs in a
+# ParsePool worker process (or on the parse thread for small batches). The
+# column block and the strings pickle far cheaper than a list of BoardRecords.
+def parse_chunk(filename, sequence, is_treebeard, text):
+    key = (filename, sequence, is_treebeard)
+    parser = _worker_parsers.get(key)
+    if parser is None:
+        parser = _worker_parsers[key] = LogParser(filename, sequence, is_treebeard)
+    block = parser.parse_lines(text.splitlines())
+    return block, block.to_messages()
+
+
+# Parse a whole batch on the parse thread; same results as parse_batch()
+def parse_local(changes, sequence, is_treebeard, captured):
+    results = []
+    for filename, lines in changes:
+        block, messages = parse_chunk(filename, sequence, is_treebeard, "\n".join(lines))
+        results.append((filename, len(block), block.to_records(messages, captured)))
+    return results
+
+
+# Optional multi-core parse stage. A batch of (filename, lines) changes is
+# split into chunks of at most chunk_lines lines, parsed in a process pool and
+# handed back in the order the changes came in, so each board's records stay
+# in order. Batches smaller than min_lines (and everything when workers is 0)
+# are parsed on a single parse thread instead, where the pickling round trip
+# would cost more than it saves; either way the event loop the batch comes
+# from (shared by every oven under a supervisor) keeps running meanwhile.
+class ParsePool:
+    def __init__(self, workers=0, min_lines=2000, chunk_lines=20000):
+        self.workers = workers
+        self.min_lines = min_lines
+        self.chunk_lines = chunk_lines
+        self.executor = None
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse")
+        self.pooled_batches = 0
+        self.local_batches = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.thread.shutdown(wait=False, cancel_futures=True)
+
+    # Parse a batch of changes and return [(filename, rows parsed, records)]
+    async def parse_batch(self, changes, sequence, is_treebeard):
+        captured = time.monotonic()
+        total = sum(len(lines) for _, lines in changes)
+        loop = asyncio.get_running_loop()
+        if self.workers <= 0 or total < self.min_lines:
+            self.local_batches += 1
+            return await loop.run_in_executor(self.thread, parse_local, changes, sequence, is_treebeard, captured)
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        jobs = []
+        for filename, lines in changes:
+            chunks = []
+            for start in range(0, len(lines), self.chunk_lines):
+                text = "\n".join(lines[start:start + self.chunk_lines])
+                chunks.append(loop.run_in_executor(self.executor, parse_chunk, filename, sequence, is_treebeard, text))
+            jobs.append((filename, chunks))
+
+        results = []
+        for filename, chunks in jobs:
+            parsed = 0
+            records = []
+            for block, messages in await asyncio.gather(*chunks):
+                parsed += len(block)
+                records.extend(block.to_records(messages, captured))
+            results.append((filename, parsed, records))
+        self.pooled_batches += 1
+        return results
+
+    def stats(self):
+        return {"workers": self.workers, "pooled_batches": self.pooled_batches, "local_batches": self.local_batches}
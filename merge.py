@@ -0,0 +1,181 @@
+import heapq
+import logging
+import math
+import time
+from collections import deque
+
+from timestamps import LOCAL
+
+log = logging.getLogger(__name__)
+
+# Time-ordered merging of per-board record streams. Each board's log is in
+# time order on its own, but the tailer hands files over one after another,
+# so without merging the records come out grouped by file.
+#
+# merge_streams() is a plain k-way merge for replaying finished logs: one
+# record per stream is held at a time. LiveMerger does the same for streams
+# that are still being written: a record is held until every stream has
+# moved past its time, or for at most `lookahead` seconds (in log time, and
+# in wall time when no new data comes in), so a board that stops logging
+# only delays the others by that much.
+#
+# SnapshotBuilder groups the merged stream into rack snapshots: the readings
+# of all boards sampled within one scan period.
+
+
+# Sort key of a stream's records: the timestamp, or the stream's previous
+# one for rows without a timestamp, so they stay where they were logged
+def _keyed(index, stream):
+    last = -math.inf
+    for record in stream:
+        if not math.isnan(record.timestamp):
+            last = record.timestamp
+        yield last, index, record
+
+
+# Merge iterables of time-ordered BoardRecords into one time-ordered iterator
+def merge_streams(streams):
+    for _, _, record in heapq.merge(*(_keyed(index, stream) for index, stream in enumerate(streams))):
+        yield record
+
+
+class LiveMerger:
+    def __init__(self, lookahead=0.0):
+        self.lookahead = lookahead
+        self.heap = []  # (timestamp, seq, stream, record, pushed at)
+        self.sequence = 0
+        self.latest = {}  # stream -> newest timestamp pushed
+        self.newest = -math.inf
+        self.pushed = {}  # stream -> seq of its last record pushed
+        self.released = {}  # stream -> seq of its last record popped
+        self.marks = {}  # stream -> deque of (seq, mark)
+        self.last_popped = -math.inf
+        self.late = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    # Add a stream's next records (in time order). mark is returned by
+    # released_marks() once every record pushed so far for the stream has
+    # been popped, e.g. the file position the records were read up to.
+    def push(self, stream, records, mark=None, now=None):
+        now = time.monotonic() if now is None else now
+        latest = self.latest.get(stream, -math.inf)
+        for record in records:
+            timestamp = record.timestamp
+            if math.isnan(timestamp):
+                timestamp = latest if latest > -math.inf else self.newest
+            elif timestamp > latest:
+                latest = timestamp
+            heapq.heappush(self.heap, (timestamp, self.sequence, stream, record, now))
+            self.pushed[stream] = self.sequence
+            self.sequence += 1
+        self.latest[stream] = latest
+        if latest > self.newest:
+            self.newest = latest
+        if mark is not None:
+            self.marks.setdefault(stream, deque()).append((self.pushed.get(stream, -1), mark))
+
+    # Stop waiting on a stream that has gone away. Its records still held
+    # are popped as usual, but no marks are returned for it any more.
+    def forget(self, stream):
+        self.latest.pop(stream, None)
+        self.marks.pop(stream, None)
+        self.pushed.pop(stream, None)
+
+    # Pop the records that are due, oldest first, as (stream, record)
+    def pop(self, now=None):
+        now = time.monotonic() if now is None else now
+        watermark = self.newest - self.lookahead
+        if self.latest:
+            watermark = max(watermark, min(self.latest.values()))
+        due = []
+        heap = self.heap
+        while heap and (heap[0][0] <= watermark or now - heap[0][4] >= self.lookahead):
+            timestamp, seq, stream, record, _ = heapq.heappop(heap)
+            if timestamp < self.last_popped:
+                self.late += 1
+            else:
+                self.last_popped = timestamp
+            self.released[stream] = seq
+            due.append((stream, record))
+        return due
+
+    # Everything still held, in order
+    def drain(self):
+        due = []
+        while self.heap:
+            timestamp, seq, stream, record, _ = heapq.heappop(self.heap)
+            self.released[stream] = seq
+            due.append((stream, record))
+        return due
+
+    # {stream: mark} for the newest mark of each stream whose records have
+    # all been popped
+    def released_marks(self):
+        done = {}
+        for stream, marks in self.marks.items():
+            released = self.released.get(stream, -1)
+            while marks and marks[0][0] <= released:
+                done[stream] = marks.popleft()[1]
+        return done
+
+    def stats(self):
+        return {
+            "held": len(self.heap),
+            "streams": len(self.latest),
+            "late": self.late
+        }
+
+
+# A rack snapshot: one reading per board, all taken within one scan period
+class RackSnapshot:
+    __slots__ = ("timestamp", "records")
+
+    def __init__(self, timestamp, records):
+        self.timestamp = timestamp
+        self.records = records
+
+    @property
+    def boards(self):
+        return [record.board for record in self.records]
+
+    @property
+    def message(self):
+        when = LOCAL.format(int(self.timestamp * 1000)) if not math.isnan(self.timestamp) else "?"
+        return f"Rack {when} " + " | ".join(record.message for record in self.records)
+
+    def __repr__(self):
+        return f"RackSnapshot({self.timestamp}, boards={self.boards})"
+
+
+# Groups a time-ordered record stream into RackSnapshots. A snapshot closes
+# when a record is `period` seconds or more after its first one, or a board
+# comes round again.
+class SnapshotBuilder:
+    def __init__(self, period):
+        self.period = period
+        self.records = []
+        self.boards = set()
+        self.started = math.nan
+        self.snapshots = 0
+
+    # Add the next record; returns the snapshot it closed, if any
+    def add(self, record):
+        closed = None
+        if self.records and (record.board in self.boards or record.timestamp - self.started >= self.period):
+            closed = self.flush()
+        if not self.records:
+            self.started = record.timestamp
+        self.records.append(record)
+        self.boards.add(record.board)
+        return closed
+
+    def flush(self):
+        if not self.records:
+            return None
+        snapshot = RackSnapshot(self.started, self.records)
+        self.records = []
+        self.boards = set()
+        self.snapshots += 1
+        return snapshot
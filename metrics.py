@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Lightweight metrics for the transmitter pipeline: counters, gauges and
+# latency histograms, labelled per oven, exported either as a JSON snapshot
+# file or as Prometheus text over a local HTTP endpoint. Pipeline stages
+# record into the module-level REGISTRY.
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+# Set up structured logging for an entry point ("DEBUG", "INFO", ...)
+def setup_logging(level="INFO"):
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO), format=LOG_FORMAT)
+
+
+def format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.value = 0
+
+    # Counters only go up; anything that can fall back is a Gauge
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError(f"{self.name} can only be increased, not by {amount}")
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def prometheus(self):
+        return [f"{self.name}{format_labels(self.labels)} {self.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+# A counter or gauge whose value is read from the owning object at export
+# time, for components that already keep their own counts
+class FunctionMetric(Counter):
+    def __init__(self, name, help_text, labels, function, kind):
+        super().__init__(name, help_text, labels)
+        self.function = function
+        self.kind = kind
+
+    @property
+    def value(self):
+        return self.function()
+
+    @value.setter
+    def value(self, value):
+        pass
+
+
+# Latency histogram with HdrHistogram-style log-linear buckets: each power of
+# two is split into 2**(sub_bits - 1) equal buckets, so a recorded value is
+# off by at most 1/2**(sub_bits - 1) of itself (about 3% with sub_bits=6).
+# Values are in seconds and kept as integer microseconds up to ~2**41 us.
+class Histogram:
+    kind = "summary"
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name, help_text, labels, sub_bits=6, max_bits=41):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half_count = self.sub_count >> 1
+        self.max_value = (1 << max_bits) - 1
+        # A fixed-size list, so exporting from another thread never sees it resize
+        self.counts = [0] * self.index(self.max_value) + [0]
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half_count + (value >> shift) - self.half_count
+
+    # Middle of the bucket at index, in microseconds
+    def value_at(self, index):
+        if index < self.sub_count:
+            return index
+        offset = index - self.sub_count
+        shift = offset // self.half_count + 1
+        lower = (offset % self.half_count + self.half_count) << shift
+        return lower + (1 << shift) / 2
+
+    def observe(self, seconds):
+        micros = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self.index(micros)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    # Time a block: with histogram.time(): ...
+    def time(self):
+        return _Timer(self)
+
+    def percentiles(self, quantiles=QUANTILES):
+        counts = list(self.counts)
+        total = sum(counts)
+        results = {}
+        if not total:
+            return {quantile: 0.0 for quantile in quantiles}
+        targets = sorted(quantiles)
+        seen = 0
+        position = 0
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+            seen += count
+            while position < len(targets) and seen >= targets[position] * total:
+                results[targets[position]] = self.value_at(index) / 1e6
+                position += 1
+            if position == len(targets):
+                break
+        return results
+
+    def snapshot(self):
+        snapshot = {"count": self.count, "sum": round(self.total, 6), "min": self.min, "max": self.max}
+        for quantile, value in self.percentiles().items():
+            snapshot[f"p{quantile * 100:g}"] = value
+        return snapshot
+
+    def prometheus(self):
+        lines = [f"{self.name}{format_labels(self.labels, ('quantile', quantile))} {value}"
+                 for quantile, value in self.percentiles().items()]
+        lines.append(f"{self.name}_sum{format_labels(self.labels)} {self.total}")
+        lines.append(f"{self.name}_count{format_labels(self.labels)} {self.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+# Metrics keyed by name and labels. Asking for an existing metric returns it,
+# except function metrics, which are re-bound (a reconnect builds a new
+# uplink, and its counters should be the ones exported).
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None or cls is FunctionMetric:
+                metric = self.metrics[key] = cls(name, help_text, key[1], *args)
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, **labels):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, **labels):
+        return self._get(Histogram, name, help_text, labels)
+
+    def counter_function(self, name, help_text, function, **labels):
+        return self._get(FunctionMetric, name, help_text, labels, function, "counter")
+
+    def gauge_function(self, name, help_text, function, **labels):
+        return self._get(FunctionMetric, name, help_text, labels, function, "gauge")
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            entry = snapshot.setdefault(metric.name, [])
+            entry.append({"labels": dict(metric.labels), "value": metric.snapshot()})
+        return {"time": time.time(), "metrics": snapshot}
+
+    def to_prometheus(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        name = None
+        for metric in metrics:
+            if metric.name != name:
+                name = metric.name
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Serves /metrics (Prometheus text) and /metrics.json on a local port
+class MetricsServer:
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry_.to_prometheus().encode('utf-8')
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry_.snapshot()).encode('utf-8')
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        log.info("Serving metrics on http://%s:%d/metrics", *self.server.server_address[:2])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Writes a JSON snapshot to path every interval seconds (atomically, so a
+# reader never sees half a file)
+class SnapshotWriter:
+    def __init__(self, path, interval=10.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(self.interval)
+        self.write()
+
+    def write(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.registry.snapshot(), file)
+        os.replace(temp_path, self.path)
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                log.warning("Could not write metrics snapshot %s: %s", self.path, e)
+
+
+# Start whichever exporters were asked for; returns them for stopping later
+def start_exporters(port=0, snapshot_path="", interval=10.0):
+    exporters = []
+    if port:
+        exporters.append(MetricsServer(port))
+    if snapshot_path:
+        exporters.append(SnapshotWriter(snapshot_path, interval))
+    for exporter in exporters:
+        exporter.start()
+    return exporters
+
+
+# Command line options shared by the headless entry points
+def add_arguments(arg_parser):
+    arg_parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR (default: INFO)")
+    arg_parser.add_argument("--metrics-port", type=int, default=0, help="serve Prometheus metrics on this local port")
+    arg_parser.add_argument("--metrics-file", default="", help="write a JSON metrics snapshot to this file")
+    arg_parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between JSON snapshots (default: 10)")
+
+
+def start_from_args(args):
+    setup_logging(args.log_level)
+    return start_exporters(args.metrics_port, args.metrics_file, args.metrics_interval)
@@ -0,0 +1,470 @@
+import time
+import json
+import logging
+import os
+from tailer import CheckpointStore, DirectoryTailer
+from logparser import ParsePool
+from burnsys import BurnsysSession, decode_e6, is_e6_frame
+from engine import TransmitterEngine
+from spool import Spool
+from records import BoardRecord, board_fields
+from limits import LimitFilter
+from reduction import Reducer
+from archive import ArchiveWriter, archive_path, session_id
+from merge import LiveMerger, SnapshotBuilder
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# Define the CONFIG File
+CONFIG_FILE = "oven_config.json"
+
+# Config keys that aren't sent to the ESP32, whose JSON document is only 2 KB
+TRANSMITTER_ONLY_KEYS = ("uplink_protocol", "spool_dir", "parse_workers", "parse_min_lines", "limit_mode", "limit_summary_interval", "reduction", "tail_start", "archive_dir", "index_dir", "merge_lookahead", "rack_snapshot_period")
+
+# Function to load the configuration from a file
+def load_config(config_file=CONFIG_FILE):
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as file:
+            config = json.load(file)
+    else:
+        config = {
+            "log_board_data": False,
+            "temperature_control": {
+                "allow_control_limits": False,
+                "lower_temp_value": 0.0,
+                "high_temp_value": 0.0,
+                "temp_limits_plus_minus": 0.0,
+                "ramp_rate": None
+            },
+            "board_data": {
+                "modbus_burnsys": "Modbus",
+                "is_treebeard": False,
+                "folder_path": "",
+                "com_port": "",
+                "allow_control_limits": False,
+                "control_limits": {
+                    "P1": {"plus_minus": 0.0, "additional_value": 0.0},
+                    "P2": {"plus_minus": 0.0, "additional_value": 0.0},
+                    "T1": {"plus_minus": 0.0, "low_temp_value": 0.0, "high_temp_value": 0.0},
+                    "T2": {"plus_minus": 0.0, "low_temp_value": 0.0, "high_temp_value": 0.0},
+                    "Vx": {"plus_minus": 0.0,  "additional_value": 0.0},
+                    "Vz": {"plus_minus": 0.0,  "additional_value": 0.0},
+                    "Ct": {"plus_minus": 0.0,  "additional_value": 0.0},
+                    "Vt": {"plus_minus": 0.0,  "additional_value": 0.0}
+                },
+                "sequence": "P1 P2 T1 T2 Vx Vz Ct Vt"
+            },
+            "transmitter_com":"",
+            "uplink_protocol": "ascii",
+            "spool_dir": "spool",
+            "parse_workers": 0,
+            "parse_min_lines": 2000,
+            "limit_mode": "all",
+            "limit_summary_interval": 60.0,
+            "reduction": {"deadband": {}, "window": 0.0, "window_statistic": "mean", "heartbeat": 0.0},
+            "tail_start": "beginning",
+            "archive_dir": "archive",
+            "index_dir": "index",
+            "merge_lookahead": 0.0,
+            "rack_snapshot_period": 0.0,
+        }
+        save_config(config, config_file)  # Save default config to file
+
+    # Ensure the 'com_port' key exists
+    if "com_port" not in config["board_data"]:
+        config["board_data"]["com_port"] = ""
+
+    # Older config files predate the binary uplink
+    if "uplink_protocol" not in config:
+        config["uplink_protocol"] = "ascii"
+
+    # Where outbound readings are kept until the transmitter has them
+    if "spool_dir" not in config:
+        config["spool_dir"] = "spool"
+
+    # Worker processes for parsing large Modbus/Treebeard batches (0 = in-thread)
+    if "parse_workers" not in config:
+        config["parse_workers"] = 0
+    if "parse_min_lines" not in config:
+        config["parse_min_lines"] = 2000
+
+    # Send every reading, or only the ones outside their control limits plus
+    # periodic per-board summaries
+    if "limit_mode" not in config:
+        config["limit_mode"] = "all"
+    if "limit_summary_interval" not in config:
+        config["limit_summary_interval"] = 60.0
+
+    # Change-based reporting; with no deadband, window or heartbeat every
+    # reading is sent
+    if "reduction" not in config:
+        config["reduction"] = {"deadband": {}, "window": 0.0, "window_statistic": "mean", "heartbeat": 0.0}
+
+    # Where to start on logs that have no tail checkpoint yet: "beginning",
+    # "end" or a time such as "2024-06-25 13:20:00"
+    if "tail_start" not in config:
+        config["tail_start"] = "beginning"
+
+    # Every active session's readings are archived here ("" to turn it off)
+    if "archive_dir" not in config:
+        config["archive_dir"] = "archive"
+
+    # Timestamp indexes of the tailed logs, for logindex.py queries ("" to turn them off)
+    if "index_dir" not in config:
+        config["index_dir"] = "index"
+
+    # How long (seconds) Modbus/Treebeard readings may wait for the other
+    # boards so they go out in time order, and the scan period to group them
+    # into rack snapshots over (0 = none)
+    if "merge_lookahead" not in config:
+        config["merge_lookahead"] = 0.0
+    if "rack_snapshot_period" not in config:
+        config["rack_snapshot_period"] = 0.0
+
+    return config
+
+# Function to save the configuration to a file
+def save_config(config, config_file=CONFIG_FILE):
+    with open(config_file, 'w') as file:
+        json.dump(config, file, indent=4)
+
+# Raised when a lifecycle command doesn't make sense in the current state
+class MonitorError(Exception):
+    pass
+
+
+# Runs the acquisition and uplink pipeline for one oven. It has no UI of its
+# own: each lifecycle method returns a message for the user (or None) and
+# raises if the command failed, so the Tk app, the headless service and the
+# control socket can all drive it the same way.
+class OvenMonitor:
+    # loop is an optional engine.LoopThread and parse_pool an optional
+    # logparser.ParsePool, both shared by several ovens
+    def __init__(self, config, config_file=CONFIG_FILE, loop=None, parse_pool=None):
+        self.config = config
+        self.config_file = config_file
+        self.loop = loop
+        self.parse_pool = parse_pool
+        self.oven_name = None
+        self.ws = None
+        self.engine = None  # Owns the transmitter serial port once connected
+        self.acquisition = None  # Future of the running board data logger
+        self.limit_filter = None  # Control limit checks for the running logger
+        self.reducer = None  # Deadband/window reduction for the running logger
+        self.archive = None  # Columnar archive of the running session's readings
+        self.merger = None  # Time-orders the Modbus/Treebeard boards' readings
+        self.rack_snapshot = None  # Latest merge.RackSnapshot
+        self.connected = False
+        self.monitoring = False
+        self.temperature = 0
+        self.board_number = 1
+        self.last_data_time = time.time()
+        self.BOARD_RESET_TIME = 20 * 60  # 20 minutes in seconds
+        self.COMMAND_TIMEOUT = 30  # Upper bound on waiting for the transmitter to reply
+
+    def establish_connection(self, oven_name):
+        if self.connected:
+            self.engine.run(self.engine.idle(), self.COMMAND_TIMEOUT)
+            return None
+
+        transmitter_com = self.config["transmitter_com"]
+        spool = Spool(os.path.join(self.config["spool_dir"], oven_name))
+        self.engine = TransmitterEngine(transmitter_com, protocol=self.config["uplink_protocol"], spool=spool, loop=self.loop, labels={"oven": oven_name})
+        self.engine.start()
+        try:
+            # Read the JSON configuration to send after CONNECT, minus the
+            # settings only the transmitter uses
+            with open(self.config_file, 'r') as f:
+                json_data = json.load(f)
+            for key in TRANSMITTER_ONLY_KEYS:
+                json_data.pop(key, None)
+
+            # Opens the port, sends CONNECT and the JSON config and waits for the replies
+            self.engine.run(self.engine.connect(oven_name, json_data), self.COMMAND_TIMEOUT)
+        except Exception:
+            self.engine.stop()
+            self.engine = None
+            raise
+        self.connected = True
+        self.oven_name = oven_name
+        return f"Connected to oven '{oven_name}' and idling."
+
+    def end_connection(self):
+        self.connected = False
+        self.stop_logging()
+        if self.engine:
+            try:
+                self.engine.run(self.engine.disconnect(), self.COMMAND_TIMEOUT)
+            except Exception as e:
+                log.warning("Disconnect was not acknowledged: %s", e)
+            self.engine.stop()
+            self.engine = None
+        self.oven_name = None
+        return "Connection ended."
+
+    def start_active_session(self):
+        if not self.connected:
+            raise MonitorError("Not connected to an oven.")
+        self.engine.run(self.engine.activate(), self.COMMAND_TIMEOUT)
+
+        # Check if logging is enabled
+        if self.config["log_board_data"]:
+            self.execute_logging_script(self.config["board_data"])
+        return "Active session started."
+
+    def end_active_session(self):
+        if not self.connected:
+            raise MonitorError("Not connected to an oven.")
+        self.stop_logging()
+        try:
+            self.engine.run(self.engine.idle(), self.COMMAND_TIMEOUT)
+        except Exception as e:
+            log.warning("Idle was not acknowledged: %s", e)
+        return "Switched back to idle state."
+
+    def status(self):
+        status = {
+            "oven": self.oven_name,
+            "connected": self.connected,
+            "monitoring": self.monitoring
+        }
+        if self.engine:
+            status.update(self.engine.stats())
+        if self.limit_filter:
+            status["limits"] = self.limit_filter.stats()
+        if self.reducer:
+            status["reduction"] = self.reducer.stats()
+        if self.archive:
+            status["archive"] = self.archive.stats()
+        if self.merger is not None:
+            status["merge"] = self.merger.stats()
+        if self.rack_snapshot:
+            status["rack"] = {"timestamp": self.rack_snapshot.timestamp, "boards": self.rack_snapshot.boards}
+        return status
+
+    # Let the running logger notice monitoring is off and finish its current pass
+    def stop_logging(self):
+        self.monitoring = False
+        if self.acquisition:
+            try:
+                self.acquisition.result(timeout=5)
+            except Exception as e:
+                log.error("Board data logging stopped with an error: %s", e)
+            self.acquisition = None
+            # The logger sends what it held back when it finishes; this
+            # catches a logger that stopped with an error
+            if self.engine:
+                try:
+                    self.engine.run(self.send_held(final=True), self.COMMAND_TIMEOUT)
+                except Exception as e:
+                    log.warning("Could not send the readings held back: %s", e)
+        if self.archive:
+            self.archive.close()
+            log.info("Archived session to %s: %s", self.archive.path, self.archive.stats())
+            self.archive = None
+
+    def execute_logging_script(self, board_data):
+        data_source = board_data["modbus_burnsys"]
+        self.stop_logging()
+        self.monitoring = True
+
+        # Compile the control limits for this session
+        self.limit_filter = LimitFilter.from_config(self.config, {"oven": self.oven_name})
+        self.reducer = Reducer.from_config(self.config, {"oven": self.oven_name})
+        if self.config["archive_dir"]:
+            session = session_id()
+            self.archive = ArchiveWriter(archive_path(self.config["archive_dir"], self.oven_name, session), self.oven_name, session,
+                                         labels={"oven": self.oven_name}, fields=board_fields(self.config))
+
+        if data_source == "Modbus":
+            is_treebeard = board_data["is_treebeard"]
+            folder_path = board_data["folder_path"]
+            # Call your specific function or script here based on the Modbus configuration
+            log.info("Data Source: %s, Treebeard: %s, Folder Path: %s", data_source, is_treebeard, folder_path)
+            # The logger runs as a task on the engine loop
+            self.acquisition = self.engine.spawn(self.log_modbus_data(is_treebeard, folder_path))
+        elif data_source == "Burnsys":
+            com_port = board_data["com_port"]
+            # Call your specific function or script here based on the Burnsys configuration
+            log.info("Data Source: %s, COM Port: %s", data_source, com_port)
+            self.acquisition = self.engine.spawn(self.log_burnsys_data(com_port))
+
+    # Send the limit summaries and the reducer's windows and heartbeats that
+    # are due, or with final=True everything still held back. Runs on the
+    # engine's loop.
+    async def send_held(self, final=False):
+        if not self.reducer:
+            return
+        summaries = self.limit_filter.flush(final=final) if self.limit_filter else []
+        records = self.reducer.process(summaries) + self.reducer.flush(final=final)
+        for record in records:
+            await self.engine.send(record, key=record.board)
+        if records:
+            REGISTRY.counter("records_queued_total", "Board records queued for the transmitter", oven=self.oven_name).inc(len(records))
+
+    # Board data loggers. Both run as tasks on the engine's event loop and hand
+    # their messages to the engine's outbound queue.
+    async def log_modbus_data(self, is_treebeard, folder_path):
+        sequence = self.config["board_data"]["sequence"]
+        # Parsing runs on the pool's parse thread, or for big batches in
+        # worker processes when parse_workers is set (or a supervisor shares
+        # its pool), never on the engine loop itself
+        pool = self.parse_pool or ParsePool(self.config["parse_workers"], self.config["parse_min_lines"])
+        labels = {"oven": self.oven_name}
+        parse_latency = REGISTRY.histogram("parse_batch_seconds", "Time to parse one batch of new log lines", **labels)
+        lines_read = REGISTRY.counter("parse_lines_total", "Log lines handed to the parser", **labels)
+        lines_skipped = REGISTRY.counter("parse_lines_skipped_total", "Log lines that could not be parsed", **labels)
+        records_queued = REGISTRY.counter("records_queued_total", "Board records queued for the transmitter", **labels)
+        rack_snapshots = REGISTRY.counter("rack_snapshots_total", "Rack snapshots built from the merged readings", **labels)
+        self.merger = merger = LiveMerger(self.config["merge_lookahead"])
+        stream_boards = {}  # log file -> board its readings are for
+        waiting = {}  # log file -> [(position, what its readings wait in)]
+        snapshots = SnapshotBuilder(self.config["rack_snapshot_period"]) if self.config["rack_snapshot_period"] else None
+        self.rack_snapshot = None
+
+        async def send_to_arduino(records):
+            if snapshots:
+                for record in records:
+                    snapshot = snapshots.add(record)
+                    if snapshot:
+                        self.rack_snapshot = snapshot
+                        rack_snapshots.inc()
+                        log.debug("%s", snapshot.message)
+            # Check the control limits (and, in exceptions mode, drop what is within them)
+            outgoing = self.limit_filter.process(records)
+            # Every reading goes into the session archive, whatever is sent
+            if self.archive:
+                self.archive.append(records)
+            # Hold back readings that haven't moved past their deadband
+            records = self.reducer.process(outgoing)
+            # Queue the parsed data for the Arduino; the uplink paces the writes
+            for record in records:
+                await self.engine.send(record, key=record.board)
+                log.debug("Sent to Arduino: %s", record.message)
+            records_queued.inc(len(records))
+
+        # What holds a board's readings back: its pending limit summary and its
+        # open reduction window
+        def holding(board):
+            return self.limit_filter.holding(board), self.reducer.holding(board)
+
+        # Commit the positions whose readings are all in the spool. A reading
+        # held for a summary or folded into an open window isn't yet, so its
+        # position waits until that summary or window has gone out.
+        def commit_positions():
+            for file_path, position in merger.released_marks().items():
+                waiting.setdefault(file_path, []).append((position, holding(stream_boards.get(file_path))))
+            ready = {}
+            for file_path, positions in waiting.items():
+                current = holding(stream_boards.get(file_path))
+                while positions and all(held is None or held is not now_held for held, now_held in zip(positions[0][1], current)):
+                    ready[file_path] = positions.pop(0)[0]
+            tailer.commit(ready)
+
+        # A log file that was deleted or rotated away no longer holds the
+        # other boards back
+        def forget_stream(file_path):
+            merger.forget(file_path)
+            waiting.pop(file_path, None)
+            stream_boards.pop(file_path, None)
+
+        # Keep tailing the folder for as long as the session is active. The
+        # tailer waits for changes on the loop, not on a thread of its own.
+        # Tail positions are kept next to the spool, so a restart resumes
+        # each log after the last line that made it into the spool.
+        checkpoints = CheckpointStore(os.path.join(self.config["spool_dir"], self.oven_name, "tail.json"))
+        index_dir = os.path.join(self.config["index_dir"], self.oven_name) if self.config["index_dir"] else None
+        try:
+            with DirectoryTailer(folder_path, labels=labels, checkpoints=checkpoints, start=self.config["tail_start"], index_dir=index_dir,
+                                 on_forget=forget_stream) as tailer:
+                while self.monitoring:
+                    await tailer.wait_async(timeout=1.0)
+                    paths = []
+                    changes = []
+                    for file_path, lines in tailer.poll_lines(timeout=0):
+                        log.debug("%d new line(s) in %s", len(lines), file_path)
+                        lines_read.inc(len(lines))
+                        paths.append(file_path)
+                        changes.append((os.path.basename(file_path), lines))
+
+                    if changes:
+                        # Results come back in the order of the changes, so each board stays in order
+                        with parse_latency.time():
+                            parsed = await pool.parse_batch(changes, sequence, is_treebeard)
+                        for file_path, (filename, lines), (_, rows, records) in zip(paths, changes, parsed):
+                            if rows < len(lines):
+                                log.info("Skipped %d line(s) from %s that could not be parsed", len(lines) - rows, filename)
+                                lines_skipped.inc(len(lines) - rows)
+                            # Each board's readings wait in the merger until the others catch up
+                            if records:
+                                stream_boards[file_path] = records[0].board
+                            merger.push(file_path, records, mark=tailer.position(file_path))
+
+                    due = merger.pop()
+                    if due:
+                        await send_to_arduino([record for _, record in due])
+                    # Windows and heartbeats of boards that have gone quiet
+                    await self.send_held()
+                    commit_positions()
+
+                # Send what the merger still holds before the session ends
+                due = merger.drain()
+                if due:
+                    await send_to_arduino([record for _, record in due])
+                await self.send_held(final=True)
+                commit_positions()
+        finally:
+            if pool is not self.parse_pool:
+                pool.close()
+
+    async def log_burnsys_data(self, com_port):
+        log.info("Logging Burnsys data on COM port: %s", com_port)
+        labels = {"oven": self.oven_name}
+        records_queued = REGISTRY.counter("records_queued_total", "Board records queued for the transmitter", **labels)
+
+        async def format_and_send_data(parsed_data, frame):
+            board_str = f"Board: {self.board_number:02} "
+            data_str = " ".join([f"{key}:{int(value)}" for key, value in parsed_data.items()])
+
+            # Combine the strings into the final format
+            message = board_str + data_str
+            log.debug("Sending to Arduino: %s", message)
+
+            # Queue the formatted message for the Arduino
+            record = BoardRecord(f"{self.board_number:02}", parsed_data, message, frame.received, frame.captured)
+            outgoing = self.limit_filter.process([record])
+            if self.archive:
+                self.archive.append([record])
+            for record in self.reducer.process(outgoing):
+                await self.engine.send(record, key=record.board)
+                records_queued.inc()
+
+        async def handle_frame(frame):
+            if not is_e6_frame(frame):
+                # Status/exception frames don't carry board readings
+                log.info("Status frame from address %d: %s", frame.address, frame.raw.hex())
+                return
+
+            # Time check before numbering the board
+            time_difference = time.time() - self.last_data_time
+            if time_difference > self.BOARD_RESET_TIME:
+                log.info("No data received for %g minutes. Resetting board number counter.", self.BOARD_RESET_TIME / 60)
+                self.board_number = 1  # Reset board number counter
+
+            parsed_data = decode_e6(frame)
+            self.last_data_time = time.time()  # Update last data time only when data is received
+            log.debug("Board %d Data: %s", self.board_number, parsed_data)
+            # Format and send the data to Arduino
+            await format_and_send_data(parsed_data, frame)
+            self.board_number += 1  # Increment board number after successful data processing
+
+        # The session keeps the COM port open and decodes frames on its own thread
+        with BurnsysSession(com_port, labels=labels) as session:
+            while self.monitoring:
+                frame = await session.next_frame(timeout=1.0)
+                if frame:
+                    await handle_frame(frame)
+                await self.send_held()
+            await self.send_held(final=True)
+            log.info("Burnsys session on %s finished: %s", com_port, session.stats())
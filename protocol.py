@@ -0,0 +1,151 @@
+import logging
+import math
+import struct
+
+from burnsys import crc16
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# Binary uplink framing ("BIN1"), an optional alternative to the ASCII
+# "Board: 03 P1:99 ..." lines. It is negotiated after CONNECT: the transmitter
+# sends "PROTO BIN1" and switches only if the bridge answers "PROTO BIN1 OK".
+# In binary mode the bridge acknowledges every frame with "ACK <seq>".
+#
+#   offset  size  field
+#   0       2     sync 0xA5 0x5A
+#   2       1     protocol version (1)
+#   3       1     frame type (1 = board record)
+#   4       1     sequence number (wraps at 256)
+#   5       1     body length N
+#   6       2     board id (uint16, big endian)
+#   8       2     field bitmap (bit 0 = P1 ... bit 7 = Vt)
+#   10      2*k   one int16 (big endian) per set bit, value * scale
+#   6+N     2     CRC-16/MODBUS of bytes 2 .. 6+N-1, little endian
+
+SYNC = b"\xa5\x5a"
+VERSION = 1
+BOARD_RECORD = 1
+NEGOTIATE_COMMAND = "PROTO BIN1"
+NEGOTIATE_OK = "PROTO BIN1 OK"
+ACK_PREFIX = "ACK "
+
+# Field order for the bitmap and the fixed-point scale of each field
+FIELDS = ("P1", "P2", "T1", "T2", "Vx", "Vz", "Ct", "Vt")
+SCALES = (10, 10, 10, 10, 1000, 1000, 10, 10)
+
+HEADER = struct.Struct(">2sBBBB")
+BODY_HEADER = struct.Struct(">HH")
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+
+class ProtocolError(Exception):
+    pass
+
+
+CLAMPED = REGISTRY.counter("uplink_values_clamped_total", "Binary uplink values outside the int16 range of their field")
+_clamped_fields = set()
+
+
+# A value that doesn't fit in an int16 at its field's scale (e.g. Vx of
+# 32.768 or more) goes out as the nearest end of the range. Every one is
+# counted, and the first for each field logged.
+def to_fixed(value, scale, key=None):
+    fixed = value * scale
+    if INT16_MIN - 0.5 <= fixed < INT16_MAX + 0.5:
+        return round(fixed)
+    CLAMPED.inc()
+    if key not in _clamped_fields:
+        _clamped_fields.add(key)
+        log.warning("%s value %r is out of range for the binary uplink, sending it clamped", key or "A", value)
+    return INT16_MIN if fixed < 0 else INT16_MAX
+
+
+# Encode one board record. Missing (NaN) values and fields the protocol
+# doesn't know about are left out of the bitmap.
+def encode_record(board_id, values, seq):
+    bitmap = 0
+    fixed = []
+    for bit, (key, scale) in enumerate(zip(FIELDS, SCALES)):
+        value = values.get(key)
+        if value is None or math.isnan(value):
+            continue
+        bitmap |= 1 << bit
+        fixed.append(to_fixed(value, scale, key))
+
+    body = BODY_HEADER.pack(board_id & 0xFFFF, bitmap) + struct.pack(f">{len(fixed)}h", *fixed)
+    frame = HEADER.pack(SYNC, VERSION, BOARD_RECORD, seq & 0xFF, len(body)) + body
+    return frame + crc16(frame, 2).to_bytes(2, byteorder='little')
+
+
+# Decode one complete frame into (seq, board_id, values)
+def decode_frame(data):
+    if len(data) < HEADER.size + BODY_HEADER.size + 2:
+        raise ProtocolError("Frame too short")
+    sync, version, frame_type, seq, length = HEADER.unpack_from(data, 0)
+    if sync != SYNC:
+        raise ProtocolError("Bad sync bytes")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if frame_type != BOARD_RECORD:
+        raise ProtocolError(f"Unknown frame type {frame_type}")
+    end = HEADER.size + length
+    if len(data) != end + 2:
+        raise ProtocolError("Frame length doesn't match its header")
+    if crc16(data, 2, end) != int.from_bytes(data[end:end + 2], byteorder='little'):
+        raise ProtocolError("CRC mismatch")
+
+    board_id, bitmap = BODY_HEADER.unpack_from(data, HEADER.size)
+    count = bin(bitmap & 0xFF).count("1")
+    if length != BODY_HEADER.size + 2 * count:
+        raise ProtocolError("Body length doesn't match the field bitmap")
+    fixed = struct.unpack_from(f">{count}h", data, HEADER.size + BODY_HEADER.size)
+    values = {}
+    index = 0
+    for bit, (key, scale) in enumerate(zip(FIELDS, SCALES)):
+        if bitmap & (1 << bit):
+            values[key] = fixed[index] / scale
+            index += 1
+    return seq, board_id, values
+
+
+# Known-good encodings. Any change to the framing must keep these passing (or
+# bump VERSION), since the ESP32 firmware is built against the same layout.
+GOLDEN_VECTORS = [
+    (3, {"P1": 99, "P2": 98, "T1": 25.3, "T2": 26.4, "Vx": 0.023, "Vz": 0.011, "Ct": 10.0, "Vt": 121.0}, 0,
+     "a55a01010014000300ff03de03d400fd01080017000b006404baaa16"),
+    (12, {"P1": 1.5, "T1": -4.2}, 7,
+     "a55a01010708000c0005000fffd6bb4a"),
+    (65535, {}, 255,
+     "a55a0101ff04ffff000074ec"),
+]
+
+
+def check_golden_vectors():
+    for board_id, values, seq, expected in GOLDEN_VECTORS:
+        frame = encode_record(board_id, values, seq)
+        if frame.hex() != expected:
+            raise AssertionError(f"Encoding board {board_id} gave {frame.hex()}, expected {expected}")
+        decoded_seq, decoded_board, decoded = decode_frame(bytes.fromhex(expected))
+        if decoded_seq != seq or decoded_board != board_id or decoded.keys() != values.keys():
+            raise AssertionError(f"Decoding board {board_id} gave {decoded_seq}, {decoded_board}, {decoded}")
+        for key, value in values.items():
+            scale = SCALES[FIELDS.index(key)]
+            if abs(decoded[key] - value) > 0.5 / scale:
+                raise AssertionError(f"Board {board_id} {key} decoded as {decoded[key]}, expected {value}")
+
+    # A corrupted frame must be rejected
+    corrupted = bytearray.fromhex(GOLDEN_VECTORS[0][3])
+    corrupted[9] ^= 0x01
+    try:
+        decode_frame(bytes(corrupted))
+    except ProtocolError:
+        pass
+    else:
+        raise AssertionError("Corrupted frame was accepted")
+
+
+if __name__ == "__main__":
+    check_golden_vectors()
+    print(f"{len(GOLDEN_VECTORS)} golden vectors OK")
@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Encoding and batching for messages published to the ingest server.
+#
+# Per-sample mode sends every message as its own frame, exactly as before:
+#   {"type": "newOvenData", "data": {...}}
+# Batch mode packs consecutive samples into one frame, which server.js
+# unpacks and handles like separate messages:
+#   {"type": "newOvenDataBatch", "data": [{...}, {...}, ...]}
+# Other messages (identify, ovenActive, stop) always go out on their own,
+# after any samples queued before them, so the order is kept.
+
+SAMPLE_TYPE = "newOvenData"
+BATCH_TYPE = "newOvenDataBatch"
+
+
+# Serialize a message to JSON text, with orjson when it is installed.
+# Both produce compact JSON the server parses the same way.
+def dumps(message):
+    if orjson is not None:
+        return orjson.dumps(message).decode('utf-8')
+    return json.dumps(message, separators=(',', ':'))
+
+
+# Pack a list of messages into frames: runs of samples become batch frames
+# of at most max_batch samples, everything else is sent as is
+def encode_messages(messages, batch=True, max_batch=100):
+    frames = []
+    samples = []
+    for message in messages:
+        if batch and message.get("type") == SAMPLE_TYPE:
+            samples.append(message["data"])
+            if len(samples) >= max_batch:
+                frames.append(dumps({"type": BATCH_TYPE, "data": samples}))
+                samples = []
+            continue
+        if samples:
+            frames.append(dumps({"type": BATCH_TYPE, "data": samples}))
+            samples = []
+        frames.append(dumps(message))
+    if samples:
+        frames.append(dumps({"type": BATCH_TYPE, "data": samples}))
+    return frames
+
+
+# Number of samples in an encoded frame's message
+def sample_count(message):
+    if message.get("type") == BATCH_TYPE:
+        return len(message["data"])
+    return 1 if message.get("type") == SAMPLE_TYPE else 0
+
+
+# Batches samples for one websocket. A batch goes out once it holds
+# max_batch samples or its oldest sample has waited max_latency seconds,
+# whichever comes first. send(frame) is the socket's async send. With
+# batch=False every message is sent straight away, one per frame.
+class BatchPublisher:
+    def __init__(self, send, batch=True, max_batch=100, max_latency=0.05):
+        self.send = send
+        self.batch = batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.samples = []
+        self.timer = None
+        self.lock = asyncio.Lock()
+        self.frames_sent = 0
+        self.samples_sent = 0
+
+    async def publish(self, message):
+        if not self.batch or message.get("type") != SAMPLE_TYPE:
+            await self.flush()
+            await self._send(dumps(message), sample_count(message))
+            return
+        self.samples.append(message["data"])
+        if len(self.samples) >= self.max_batch:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_latency, self._flush_later)
+
+    def _flush_later(self):
+        self.timer = None
+        if self.samples:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.samples:
+            return
+        samples = self.samples
+        self.samples = []
+        await self._send(dumps({"type": BATCH_TYPE, "data": samples}), len(samples))
+
+    async def _send(self, frame, samples):
+        # Timer flushes and direct sends mustn't interleave on the socket
+        async with self.lock:
+            await self.send(frame)
+        self.frames_sent += 1
+        self.samples_sent += samples
+
+    async def close(self):
+        await self.flush()
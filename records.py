@@ -0,0 +1,86 @@
+import math
+import time
+
+from protocol import FIELDS
+
+NAN = float("nan")
+
+
+# The fields the reduction, limits and archive stages track: the protocol's
+# fields, then any other names a user-edited board_data.sequence gives the
+# Modbus log columns
+def board_fields(config):
+    sequence = config.get("board_data", {}).get("sequence", "").split()
+    return FIELDS + tuple(key for key in dict.fromkeys(sequence) if key not in FIELDS)
+
+
+# Format a worked-out value (of a summary or window) for its ASCII line:
+# "99", "1.11266" or "N/A". Parsed rows keep their log text instead.
+def format_value(value):
+    if math.isnan(value):
+        return "N/A"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# One reading for one board as it moves from a parser to the uplink. values
+# maps field names (P1, P2, ...) to floats and message is the ASCII line the
+# ESP32 bridge understands, built by the parser that produced the record.
+# limits ({field: (lower, upper)}) and failed (fields outside them) are
+# filled in by limits.LimitFilter when control limits are checked.
+# timestamp is when the source says the reading was taken (epoch seconds)
+# and captured when the transmitter took it in (time.monotonic()), so the
+# time a record spends in here can be measured.
+class BoardRecord:
+    __slots__ = ("board", "values", "message", "timestamp", "captured", "limits", "failed")
+
+    def __init__(self, board, values, message, timestamp=NAN, captured=NAN):
+        self.board = board
+        self.values = values
+        self.message = message
+        self.timestamp = timestamp
+        self.captured = captured
+        self.limits = None
+        self.failed = ()
+
+    # Numeric board id for the binary uplink, 0 if the board isn't numbered
+    @property
+    def board_id(self):
+        try:
+            return int(self.board)
+        except (TypeError, ValueError):
+            return 0
+
+    def __repr__(self):
+        return f"BoardRecord({self.message!r})"
+
+
+# A record that wasn't parsed from a board line but worked out from several
+# readings (a summary or a window), with its own "Board: NN ..." line
+def summary_record(board, values, timestamp=NAN):
+    message = f"Board: {board} " + " ".join(f"{key}:{format_value(value)}" for key, value in values.items())
+    return BoardRecord(board, values, message, timestamp, time.monotonic())
+
+
+# Log time as the pipeline has seen it: the newest reading timestamp, moved
+# on by the wall time since it arrived so that time keeps passing while the
+# boards are quiet. Replayed backlogs run on their own timestamps rather
+# than on the (much shorter) time it takes to replay them.
+class LogClock:
+    def __init__(self):
+        self.latest = NAN
+        self.seen_at = 0.0
+
+    def observe(self, timestamp, now=None):
+        if math.isnan(timestamp) or timestamp <= self.latest:
+            return
+        self.latest = timestamp
+        self.seen_at = time.time() if now is None else now
+
+    # The log time now; now is the wall time (time.time() by default)
+    def time(self, now=None):
+        now = time.time() if now is None else now
+        if math.isnan(self.latest):
+            return now
+        return self.latest + max(0.0, now - self.seen_at)
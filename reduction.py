@@ -0,0 +1,249 @@
+import logging
+import math
+
+from metrics import REGISTRY
+from protocol import FIELDS
+from records import LogClock, board_fields, summary_record
+
+log = logging.getLogger(__name__)
+
+# Change-based reporting between the parsers and the uplink. Boards report
+# every ~15 s, and during a long soak most readings repeat the last one, so
+# per board a reading is only sent when:
+#
+#   it is the board's first reading,
+#   a field moved more than its deadband from the value last sent,
+#   it has fields outside their control limits (never held back), or
+#   nothing was sent for the board for `heartbeat` seconds.
+#
+# Readings held back are folded into a per-board window; after `window`
+# seconds the window goes out as one reading holding the mean, min, max or
+# last value of each field (window_statistic). Sending a reading starts a new
+# window. The counters say exactly how many readings were held back and how
+# many went out for which reason.
+#
+# Windows and heartbeats run on the readings' own timestamps (a LogClock),
+# so a backlog replayed from the start of a log is reduced the same way it
+# would have been live. flush() sends the windows and heartbeats that fall
+# due while a board is quiet; the logger calls it on every pass and with
+# final=True when the session ends, which sends every open window.
+#
+# Configured under "reduction" in oven_config.json:
+#
+#   "reduction": {"deadband": {"P1": 0.5, "T1": 1.0}, "window": 300,
+#                 "window_statistic": "max", "heartbeat": 900}
+#
+# deadband can also be a single number for every field. Each setting works
+# on its own: with only a window every reading after a board's first is
+# folded into windows, with only a heartbeat a board sends one reading per
+# heartbeat (and excursions). With none of them every reading is sent, as
+# before. A reading with none of the tracked fields (see
+# records.board_fields) is sent as it is.
+
+WINDOW_STATISTICS = ("mean", "min", "max", "last")
+SEND_REASONS = ("first", "change", "excursion", "heartbeat", "window", "untracked")
+
+
+class BoardWindow:
+    __slots__ = ("fields", "minimum", "maximum", "total", "count", "last", "readings", "started", "ended")
+
+    def __init__(self, fields, started):
+        self.fields = fields
+        size = len(fields)
+        self.minimum = [math.inf] * size
+        self.maximum = [-math.inf] * size
+        self.total = [0.0] * size
+        self.count = [0] * size
+        self.last = [math.nan] * size
+        self.readings = 0
+        self.started = started
+        self.ended = started
+
+    def add(self, row, at):
+        self.readings += 1
+        self.ended = at
+        for i, value in enumerate(row):
+            if math.isnan(value):
+                continue
+            if value < self.minimum[i]:
+                self.minimum[i] = value
+            if value > self.maximum[i]:
+                self.maximum[i] = value
+            self.total[i] += value
+            self.count[i] += 1
+            self.last[i] = value
+
+    def values(self, statistic):
+        values = {}
+        for i, key in enumerate(self.fields):
+            if not self.count[i]:
+                continue
+            if statistic == "mean":
+                values[key] = round(self.total[i] / self.count[i], 6)
+            elif statistic == "min":
+                values[key] = self.minimum[i]
+            elif statistic == "max":
+                values[key] = self.maximum[i]
+            else:
+                values[key] = self.last[i]
+        return values
+
+
+class BoardState:
+    __slots__ = ("sent_values", "sent_at", "window", "held")
+
+    def __init__(self):
+        self.sent_values = None
+        self.sent_at = 0.0
+        self.window = None
+        self.held = None  # Latest reading held back outside a window, for a heartbeat
+
+
+class Reducer:
+    def __init__(self, deadband=None, window=0.0, window_statistic="mean", heartbeat=0.0, labels=None, fields=FIELDS):
+        if window_statistic not in WINDOW_STATISTICS:
+            raise ValueError(f"Unknown window_statistic {window_statistic!r}, expected one of {', '.join(WINDOW_STATISTICS)}")
+        self.fields = fields
+        if isinstance(deadband, (int, float)):
+            deadband = {key: deadband for key in fields}
+        deadband = deadband or {}
+        self.deadband = [(i, float(deadband[key])) for i, key in enumerate(fields) if deadband.get(key) is not None]
+        self.window = window
+        self.window_statistic = window_statistic
+        self.heartbeat = heartbeat
+        self.boards = {}
+        self.clock = LogClock()
+        labels = labels or {}
+        self.received = REGISTRY.counter("reduction_records_received_total", "Board records entering the reduction stage", **labels)
+        self.suppressed = REGISTRY.counter("reduction_records_suppressed_total", "Board records held back by the reduction stage", **labels)
+        self.suppressed_bytes = REGISTRY.counter("reduction_bytes_suppressed_total", "Uplink bytes of the records held back", **labels)
+        # What goes out in place of held-back records (window records and held
+        # readings sent on a heartbeat); the saving is suppressed - released
+        self.released = REGISTRY.counter("reduction_records_released_total", "Records sent in place of records held back", **labels)
+        self.released_bytes = REGISTRY.counter("reduction_bytes_released_total", "Uplink bytes sent in place of records held back", **labels)
+        self.sent = {reason: REGISTRY.counter("reduction_records_sent_total", "Board records sent by the reduction stage, by reason", reason=reason, **labels)
+                     for reason in SEND_REASONS}
+
+    @classmethod
+    def from_config(cls, config, labels=None):
+        settings = config.get("reduction") or {}
+        return cls(settings.get("deadband"), settings.get("window", 0.0), settings.get("window_statistic", "mean"),
+                   settings.get("heartbeat", 0.0), labels, board_fields(config))
+
+    def _row(self, values):
+        return [float(values.get(key, math.nan)) for key in self.fields]
+
+    @property
+    def enabled(self):
+        return bool(self.deadband or self.window or self.heartbeat)
+
+    def _reason(self, record, row, state, now):
+        if state.sent_values is None:
+            return "first"
+        if record.failed:
+            return "excursion"
+        sent_values = state.sent_values
+        for i, band in self.deadband:
+            value, sent = row[i], sent_values[i]
+            if math.isnan(value):
+                continue
+            if math.isnan(sent) or abs(value - sent) > band:
+                return "change"
+        if self.heartbeat and now - state.sent_at >= self.heartbeat:
+            return "heartbeat"
+        return None
+
+    def _mark_sent(self, state, row, reason, now):
+        state.sent_values = row
+        state.sent_at = now
+        state.window = None
+        state.held = None
+        self.sent[reason].inc()
+
+    # Return the records to send out of a batch, oldest first. now is the
+    # wall time, used for readings without a timestamp of their own.
+    def process(self, records, now=None):
+        if not self.enabled:
+            return records
+        outgoing = []
+        for record in records:
+            self.received.inc()
+            self.clock.observe(record.timestamp, now)
+            at = self.clock.time(now) if math.isnan(record.timestamp) else record.timestamp
+            row = self._row(record.values)
+            if all(math.isnan(value) for value in row):
+                # Nothing to compare or fold into a window
+                self.sent["untracked"].inc()
+                outgoing.append(record)
+                continue
+            state = self.boards.get(record.board)
+            if state is None:
+                state = self.boards[record.board] = BoardState()
+            # A window that has run its time goes out before the next reading
+            if state.window is not None and at - state.window.started >= self.window:
+                outgoing.append(self._close_window(record.board, state, "window"))
+            reason = self._reason(record, row, state, at)
+            if reason:
+                # A window still open is superseded by this reading
+                self._mark_sent(state, row, reason, at)
+                outgoing.append(record)
+                continue
+            self.suppressed.inc()
+            self.suppressed_bytes.inc(len(record.message) + 1)
+            if self.window:
+                if state.window is None:
+                    state.window = BoardWindow(self.fields, at)
+                state.window.add(row, at)
+            else:
+                state.held = record
+        outgoing.extend(self.flush(now))
+        return outgoing
+
+    # Send the windows and heartbeats that are due by log time, for boards
+    # that have gone quiet as well; final sends every open window
+    def flush(self, now=None, final=False):
+        if not self.enabled:
+            return []
+        now = self.clock.time(now)
+        due = []
+        for board, state in self.boards.items():
+            window = state.window
+            if window is not None and (final or now - window.started >= self.window):
+                due.append(self._close_window(board, state, "window"))
+            elif self.heartbeat and now - state.sent_at >= self.heartbeat:
+                if window is not None:
+                    due.append(self._close_window(board, state, "heartbeat"))
+                elif state.held is not None:
+                    # The latest reading held back goes out after all
+                    record = state.held
+                    self.released.inc()
+                    self.released_bytes.inc(len(record.message) + 1)
+                    self._mark_sent(state, self._row(record.values), "heartbeat", now)
+                    due.append(record)
+        return due
+
+    # The open window holding a board's readings back, if any. It is a new
+    # object for every window, so a caller can tell when one has gone out.
+    def holding(self, board):
+        state = self.boards.get(board)
+        return state.window if state else None
+
+    # The readings in a board's window go out as one record
+    def _close_window(self, board, state, reason):
+        window = state.window
+        values = window.values(self.window_statistic)
+        record = summary_record(board, values, window.ended)
+        self.released.inc()
+        self.released_bytes.inc(len(record.message) + 1)
+        self._mark_sent(state, self._row(values), reason, window.ended)
+        return record
+
+    def stats(self):
+        return {
+            "received": self.received.value,
+            "suppressed": self.suppressed.value,
+            "suppressed_bytes": self.suppressed_bytes.value,
+            "released": self.released.value,
+            "released_bytes": self.released_bytes.value,
+            "sent": {reason: counter.value for reason, counter in self.sent.items()}
+        }
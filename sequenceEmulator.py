@@ -1,7 +1,21 @@
+import argparse
 import random
+import sys
 import time
-import json
-from websocket import create_connection
+from collections import namedtuple
+
+from publish import dumps, encode_messages
+from timestamps import UTC, now_ms
+
+try:
+    from websocket import create_connection
+except ImportError:  # only needed to run this script, not for loadgen.py
+    create_connection = None
+
+try:
+    import numpy as np
+except ImportError:  # only needed for synthesized profiles
+    np = None
 
 # Define the WebSocket URL
 WEBSOCKET_URL = "ws://192.168.0.11:3000"
@@ -21,21 +35,35 @@ sequence = [
     {"temperature": 25, "heat_cool_duration": 35, "soak_time": 30}
 ]
 
+# Timestamp in the format the server expects; at is epoch seconds, default now
+def format_timestamp(at=None):
+    return UTC.format(now_ms() if at is None else int(at * 1000), "T", False, "Z")
+
 # Function to generate oven data
-def generate_oven_data(oven_name, temperature, upper_control_limit, lower_control_limit, is_ramping):
+def generate_oven_data(oven_name, temperature, upper_control_limit, lower_control_limit, is_ramping, at=None):
     return {
         "ovenId": oven_name,
         "temperature": temperature,
         "temperatureUpperControlLimit": None,
         "temperatureLowerControlLimit": None,
         "dataType": "Oven",
-        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "timestamp": format_timestamp(at),
         "hasOvenControlLimits": False,
         "hasBoardControlLimits": False
     }
 
-# Function to generate board data
-def generate_board_data(oven_name, temperature, upper_control_limit, lower_control_limit):
+# Board parameters and the range their random values are drawn from
+BOARD_FIELDS = ("p1", "p2", "t1", "t2", "vx", "vz", "ct", "vt")
+BOARD_RANGES = ((20, 80), (20, 60), (20, 60), (20, 60), (20, 60), (20, 60), (20, 60), (20, 60))
+BOARD_IDS = (1, 5)
+
+# Function to generate board data. values (keyed by BOARD_FIELDS) and
+# board_id are random unless given, e.g. from a synthesized profile.
+def generate_board_data(oven_name, temperature, upper_control_limit, lower_control_limit, at=None, values=None, board_id=None):
+    if values is None:
+        values = {key: random.uniform(low, high) for key, (low, high) in zip(BOARD_FIELDS, BOARD_RANGES)}
+    if board_id is None:
+        board_id = random.randint(*BOARD_IDS)
     board_limits = {
         "p1": (65, 15),
         "p2": (65, 15),
@@ -51,113 +79,276 @@ def generate_board_data(oven_name, temperature, upper_control_limit, lower_contr
         "temperature": temperature,
         "temperatureUpperControlLimit": upper_control_limit,
         "temperatureLowerControlLimit": lower_control_limit,
-        "p1": random.uniform(20, 80),
+        "p1": values["p1"],
         "p1UpperControlLimit": board_limits["p1"][0],
         "p1LowerControlLimit": board_limits["p1"][1],
-        "p2": random.uniform(20, 60),
+        "p2": values["p2"],
         "p2UpperControlLimit": board_limits["p2"][0],
         "p2LowerControlLimit": board_limits["p2"][1],
-        "t1": random.uniform(20, 60),
+        "t1": values["t1"],
         "t1UpperControlLimit": board_limits["t1"][0],
         "t1LowerControlLimit": board_limits["t1"][1],
-        "t2": random.uniform(20, 60),
+        "t2": values["t2"],
         "t2UpperControlLimit": board_limits["t2"][0],
         "t2LowerControlLimit": board_limits["t2"][1],
-        "vx": random.uniform(20, 60),
+        "vx": values["vx"],
         "vxUpperControlLimit": board_limits["vx"][0],
         "vxLowerControlLimit": board_limits["vx"][1],
-        "vz": random.uniform(20, 60),
+        "vz": values["vz"],
         "vzUpperControlLimit": board_limits["vz"][0],
         "vzLowerControlLimit": board_limits["vz"][1],
-        "ct": random.uniform(20, 60),
+        "ct": values["ct"],
         "ctUpperControlLimit": board_limits["ct"][0],
         "ctLowerControlLimit": board_limits["ct"][1],
-        "vt": random.uniform(20, 60),
+        "vt": values["vt"],
         "vtUpperControlLimit": board_limits["vt"][0],
         "vtLowerControlLimit": board_limits["vt"][1],
         "dataType": "Board",
-        "boardId": f"{random.randint(1, 5)}",
-        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "boardId": f"{board_id}",
+        "timestamp": format_timestamp(at),
         "hasOvenControlLimits": False,
         "hasBoardControlLimits": True
     }
 
 # Function to send a WebSocket notification
 def send_websocket_notification(ws, data):
-    ws.send(json.dumps({"type": "newOvenData", "data": data}))
+    ws.send(dumps({"type": "newOvenData", "data": data}))
 
 def send_oven_active_message(ws, oven_name):
-    ws.send(json.dumps({"type": "ovenActive", "data": {"ovenId": oven_name}}))
+    ws.send(dumps({"type": "ovenActive", "data": {"ovenId": oven_name}}))
 
-# Main loop to emulate the sequence
-def emulate_oven_sequence(oven_name, sequence):
-    ws = create_connection(WEBSOCKET_URL)
-    ws.send(json.dumps({"type": "identify", "clientId": oven_name}))
-    try:
-        current_temp = sequence[0]["temperature"]  # Initialize current temperature
-        idle_time = 20
-        
-        # Send idle data for 20 seconds
-        for _ in range(idle_time):
-            data = generate_oven_data(oven_name, 25, 27, 23, False)
-            send_websocket_notification(ws, data)
-            time.sleep(1)
-        
-        # Send oven active message
-        send_oven_active_message(ws, oven_name)
-        
-        for step in sequence:
-            target_temp = step["temperature"]
-            soak_time = step["soak_time"]
-            initial_temp = current_temp
-            
-            # Determine if we are heating or cooling
-            if current_temp < target_temp:
-                ramp_rate = 4.1  # degrees per second for heating
+# One second of an oven following a sequence. with_board: board data is sent
+# too; active: this is the first second after the idle period. board_values
+# and board_id are only set by a synthesized Profile (random otherwise).
+ProfileSecond = namedtuple("ProfileSecond", ["temperature", "upper_control_limit", "lower_control_limit", "is_ramping", "with_board", "active",
+                                             "board_values", "board_id"], defaults=(None, None))
+
+# What the oven does each second: idle, then the ramps and soaks. This only
+# works out the temperatures; profile_messages() builds the messages, so a
+# load generator can skip seconds cheaply.
+def sequence_seconds(sequence, idle_time=20):
+    current_temp = sequence[0]["temperature"]  # Initialize current temperature
+
+    # Send idle data for idle_time seconds
+    for _ in range(idle_time):
+        yield ProfileSecond(25, 27, 23, False, False, False)
+
+    # The first second after the idle period carries the oven active message
+    active = True
+
+    for step in sequence:
+        target_temp = step["temperature"]
+        soak_time = step["soak_time"]
+        initial_temp = current_temp
+
+        # Determine if we are heating or cooling
+        if current_temp < target_temp:
+            ramp_rate = 4.1  # degrees per second for heating
+        else:
+            ramp_rate = -2.1  # degrees per second for cooling
+
+        time_passed = 0
+
+        # Ramp up or down to the target temperature
+        while (ramp_rate > 0 and current_temp < target_temp) or (ramp_rate < 0 and current_temp > target_temp):
+            current_temp += ramp_rate
+            time_passed += 1
+            # Calculate expected target temperature at this point
+            expected_temp = initial_temp + ramp_rate * time_passed
+            # Generate random fluctuation
+            fluctuated_temp = current_temp + random.uniform(-0.5, 0.5)
+            upper_control_limit = expected_temp + 2  # Control limit based on expected temperature
+            lower_control_limit = expected_temp - 2  # Control limit based on expected temperature
+            yield ProfileSecond(fluctuated_temp, upper_control_limit, lower_control_limit, True, False, active)
+            active = False
+
+        # Adjust current_temp to target_temp after ramping
+        current_temp = target_temp
+        upper_control_limit = target_temp + 2
+        lower_control_limit = target_temp - 2
+
+        # Soak at the target temperature
+        for _ in range(soak_time):
+            # Generate random fluctuation and occasional out-of-bound temperature
+            if random.choice([True, False]):
+                fluctuated_temp = current_temp + random.uniform(-3, 3)
             else:
-                ramp_rate = -2.1  # degrees per second for cooling
-            
-            time_passed = 0
-            
-            # Ramp up or down to the target temperature
-            while (ramp_rate > 0 and current_temp < target_temp) or (ramp_rate < 0 and current_temp > target_temp):
-                current_temp += ramp_rate
-                time_passed += 1
-                # Calculate expected target temperature at this point
-                expected_temp = initial_temp + ramp_rate * time_passed
-                # Generate random fluctuation
                 fluctuated_temp = current_temp + random.uniform(-0.5, 0.5)
-                upper_control_limit = expected_temp + 2  # Control limit based on expected temperature
-                lower_control_limit = expected_temp - 2  # Control limit based on expected temperature
-                data = generate_oven_data(oven_name, fluctuated_temp, upper_control_limit, lower_control_limit, True)
-                send_websocket_notification(ws, data)
-                time.sleep(1)
-            
-            # Adjust current_temp to target_temp after ramping
-            current_temp = target_temp
-            upper_control_limit = target_temp + 2
-            lower_control_limit = target_temp - 2
-            
-            # Soak at the target temperature
-            for _ in range(soak_time):
-                # Generate random fluctuation and occasional out-of-bound temperature
-                if random.choice([True, False]):
-                    fluctuated_temp = current_temp + random.uniform(-3, 3)
-                else:
-                    fluctuated_temp = current_temp + random.uniform(-0.5, 0.5)
-                
-                data = generate_oven_data(oven_name, fluctuated_temp, upper_control_limit, lower_control_limit, False)
-                send_websocket_notification(ws, data)
-                
-                # Occasionally send board data
-                if random.choice([True, False]):
-                    board_data = generate_board_data(oven_name, fluctuated_temp,upper_control_limit,lower_control_limit)
-                    send_websocket_notification(ws, board_data)
-                
-                time.sleep(1)  # wait for 1 second
-    
+
+            # Occasionally send board data
+            with_board = random.choice([True, False])
+            yield ProfileSecond(fluctuated_temp, upper_control_limit, lower_control_limit, False, with_board, active)
+            active = False
+
+# Number of messages profile_messages() returns for a second
+def message_count(second):
+    return 1 + second.with_board + second.active
+
+# The messages for one second of the profile; at is its epoch time
+def profile_messages(oven_name, second, at=None):
+    messages = []
+    if second.active:
+        messages.append({"type": "ovenActive", "data": {"ovenId": oven_name}})
+    data = generate_oven_data(oven_name, second.temperature, second.upper_control_limit, second.lower_control_limit, second.is_ramping, at)
+    messages.append({"type": "newOvenData", "data": data})
+    if second.with_board:
+        board_data = generate_board_data(oven_name, second.temperature, second.upper_control_limit, second.lower_control_limit, at,
+                                         second.board_values, second.board_id)
+        messages.append({"type": "newOvenData", "data": board_data})
+    return messages
+
+HEATING_RATE = 4.1  # degrees per second
+COOLING_RATE = -2.1
+
+# A whole run worked out up front as NumPy arrays, one entry per second:
+# the same ramps, soaks and noise as sequence_seconds(), drawn from a seeded
+# generator so a run can be repeated exactly. Board values are NaN in the
+# seconds without board data. Save it with save() and load it back for replay.
+class Profile:
+    ARRAYS = ("temperature", "upper_control_limit", "lower_control_limit", "is_ramping", "with_board", "board_values", "board_id")
+
+    def __init__(self, temperature, upper_control_limit, lower_control_limit, is_ramping, with_board, board_values, board_id, active_index):
+        self.temperature = temperature
+        self.upper_control_limit = upper_control_limit
+        self.lower_control_limit = lower_control_limit
+        self.is_ramping = is_ramping
+        self.with_board = with_board
+        self.board_values = board_values
+        self.board_id = board_id
+        self.active_index = active_index
+
+    def __len__(self):
+        return len(self.temperature)
+
+    # Total number of messages profile_messages() builds for the whole run
+    def message_count(self):
+        return len(self) + int(self.with_board.sum()) + (self.active_index < len(self))
+
+    # Stream the run as ProfileSeconds, for profile_messages() or loadgen.py
+    def seconds(self):
+        columns = zip(self.temperature.tolist(), self.upper_control_limit.tolist(), self.lower_control_limit.tolist(),
+                      self.is_ramping.tolist(), self.with_board.tolist(), self.board_values.tolist(), self.board_id.tolist())
+        for index, (temperature, upper, lower, is_ramping, with_board, values, board_id) in enumerate(columns):
+            board_values = dict(zip(BOARD_FIELDS, values)) if with_board else None
+            yield ProfileSecond(temperature, upper, lower, is_ramping, with_board, index == self.active_index,
+                                board_values, board_id if with_board else None)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, active_index=self.active_index, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(*(data[name] for name in cls.ARRAYS), int(data["active_index"]))
+
+# Work out a whole run for a sequence in one pass. excursion_rate is the
+# share of soak seconds pushed 2-6 degrees outside the control limits, on
+# top of the occasional wide noise sequence_seconds() already has.
+def synthesize_profile(sequence, seed=None, idle_time=20, excursion_rate=0.0):
+    if np is None:
+        raise ImportError("Synthesized profiles need numpy (pip install numpy)")
+    rng = np.random.default_rng(seed)
+
+    # Expected temperature, control limit offset and ramp flag for every second
+    expected = [np.full(idle_time, 25.0)]
+    limits = [np.full(idle_time, 2.0)]
+    ramping = [np.zeros(idle_time, dtype=bool)]
+    soaking = [np.zeros(idle_time, dtype=bool)]
+    current_temp = sequence[0]["temperature"]
+    for step in sequence:
+        target_temp = step["temperature"]
+        ramp_rate = HEATING_RATE if current_temp < target_temp else COOLING_RATE
+        # Seconds until the ramp reaches the target, as in sequence_seconds()
+        ramp_seconds = max(int(np.ceil((target_temp - current_temp) / ramp_rate)), 0)
+        expected.append(current_temp + ramp_rate * np.arange(1, ramp_seconds + 1))
+        expected.append(np.full(step["soak_time"], float(target_temp)))
+        for array, ramp_value, soak_value in ((limits, 2.0, 2.0), (ramping, True, False), (soaking, False, True)):
+            array.append(np.full(ramp_seconds, ramp_value))
+            array.append(np.full(step["soak_time"], soak_value))
+        current_temp = target_temp
+
+    expected = np.concatenate(expected)
+    limits = np.concatenate(limits)
+    is_ramping = np.concatenate(ramping).astype(bool)
+    is_soaking = np.concatenate(soaking).astype(bool)
+    count = len(expected)
+
+    # Ramps wobble by half a degree; soaks by half a degree or, on a coin
+    # flip, by up to three
+    wide = is_soaking & (rng.random(count) < 0.5)
+    noise = rng.uniform(-0.5, 0.5, count)
+    noise[wide] = rng.uniform(-3, 3, int(wide.sum()))
+    temperature = expected + noise
+    idle = ~(is_ramping | is_soaking)
+    temperature[idle] = 25.0
+
+    if excursion_rate:
+        excursions = is_soaking & (rng.random(count) < excursion_rate)
+        size = rng.uniform(2, 6, count) * np.where(rng.random(count) < 0.5, -1, 1)
+        temperature[excursions] = (expected + np.sign(size) * limits + size)[excursions]
+
+    upper_control_limit = expected + limits
+    lower_control_limit = expected - limits
+    upper_control_limit[idle] = 27.0
+    lower_control_limit[idle] = 23.0
+
+    # Board data on about half the soak seconds
+    with_board = is_soaking & (rng.random(count) < 0.5)
+    low = np.array([low for low, _ in BOARD_RANGES], dtype=float)
+    high = np.array([high for _, high in BOARD_RANGES], dtype=float)
+    board_values = np.full((count, len(BOARD_FIELDS)), np.nan)
+    board_values[with_board] = rng.uniform(low, high, (int(with_board.sum()), len(BOARD_FIELDS)))
+    board_id = np.where(with_board, rng.integers(BOARD_IDS[0], BOARD_IDS[1] + 1, count), 0).astype(np.int8)
+
+    active_index = idle_time
+    return Profile(temperature, upper_control_limit, lower_control_limit, is_ramping, with_board, board_values, board_id, active_index)
+
+# Main loop to emulate the sequence in real time over one connection.
+# loadgen.py runs the same profile for many ovens at once.
+# seconds can be a synthesized Profile's seconds() instead of a fresh random run.
+# With batch=True each second's samples go out as one newOvenDataBatch frame.
+def emulate_oven_sequence(oven_name, sequence, url=WEBSOCKET_URL, seconds=None, batch=False):
+    if seconds is None:
+        seconds = sequence_seconds(sequence)
+    ws = create_connection(url)
+    ws.send(dumps({"type": "identify", "clientId": oven_name}))
+    try:
+        for second in seconds:
+            for frame in encode_messages(profile_messages(oven_name, second), batch):
+                ws.send(frame)
+            time.sleep(1)  # wait for 1 second
     finally:
         ws.close()
 
-# Start the sequence emulation
-emulate_oven_sequence("Gimli", sequence)
+# Start the sequence emulation:
+#
+#   python sequenceEmulator.py [oven name] [url]
+#   python sequenceEmulator.py --seed 7 --dump run.npz     save a synthesized run
+#   python sequenceEmulator.py Gimli --replay run.npz      play a saved run
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog="sequenceEmulator.py", description="Emulate an oven following the sequence")
+    arg_parser.add_argument("oven", nargs="?", default="Gimli", help="oven name (default: Gimli)")
+    arg_parser.add_argument("url", nargs="?", default=WEBSOCKET_URL, help=f"server (default: {WEBSOCKET_URL})")
+    arg_parser.add_argument("--batch", action="store_true", help="send each second's samples as one batch frame")
+    arg_parser.add_argument("--seed", type=int, help="synthesize the run up front from this seed")
+    arg_parser.add_argument("--excursions", type=float, default=0.0, help="share of soak seconds outside the limits (with --seed)")
+    arg_parser.add_argument("--dump", default="", help="save the synthesized run to this file instead of sending it")
+    arg_parser.add_argument("--replay", default="", help="send a run saved with --dump")
+    args = arg_parser.parse_args(argv)
+
+    seconds = None
+    if args.replay:
+        seconds = Profile.load(args.replay).seconds()
+    elif args.seed is not None or args.dump:
+        profile = synthesize_profile(sequence, args.seed, excursion_rate=args.excursions)
+        if args.dump:
+            profile.save(args.dump)
+            print(f"Saved {len(profile)} seconds ({profile.message_count()} messages) to {args.dump}")
+            return 0
+        seconds = profile.seconds()
+    emulate_oven_sequence(args.oven, sequence, args.url, seconds, args.batch)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
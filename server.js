@@ -235,6 +235,76 @@ async function triggerWarning(ovenId, failureType) {
     }
   });
 }
+// Save one sample (a newOvenData message), run outlier detection on it and
+// broadcast it to the browsers
+async function handleOvenData(parsedData) {
+  const ovenName = parsedData.data.ovenId;
+  const formattedTimestamp = parsedData.data.timestamp ? formatTimestampLong(parsedData.data.timestamp) : formatTimestampLong(new Date());
+
+  const newData = new OvenData({
+    ovenId: parsedData.data.ovenId,
+    temperature: parsedData.data.temperature,
+    temperatureUpperControlLimit: parsedData.data.temperatureUpperControlLimit,
+    temperatureLowerControlLimit: parsedData.data.temperatureLowerControlLimit,
+    hasOvenControlLimits: parsedData.data.hasOvenControlLimits,
+    hasBoardControlLimits: parsedData.data.hasBoardControlLimits,
+    p1: parsedData.data.p1,
+    p1UpperControlLimit: parsedData.data.p1UpperControlLimit,
+    p1LowerControlLimit: parsedData.data.p1LowerControlLimit,
+    p2: parsedData.data.p2,
+    p2UpperControlLimit: parsedData.data.p2UpperControlLimit,
+    p2LowerControlLimit: parsedData.data.p2LowerControlLimit,
+    t1: parsedData.data.t1,
+    t1UpperControlLimit: parsedData.data.t1UpperControlLimit,
+    t1LowerControlLimit: parsedData.data.t1LowerControlLimit,
+    t2: parsedData.data.t2,
+    t2UpperControlLimit: parsedData.data.t2UpperControlLimit,
+    t2LowerControlLimit: parsedData.data.t2LowerControlLimit,
+    vx: parsedData.data.vx,
+    vxUpperControlLimit: parsedData.data.vxUpperControlLimit,
+    vxLowerControlLimit: parsedData.data.vxLowerControlLimit,
+    vz: parsedData.data.vz,
+    vzUpperControlLimit: parsedData.data.vzUpperControlLimit,
+    vzLowerControlLimit: parsedData.data.vzLowerControlLimit,
+    ct: parsedData.data.ct,
+    ctUpperControlLimit: parsedData.data.ctUpperControlLimit,
+    ctLowerControlLimit: parsedData.data.ctLowerControlLimit,
+    vt: parsedData.data.vt,
+    vtUpperControlLimit: parsedData.data.vtUpperControlLimit,
+    vtLowerControlLimit: parsedData.data.vtLowerControlLimit,
+    dataType: parsedData.data.dataType,
+    boardId: parsedData.data.boardId,
+    timestamp: formattedTimestamp
+  });
+
+  try {
+    await newData.save();
+
+    if (activeOvens.has(ovenName)) {
+      const activeOvenCollection = mongoose.connection.collection(ovenName);
+      const activeID = activeOvens.get(ovenName);
+      if (isNaN(activeID)) {
+        console.error('Error: activeID is NaN');
+        return;
+      }
+      const newDataObj = newData.toObject();
+      newDataObj.activeID = activeID;
+      await activeOvenCollection.insertOne(newDataObj);
+    }
+    // Perform outlier detection
+    await checkForOutliers([newData]);
+
+    wss.clients.forEach(client => {
+      if (client.readyState === WebSocket.OPEN) {
+        console.log('Broadcasting message to client:', JSON.stringify({ type: 'newOvenData', data: newData }));
+        client.send(JSON.stringify({ type: 'newOvenData', data: newData }));
+      }
+    });
+  } catch (err) {
+    console.error('Error saving data:', err.message);
+  }
+}
+
 // Map to store WebSocket connections by clientId
 const activeWebSockets = new Map();
 // Server-side WebSocket handling
@@ -329,72 +399,13 @@ wss.on('connection', async(ws) => {
           client.send(JSON.stringify({ type: 'statusUpdate', data: { ovenName, status: 'Idle', timestamp: new Date().toISOString() } }));
         }
       });
-    } else {
-      const ovenName = parsedData.data.ovenId;
-      const formattedTimestamp = parsedData.data.timestamp ? formatTimestampLong(parsedData.data.timestamp) : formatTimestampLong(new Date());
-
-      const newData = new OvenData({
-        ovenId: parsedData.data.ovenId,
-        temperature: parsedData.data.temperature,
-        temperatureUpperControlLimit: parsedData.data.temperatureUpperControlLimit,
-        temperatureLowerControlLimit: parsedData.data.temperatureLowerControlLimit,
-        hasOvenControlLimits: parsedData.data.hasOvenControlLimits,
-        hasBoardControlLimits: parsedData.data.hasBoardControlLimits,
-        p1: parsedData.data.p1,
-        p1UpperControlLimit: parsedData.data.p1UpperControlLimit,
-        p1LowerControlLimit: parsedData.data.p1LowerControlLimit,
-        p2: parsedData.data.p2,
-        p2UpperControlLimit: parsedData.data.p2UpperControlLimit,
-        p2LowerControlLimit: parsedData.data.p2LowerControlLimit,
-        t1: parsedData.data.t1,
-        t1UpperControlLimit: parsedData.data.t1UpperControlLimit,
-        t1LowerControlLimit: parsedData.data.t1LowerControlLimit,
-        t2: parsedData.data.t2,
-        t2UpperControlLimit: parsedData.data.t2UpperControlLimit,
-        t2LowerControlLimit: parsedData.data.t2LowerControlLimit,
-        vx: parsedData.data.vx,
-        vxUpperControlLimit: parsedData.data.vxUpperControlLimit,
-        vxLowerControlLimit: parsedData.data.vxLowerControlLimit,
-        vz: parsedData.data.vz,
-        vzUpperControlLimit: parsedData.data.vzUpperControlLimit,
-        vzLowerControlLimit: parsedData.data.vzLowerControlLimit,
-        ct: parsedData.data.ct,
-        ctUpperControlLimit: parsedData.data.ctUpperControlLimit,
-        ctLowerControlLimit: parsedData.data.ctLowerControlLimit,
-        vt: parsedData.data.vt,
-        vtUpperControlLimit: parsedData.data.vtUpperControlLimit,
-        vtLowerControlLimit: parsedData.data.vtLowerControlLimit,
-        dataType: parsedData.data.dataType,
-        boardId: parsedData.data.boardId,
-        timestamp: formattedTimestamp
-      });
-
-      try {
-        await newData.save();
-
-        if (activeOvens.has(ovenName)) {
-          const activeOvenCollection = mongoose.connection.collection(ovenName);
-          const activeID = activeOvens.get(ovenName);
-          if (isNaN(activeID)) {
-            console.error('Error: activeID is NaN');
-            return;
-          }
-          const newDataObj = newData.toObject();
-          newDataObj.activeID = activeID;
-          await activeOvenCollection.insertOne(newDataObj);
-        }
-        // Perform outlier detection
-        await checkForOutliers([newData]);
-
-        wss.clients.forEach(client => {
-          if (client.readyState === WebSocket.OPEN) {
-            console.log('Broadcasting message to client:', JSON.stringify({ type: 'newOvenData', data: newData }));
-            client.send(JSON.stringify({ type: 'newOvenData', data: newData }));
-          }
-        });
-      } catch (err) {
-        console.error('Error saving data:', err.message);
+    } else if (parsedData.type === 'newOvenDataBatch') {
+      // Several samples in one frame, handled in order as if sent one by one
+      for (const data of parsedData.data) {
+        await handleOvenData({ type: 'newOvenData', data });
       }
+    } else {
+      await handleOvenData(parsedData);
     }
   });
 
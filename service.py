@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from monitor import CONFIG_FILE, OvenMonitor, load_config
+
+log = logging.getLogger(__name__)
+
+# Headless transmitter: runs the same acquisition and uplink pipeline as the
+# Tk app, driven from oven_config.json and a local control socket instead of
+# buttons. Start it with
+#
+#   python service.py run [--oven NAME [--active]] [--port 8765]
+#
+# and drive it with "python service.py send <command>" or the Tk app in
+# remote mode ("python Transmitter.py remote 8765").
+#
+# The control protocol is one text command per line, answered with one line
+# of JSON: {"ok": true, "message": ...} or {"ok": false, "error": ...}.
+#
+#   connect <oven name>   connect to the oven and idle (reloads the config)
+#   active                start an active session
+#   idle                  back to idle
+#   disconnect            end the connection
+#   status                connection state and uplink/spool counters
+#   shutdown              disconnect and stop the service
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 8765
+
+
+class ControlError(Exception):
+    pass
+
+
+# "8765", "host:8765" or "" into (host, port)
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or CONTROL_HOST, int(port) if port else CONTROL_PORT
+
+
+class TransmitterService:
+    def __init__(self, config_file=CONFIG_FILE, host=CONTROL_HOST, port=CONTROL_PORT):
+        self.config_file = config_file
+        self.host = host
+        self.port = port
+        self.monitor = OvenMonitor(load_config(config_file), config_file)
+        # Lifecycle commands block on the transmitter, run them one at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="service-command")
+        self.stopping = None
+
+    async def call(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def connect(self, oven_name):
+        if not self.monitor.connected:
+            # Pick up edits made since the service started
+            self.monitor.config = load_config(self.config_file)
+        return await self.call(self.monitor.establish_connection, oven_name)
+
+    async def execute(self, line):
+        command, _, argument = line.strip().partition(" ")
+        command = command.lower()
+        argument = argument.strip()
+
+        if command == "connect":
+            if not argument:
+                raise ControlError("connect needs an oven name")
+            return {"message": await self.connect(argument)}
+        if command == "active":
+            return {"message": await self.call(self.monitor.start_active_session)}
+        if command == "idle":
+            return {"message": await self.call(self.monitor.end_active_session)}
+        if command == "disconnect":
+            return {"message": await self.call(self.monitor.end_connection)}
+        if command == "status":
+            return {"status": self.monitor.status()}
+        if command == "shutdown":
+            self.stopping.set()
+            return {"message": "Shutting down."}
+        raise ControlError(f"Unknown command {command!r}")
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='replace')
+                if not line.strip():
+                    continue
+                try:
+                    reply = {"ok": True, **await self.execute(line)}
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                log.info("Control: %s -> %s", line.strip()[:80], reply)
+                writer.write((json.dumps(reply) + "\n").encode('utf-8'))
+                await writer.drain()
+                if self.stopping.is_set():
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, oven_name=None, active=False):
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        log.info("Transmitter service listening on %s:%d", self.host, self.port)
+        try:
+            if oven_name:
+                try:
+                    log.info(await self.connect(oven_name))
+                    if active:
+                        log.info(await self.call(self.monitor.start_active_session))
+                except Exception as e:
+                    log.error("Failed to start oven '%s': %s", oven_name, e)
+            async with server:
+                await self.stopping.wait()
+        finally:
+            if self.monitor.connected:
+                log.info(await self.call(self.monitor.end_connection))
+            self.executor.shutdown(wait=False)
+
+
+# Blocking client for the control socket. It has the same lifecycle methods
+# as OvenMonitor, so the Tk app can use either.
+class ControlClient:
+    def __init__(self, host=CONTROL_HOST, port=CONTROL_PORT, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, line):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall((line + "\n").encode('utf-8'))
+            with sock.makefile('r', encoding='utf-8') as reply_file:
+                reply_line = reply_file.readline()
+        if not reply_line:
+            raise ControlError("The service closed the connection without replying")
+        reply = json.loads(reply_line)
+        if not reply.get("ok"):
+            raise ControlError(reply.get("error", "Command failed"))
+        return reply
+
+    def establish_connection(self, oven_name):
+        return self.request(f"connect {oven_name}").get("message")
+
+    def end_connection(self):
+        return self.request("disconnect").get("message")
+
+    def start_active_session(self):
+        return self.request("active").get("message")
+
+    def end_active_session(self):
+        return self.request("idle").get("message")
+
+    def status(self):
+        return self.request("status")["status"]
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog="service.py", description="Headless oven transmitter service")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the service")
+    run_parser.add_argument("--config", default=CONFIG_FILE, help=f"configuration file (default: {CONFIG_FILE})")
+    run_parser.add_argument("--host", default=CONTROL_HOST, help=f"control socket address (default: {CONTROL_HOST})")
+    run_parser.add_argument("--port", type=int, default=CONTROL_PORT, help=f"control socket port (default: {CONTROL_PORT})")
+    run_parser.add_argument("--oven", help="connect to this oven on startup")
+    run_parser.add_argument("--active", action="store_true", help="start an active session on startup (needs --oven)")
+    metrics.add_arguments(run_parser)
+
+    send_parser = commands.add_parser("send", help="send a command to a running service")
+    send_parser.add_argument("--to", default="", help=f"[host:]port of the service (default: {CONTROL_HOST}:{CONTROL_PORT})")
+    send_parser.add_argument("words", nargs="+", help="command, e.g. status or connect Oven1")
+
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "send":
+        host, port = parse_address(args.to)
+        client = ControlClient(host, port)
+        try:
+            reply = client.request(" ".join(args.words))
+        except (ControlError, OSError) as e:
+            print(f"Error: {e}")
+            return 1
+        print(json.dumps(reply.get("status", reply.get("message")), indent=4))
+        return 0
+
+    exporters = metrics.start_from_args(args)
+    service = TransmitterService(args.config, args.host, args.port)
+    try:
+        asyncio.run(service.serve(args.oven, args.active))
+    except KeyboardInterrupt:
+        if service.monitor.connected:
+            log.info(service.monitor.end_connection())
+    finally:
+        for exporter in exporters:
+            exporter.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from records import BoardRecord
+
+log = logging.getLogger(__name__)
+
+# Each entry is: length of the payload, sequence number, payload, CRC-32
+ENTRY_HEADER = struct.Struct(">IQ")
+ENTRY_CRC = struct.Struct(">I")
+SEGMENT_SUFFIX = ".seg"
+ACK_FILE = "acked"
+
+
+def encode_entry(seq, record):
+    payload = json.dumps([record.board, record.values, record.message, record.timestamp]).encode('utf-8')
+    header = ENTRY_HEADER.pack(len(payload), seq)
+    return header + payload + ENTRY_CRC.pack(zlib.crc32(header + payload))
+
+
+# Yield (seq, record, end_offset) for every intact entry in a segment file,
+# stopping at the first torn or corrupt entry
+def read_segment(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    pos = 0
+    while pos + ENTRY_HEADER.size <= len(data):
+        length, seq = ENTRY_HEADER.unpack_from(data, pos)
+        end = pos + ENTRY_HEADER.size + length + ENTRY_CRC.size
+        if end > len(data):
+            return
+        (crc,) = ENTRY_CRC.unpack_from(data, end - ENTRY_CRC.size)
+        if crc != zlib.crc32(data[pos:end - ENTRY_CRC.size]):
+            return
+        board, values, message, timestamp = json.loads(data[pos + ENTRY_HEADER.size:end - ENTRY_CRC.size])
+        yield seq, BoardRecord(board, values, message, timestamp), end
+        pos = end
+
+
+# Write-ahead spool between the parsers and the uplink. Every record is
+# appended to the current segment file before it is queued for the serial
+# link and stays on disk until the bridge acknowledges it, so records that
+# were in flight when the link dropped (or the program stopped) can be
+# replayed. fsync is batched: at most every `fsync_every` records or
+# `fsync_interval` seconds, and runs on a sync thread of its own (as do
+# closing a full segment and writing the ack position), so append() and ack()
+# never wait for the disk on the engine's event loop. When the spool grows
+# past `max_bytes` the oldest segments are deleted, acknowledged or not.
+class Spool:
+    def __init__(self, directory, segment_bytes=1 << 20, max_bytes=64 << 20, fsync_every=100, fsync_interval=1.0, ack_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.ack_interval = ack_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = deque()  # (first_seq, path, size)
+        self.outstanding = deque()  # seqs not yet acknowledged, in order
+        self.done = set()  # acknowledged seqs that aren't at the head yet
+        self.file = None
+        self.syncer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-sync")
+        self.syncing = None  # the fsync the sync thread is working on
+        self.closed = False
+        self.unsynced = 0
+        self.last_fsync = time.monotonic()
+        self.last_ack_write = time.monotonic()
+
+        self.appended = 0
+        self.acked = 0
+        self.replayed = 0
+        self.evicted = 0
+        self.fsyncs = 0
+        self.bytes_written = 0
+
+        self.acked_seq = self._read_ack_file()
+        self.next_seq = self.acked_seq + 1
+        self._load_segments()
+
+    def _read_ack_file(self):
+        try:
+            with open(os.path.join(self.directory, ACK_FILE), 'r') as file:
+                return int(file.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # Find the existing segments, trim a torn tail and rebuild the list of
+    # records that still need sending
+    def _load_segments(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            first_seq = int(name[:-len(SEGMENT_SUFFIX)])
+            size = 0
+            for seq, _, end in read_segment(path):
+                size = end
+                self.next_seq = max(self.next_seq, seq + 1)
+                if seq > self.acked_seq:
+                    self.outstanding.append(seq)
+            if size != os.path.getsize(path):
+                with open(path, 'r+b') as file:
+                    file.truncate(size)
+            self.segments.append((first_seq, path, size))
+        self._delete_acked_segments()
+
+    @property
+    def size(self):
+        return sum(size for _, _, size in self.segments)
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{self.next_seq:016d}{SEGMENT_SUFFIX}")
+        self.file = open(path, 'ab')
+        self.segments.append((self.next_seq, path, 0))
+
+    # Append a record and return its sequence number
+    def append(self, record):
+        if self.file is None or self.segments[-1][2] >= self.segment_bytes:
+            self._roll()
+        seq = self.next_seq
+        self.next_seq += 1
+        entry = encode_entry(seq, record)
+        self.file.write(entry)
+        self.file.flush()
+        first_seq, path, size = self.segments[-1]
+        self.segments[-1] = (first_seq, path, size + len(entry))
+        self.outstanding.append(seq)
+        self.appended += 1
+        self.bytes_written += len(entry)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.sync()
+        self._evict()
+        return seq
+
+    def _roll(self):
+        if self.file:
+            self.syncer.submit(self._fsync, self.file, True)
+            self.unsynced = 0
+        self._open_segment()
+
+    # Runs on the sync thread, where an error would otherwise go unseen
+    def _fsync(self, file, close=False):
+        try:
+            os.fsync(file.fileno())
+            self.fsyncs += 1
+        except OSError as e:
+            log.warning("Could not sync spool segment %s: %s", file.name, e)
+        if close:
+            file.close()
+
+    # Have the sync thread fsync the current segment. One fsync at a time:
+    # while one is running the records stay counted as unsynced, and the
+    # next append() asks again.
+    def sync(self):
+        if self.file and self.unsynced:
+            if self.syncing and not self.syncing.done():
+                return
+            self.syncing = self.syncer.submit(self._fsync, self.file)
+        self.unsynced = 0
+        self.last_fsync = time.monotonic()
+
+    # Mark a record as delivered (or superseded). The ack position only moves
+    # past a record once everything before it is acknowledged too.
+    def ack(self, seq):
+        if seq is None or seq <= self.acked_seq:
+            return
+        self.done.add(seq)
+        self.acked += 1
+        while self.outstanding and self.outstanding[0] in self.done:
+            self.done.discard(self.outstanding.popleft())
+        if self.outstanding:
+            self.acked_seq = max(self.acked_seq, self.outstanding[0] - 1)
+        else:
+            self.acked_seq = self.next_seq - 1
+        if time.monotonic() - self.last_ack_write >= self.ack_interval:
+            self.write_ack()
+
+    # Persist the ack position atomically (on the sync thread) and drop fully
+    # acknowledged segments
+    def write_ack(self):
+        self.syncer.submit(self._write_ack_file, self.acked_seq)
+        self.last_ack_write = time.monotonic()
+        self._delete_acked_segments()
+
+    def _write_ack_file(self, acked_seq):
+        path = os.path.join(self.directory, ACK_FILE)
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, 'w') as file:
+                file.write(str(acked_seq))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, path)
+        except OSError as e:
+            log.warning("Could not write the spool ack position: %s", e)
+
+    def _delete_acked_segments(self):
+        # A segment can go once the next one starts at or before the ack position
+        while len(self.segments) > 1 and self.segments[1][0] <= self.acked_seq + 1:
+            _, path, _ = self.segments.popleft()
+            os.remove(path)
+
+    def _evict(self):
+        while len(self.segments) > 1 and self.size > self.max_bytes:
+            _, path, _ = self.segments.popleft()
+            os.remove(path)
+            next_first = self.segments[0][0]
+            while self.outstanding and self.outstanding[0] < next_first:
+                self.outstanding.popleft()
+                self.evicted += 1
+            self.done = {seq for seq in self.done if seq >= next_first}
+            self.acked_seq = max(self.acked_seq, next_first - 1)
+            log.warning("Disk cap reached, evicted %s", path)
+
+    # Yield (seq, record) for everything that hasn't been acknowledged, oldest first
+    def unacked(self):
+        self.sync()
+        for _, path, _ in list(self.segments):
+            if not os.path.exists(path):
+                continue
+            for seq, record, _ in read_segment(path):
+                if seq > self.acked_seq and seq not in self.done:
+                    self.replayed += 1
+                    yield seq, record
+
+    # Waits for the sync thread, so everything is on disk once this returns
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.file:
+            self.syncer.submit(self._fsync, self.file, True)
+            self.file = None
+        self.write_ack()
+        self.syncer.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "appended": self.appended,
+            "acked": self.acked,
+            "acked_seq": self.acked_seq,
+            "outstanding": len(self.outstanding),
+            "replayed": self.replayed,
+            "evicted": self.evicted,
+            "fsyncs": self.fsyncs,
+            "bytes_written": self.bytes_written,
+            "segments": len(self.segments),
+            "size": self.size
+        }
@@ -0,0 +1,188 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+from engine import LoopThread
+from logparser import ParsePool
+from monitor import OvenMonitor, load_config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# Runs many ovens in one process. Every oven gets its own OvenMonitor (its
+# own transmitter port, spool and board data source), but all of their
+# uplinks, folder tailers and Burnsys decoders run as tasks on one shared
+# event loop, and the blocking lifecycle commands go through one small
+# worker pool. Per oven that leaves only the serial reader threads.
+#
+#   python supervisor.py ovens/            every *.json in the folder
+#   python supervisor.py a.json b.json     or a list of config files
+#
+# An oven is named after its config file ("ovens/Gollum.json" is "Gollum")
+# unless the config has an "oven_name" key.
+
+
+# Expand folders into the oven config files they hold
+def find_oven_configs(paths):
+    config_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")))
+        else:
+            config_files.append(path)
+    return config_files
+
+
+def oven_name_for(config_file, config):
+    return config.get("oven_name") or os.path.splitext(os.path.basename(config_file))[0]
+
+
+class SupervisedOven:
+    def __init__(self, config_file, loop, parse_pool=None):
+        self.config_file = config_file
+        config = load_config(config_file)
+        self.name = oven_name_for(config_file, config)
+        self.monitor = OvenMonitor(config, config_file, loop=loop, parse_pool=parse_pool)
+        self.error = None
+        self.last_records = 0
+        self.last_time = time.monotonic()
+
+    def start(self, activate):
+        try:
+            self.monitor.establish_connection(self.name)
+            if activate:
+                self.monitor.start_active_session()
+            self.error = None
+        except Exception as e:
+            self.error = str(e)
+            log.error("[%s] Failed to start: %s", self.name, e)
+
+    def stop(self):
+        if self.monitor.connected:
+            self.monitor.end_connection()
+
+    # Status plus records per second since the last call
+    def health(self):
+        status = self.monitor.status()
+        records = status.get("uplink", {}).get("records_sent", 0)
+        now = time.monotonic()
+        rate = (records - self.last_records) / (now - self.last_time) if now > self.last_time else 0.0
+        self.last_records = records
+        self.last_time = now
+
+        acquisition = self.monitor.acquisition
+        if acquisition and acquisition.done() and acquisition.exception():
+            self.error = f"Board data logging failed: {acquisition.exception()}"
+        return {
+            "oven": self.name,
+            "connected": status["connected"],
+            "monitoring": status["monitoring"],
+            "state": status.get("state", "Disconnected"),
+            "reconnects": status.get("reconnects", 0),
+            "records_sent": records,
+            "records_per_second": round(rate, 1),
+            "ack_timeouts": status.get("uplink", {}).get("ack_timeouts", 0),
+            "spooled": status.get("spool", {}).get("outstanding", 0),
+            "error": self.error
+        }
+
+
+class Supervisor:
+    # parse_workers > 0 gives all ovens one shared pool of parser processes.
+    # Batches below the smallest parse_min_lines in the ovens' configs are
+    # parsed on the pool's thread instead.
+    def __init__(self, config_files, workers=4, activate=True, parse_workers=0):
+        self.loop = LoopThread("supervisor-loop")
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="supervisor")
+        self.activate = activate
+        self.ovens = [SupervisedOven(config_file, self.loop) for config_file in config_files]
+        self.parse_pool = None
+        if parse_workers > 0 and self.ovens:
+            min_lines = min(oven.monitor.config["parse_min_lines"] for oven in self.ovens)
+            self.parse_pool = ParsePool(parse_workers, min_lines)
+            for oven in self.ovens:
+                oven.monitor.parse_pool = self.parse_pool
+        self.last_cpu = time.process_time()
+        self.last_time = time.monotonic()
+
+    def start(self):
+        self.loop.start()
+        wait([self.executor.submit(oven.start, self.activate) for oven in self.ovens])
+
+    def stop(self):
+        wait([self.executor.submit(oven.stop) for oven in self.ovens])
+        self.executor.shutdown()
+        if self.parse_pool:
+            self.parse_pool.close()
+        self.loop.stop()
+
+    def health(self):
+        ovens = [oven.health() for oven in self.ovens]
+        cpu = time.process_time()
+        now = time.monotonic()
+        cpu_percent = 100 * (cpu - self.last_cpu) / (now - self.last_time) if now > self.last_time else 0.0
+        self.last_cpu = cpu
+        self.last_time = now
+        process = {
+            "ovens": len(ovens),
+            "connected": sum(1 for oven in ovens if oven["connected"]),
+            "records_per_second": round(sum(oven["records_per_second"] for oven in ovens), 1),
+            "cpu_percent": round(cpu_percent, 1)
+        }
+        if resource:
+            process["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"process": process, "ovens": ovens}
+
+    def report(self):
+        health = self.health()
+        log.info("%s", health["process"])
+        for oven in health["ovens"]:
+            line = (f"  {oven['oven']:<16} {oven['state']:<12} {oven['records_per_second']:>7} rec/s"
+                    f"  sent {oven['records_sent']}  spooled {oven['spooled']}  reconnects {oven['reconnects']}")
+            if oven["error"]:
+                line += f"  error: {oven['error']}"
+            log.info(line)
+        return health
+
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog="supervisor.py", description="Run many ovens in one process")
+    arg_parser.add_argument("paths", nargs="+", help="oven config files, or folders of them")
+    arg_parser.add_argument("--workers", type=int, default=4, help="threads for connect/disconnect commands (default: 4)")
+    arg_parser.add_argument("--parse-workers", type=int, default=0, help="parser processes shared by all ovens (default: 0, parse on a thread)")
+    arg_parser.add_argument("--idle", action="store_true", help="connect but don't start active sessions")
+    arg_parser.add_argument("--report-interval", type=float, default=30.0, help="seconds between health reports (default: 30)")
+    metrics.add_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
+    exporters = metrics.start_from_args(args)
+
+    config_files = find_oven_configs(args.paths)
+    if not config_files:
+        log.error("No oven configs found")
+        return 1
+
+    supervisor = Supervisor(config_files, args.workers, activate=not args.idle, parse_workers=args.parse_workers)
+    supervisor.start()
+    try:
+        while True:
+            time.sleep(args.report_interval)
+            supervisor.report()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        for exporter in exporters:
+            exporter.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,521 @@
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import math
+import os
+import select
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+
+from logindex import LogIndex
+from metrics import REGISTRY
+from timestamps import LOCAL, to_seconds
+
+log = logging.getLogger(__name__)
+
+# File extensions that the Modbus/Treebeard logging software writes
+LOG_EXTENSIONS = (".txt", ".TST", ".Raw", ".raw", ".tst")
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+# Bytes at the start of a file that are checksummed to tell it apart from a
+# different file that was given the same inode
+HEAD_BYTES = 256
+
+# Where to start on files that were already in the folder when tailing began
+# and have no checkpoint: "beginning", "end", or a time (epoch seconds) to
+# start at the first line logged at or after. Files created later are always
+# read from the start.
+START_POLICIES = ("beginning", "end")
+
+
+# Turn the tail_start setting into "beginning", "end" or epoch seconds.
+# Times can be given as epoch seconds or "2024-06-25 13:20:00" local time.
+def parse_start_policy(value):
+    if value in START_POLICIES:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        raise ValueError(f"Unknown tail_start {value!r}, expected beginning, end or a time") from None
+
+
+# Length and CRC-32 of the first bytes of an open file
+def read_head(file, length):
+    file.seek(0)
+    data = file.read(min(length, HEAD_BYTES))
+    return [len(data), zlib.crc32(data)]
+
+
+# Per-file tail state: which file we were reading (inode), how big it was last
+# time we looked and how far into it we have consumed
+class FileState:
+    def __init__(self, path, inode, size=0, offset=0, head=None):
+        self.path = path
+        self.inode = inode
+        self.size = size
+        self.offset = offset
+        self.head = head or [0, 0]
+        self.framer = LineFramer()
+        self.index = None  # logindex.LogIndex, when indexing
+
+    # Start again from the beginning of a replaced or truncated file
+    def reset(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.head = [0, 0]
+        self.framer.clear()
+        if self.index:
+            self.index.reset()
+
+    def __repr__(self):
+        return f"FileState({self.path!r}, inode={self.inode}, size={self.size}, offset={self.offset})"
+
+
+# Splits a stream of appended bytes into complete lines. Anything after the
+# last newline is held back until the rest of the line is written.
+class LineFramer:
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self.partial = b""
+
+    def clear(self):
+        self.partial = b""
+
+    # Feed newly read bytes and return the list of complete, non-empty lines
+    def feed(self, data):
+        if self.partial:
+            data = self.partial + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            self.partial = data
+            return []
+        self.partial = data[end + 1:]
+        lines = data[:end].decode(self.encoding, errors='replace').splitlines()
+        return [line for line in lines if line.strip()]
+
+
+# Tail positions kept on disk, so a restart carries on where the last run
+# stopped instead of reading every log in the folder again. Each file's entry
+# holds its inode, the offset consumed up to and a checksum of its first
+# bytes; a file that no longer matches is treated as new. Positions are
+# written atomically (temp file, fsync, rename), at most every
+# flush_interval seconds.
+class CheckpointStore:
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.entries = self._load()
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.flushes = 0
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning("Ignoring unreadable tail checkpoints in %s: %s", self.path, e)
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, path):
+        return self.entries.get(os.path.abspath(path))
+
+    def set(self, path, inode, offset, head):
+        entry = {"inode": inode, "offset": offset, "head": list(head)}
+        path = os.path.abspath(path)
+        if self.entries.get(path) != entry:
+            self.entries[path] = entry
+            self.dirty = True
+
+    def remove(self, path):
+        if self.entries.pop(os.path.abspath(path), None) is not None:
+            self.dirty = True
+
+    # Drop entries for files in folder_path other than the ones in present
+    def prune(self, folder_path, present):
+        folder_path = os.path.abspath(folder_path)
+        present = {os.path.abspath(path) for path in present}
+        for path in list(self.entries):
+            if os.path.dirname(path) == folder_path and path not in present:
+                self.remove(path)
+
+    def maybe_flush(self):
+        if self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.flushes += 1
+
+
+# Thin ctypes wrapper around Linux inotify, returns None if it isn't available
+class InotifyWatch:
+    def __init__(self, folder_path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(folder_path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder_path}")
+
+    @classmethod
+    def create(cls, folder_path):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls(folder_path)
+        except (OSError, AttributeError) as e:
+            log.info("inotify unavailable, falling back to stat polling: %s", e)
+            return None
+
+    # Wait up to timeout seconds and return (names, overflowed) for the events seen
+    def read_events(self, timeout):
+        names = set()
+        overflowed = False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return names, overflowed
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            pos = 0
+            while pos + EVENT_HEADER.size <= len(buf):
+                _, mask, _, name_len = EVENT_HEADER.unpack_from(buf, pos)
+                pos += EVENT_HEADER.size
+                name = buf[pos:pos + name_len].rstrip(b"\0")
+                pos += name_len
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+                    overflowed = True
+                if name:
+                    names.add(os.fsdecode(name))
+        return names, overflowed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# Watches a folder of log files and hands back only the bytes that were
+# appended since the last call. Uses inotify where available and otherwise
+# falls back to comparing os.stat() results every poll_interval seconds.
+#
+# With a CheckpointStore each file resumes from its committed position (see
+# commit()); files without one start as the start policy says. At most
+# max_read bytes are read from a file per pass, so a large backlog is worked
+# through in steps rather than pulled into memory at once. With index_dir
+# set, a timestamp index of every file is built in that folder from the
+# bytes read (see logindex.py) and saved on commit().
+class DirectoryTailer:
+    # labels (e.g. {"oven": name}) tag the tailer's metrics. on_forget(path)
+    # is called when a file the tailer was following has gone away.
+    def __init__(self, folder_path, extensions=LOG_EXTENSIONS, poll_interval=0.5, use_inotify=True, labels=None,
+                 checkpoints=None, start="beginning", max_read=4 << 20, index_dir=None, on_forget=None):
+        self.folder_path = folder_path
+        self.on_forget = on_forget
+        labels = labels or {}
+        self.detect_latency = REGISTRY.histogram("tailer_detect_seconds", "Time from a log file being written to the tailer reading it", **labels)
+        self.read_latency = REGISTRY.histogram("tailer_read_seconds", "Time to read the bytes appended to one log file", **labels)
+        self.bytes_read = REGISTRY.counter("tailer_bytes_read_total", "Bytes read from board log files", **labels)
+        self.bytes_skipped = REGISTRY.counter("tailer_bytes_skipped_total", "Bytes not read because of a checkpoint or the start policy", **labels)
+        self.files_resumed = REGISTRY.counter("tailer_files_resumed_total", "Log files resumed from a checkpoint", **labels)
+        self.extensions = tuple(extensions)
+        self.poll_interval = poll_interval
+        self.checkpoints = checkpoints
+        self.start = parse_start_policy(start)
+        self.max_read = max_read
+        self.index_dir = index_dir
+        self.states = {}
+        self.watch = InotifyWatch.create(folder_path) if use_inotify else None
+        self.pending = set()
+        self.stat_cache = {}
+        self.needs_scan = True
+        self.initial_files = None  # Files already there at the first scan
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.watch:
+            self.watch.close()
+            self.watch = None
+        self.save_indexes()
+        if self.checkpoints:
+            self.checkpoints.flush()
+
+    def is_log_file(self, filename):
+        return filename.endswith(self.extensions)
+
+    # Full directory pass used at startup and after an inotify queue overflow
+    def scan(self):
+        changed = set()
+        seen = set()
+        try:
+            entries = list(os.scandir(self.folder_path))
+        except FileNotFoundError:
+            log.warning("Folder not found: %s", self.folder_path)
+            return changed
+        for entry in entries:
+            if not self.is_log_file(entry.name):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            seen.add(entry.path)
+            key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if self.stat_cache.get(entry.path) != key:
+                self.stat_cache[entry.path] = key
+                changed.add(entry.path)
+        for path in list(self.stat_cache):
+            if path not in seen:
+                self.forget(path)
+        if self.initial_files is None:
+            self.initial_files = seen
+            if self.checkpoints:
+                self.checkpoints.prune(self.folder_path, seen)
+        return changed
+
+    def forget(self, path):
+        self.stat_cache.pop(path, None)
+        known = self.states.pop(path, None) is not None
+        if self.checkpoints:
+            self.checkpoints.remove(path)
+        if known and self.on_forget:
+            self.on_forget(path)
+
+    # How far a file has been consumed: (inode, offset, head) for commit()
+    def position(self, path):
+        state = self.states[path]
+        return state.inode, state.offset - len(state.framer.partial), list(state.head)
+
+    # Record how far each file has been consumed. Call once the lines from
+    # poll_lines() have been handed on; a partial line still held back is
+    # read again after a restart. positions ({path: position()}) commits
+    # those files only, as of when the positions were taken.
+    def commit(self, positions=None):
+        self.save_indexes()
+        if not self.checkpoints:
+            return
+        if positions is None:
+            positions = {path: self.position(path) for path in self.states}
+        for path, (inode, offset, head) in positions.items():
+            if path in self.states:
+                self.checkpoints.set(path, inode, offset, head)
+        self.checkpoints.maybe_flush()
+
+    def save_indexes(self):
+        for state in self.states.values():
+            if state.index:
+                state.index.save()
+
+    # Tail state for a file seen for the first time: resumed from its
+    # checkpoint if that still matches the file, otherwise started as the
+    # start policy says
+    def _open_state(self, file_path, file, st):
+        entry = self.checkpoints.get(file_path) if self.checkpoints else None
+        if entry:
+            offset, head = entry["offset"], entry["head"]
+            if entry["inode"] == st.st_ino and offset <= st.st_size and read_head(file, head[0]) == head:
+                self.files_resumed.inc()
+                self.bytes_skipped.inc(offset)
+                return FileState(file_path, st.st_ino, offset=offset, head=head)
+            log.info("%s no longer matches its checkpoint, treating it as a new file", file_path)
+
+        offset = 0
+        if self.start != "beginning" and file_path in (self.initial_files or ()):
+            if self.start == "end" or st.st_mtime < self.start:
+                offset = self._last_line_start(file, st.st_size)
+            else:
+                offset = self._find_time(file, st.st_size, self.start)
+            self.bytes_skipped.inc(offset)
+        return FileState(file_path, st.st_ino, offset=offset, head=read_head(file, offset))
+
+    # Offset just past the last newline, so a line still being written is
+    # read whole once it is finished
+    def _last_line_start(self, file, size):
+        end = size
+        while end > 0:
+            start = max(end - 4096, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+        return 0
+
+    # Start and timestamp of the first timestamped line starting at or after pos
+    def _next_stamped_line(self, file, pos, size):
+        file.seek(max(pos - 1, 0))
+        if pos > 0:
+            file.readline()  # Finish the line pos falls in
+        while file.tell() < size:
+            start = file.tell()
+            parts = file.readline().split(None, 2)
+            if len(parts) >= 2:
+                timestamp = to_seconds(LOCAL.parse(parts[0].decode('ascii', 'replace'), parts[1].decode('ascii', 'replace')))
+                if not math.isnan(timestamp):
+                    return start, timestamp
+        return size, None
+
+    # Binary search for the first line logged at or after start_time, in a
+    # file whose lines are in time order
+    def _find_time(self, file, size, start_time):
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            _, timestamp = self._next_stamped_line(file, middle, size)
+            if timestamp is None or timestamp >= start_time:
+                high = middle
+            else:
+                low = middle + 1
+        return self._next_stamped_line(file, low, size)[0]
+
+    # Block for at most timeout seconds and return the paths that changed
+    def wait_for_changes(self, timeout=1.0):
+        if self.needs_scan:
+            self.needs_scan = False
+            self.pending |= self.scan()
+        if self.pending:
+            changed, self.pending = self.pending, set()
+            return changed
+
+        if self.watch:
+            names, overflowed = self.watch.read_events(timeout)
+            if overflowed:
+                return self.scan()
+            return {os.path.join(self.folder_path, name) for name in names if self.is_log_file(name)}
+
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self.scan()
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.poll_interval, remaining))
+
+    # Wait on the running event loop, without tying up a thread, until
+    # wait_for_changes(0) may have something: the inotify fd turning readable,
+    # or poll_interval passing when polling with stat()
+    async def wait_async(self, timeout=1.0):
+        if self.needs_scan or self.pending:
+            return
+        if self.watch is None:
+            await asyncio.sleep(min(self.poll_interval, timeout))
+            return
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self.watch.fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self.watch.fd)
+
+    # Read whatever was appended to file_path since we last looked. Handles the
+    # file being replaced (new inode) or truncated by starting again from 0.
+    def read_appended(self, file_path):
+        try:
+            file = open(file_path, 'rb')
+        except FileNotFoundError:
+            self.forget(file_path)
+            return None
+        with file:
+            st = os.fstat(file.fileno())
+            state = self.states.get(file_path)
+            if state is None:
+                state = self.states[file_path] = self._open_state(file_path, file, st)
+            elif state.inode != st.st_ino:
+                log.info("%s was rotated, reading new file from the start", file_path)
+                state.reset(st.st_ino)
+            elif st.st_size < state.offset:
+                log.info("%s was truncated, reading from the start", file_path)
+                state.reset(st.st_ino)
+            if self.index_dir and state.index is None:
+                state.index = LogIndex(file_path, self.index_dir)
+
+            state.size = st.st_size
+            if state.size <= state.offset:
+                return None
+            started = time.perf_counter()
+            file.seek(state.offset, os.SEEK_SET)
+            data = file.read(min(state.size - state.offset, self.max_read))
+            state.offset += len(data)
+            if state.index:
+                state.index.feed(data, state.offset - len(data))
+            if state.offset < state.size:
+                # Carry on with the rest on the next pass
+                self.pending.add(file_path)
+            if state.head[0] < min(state.offset, HEAD_BYTES):
+                state.head = read_head(file, state.offset)
+            self.read_latency.observe(time.perf_counter() - started)
+            self.detect_latency.observe(time.time() - st.st_mtime)
+            self.bytes_read.inc(len(data))
+            return state, data
+
+    # Wait for changes and yield (file_path, new_bytes) for every file that grew
+    def poll(self, timeout=1.0):
+        for file_path in sorted(self.wait_for_changes(timeout)):
+            result = self.read_appended(file_path)
+            if result:
+                yield file_path, result[1]
+
+    # Same as poll() but yields (file_path, lines) with every complete line
+    # appended since the last call. Partial trailing lines are kept per file.
+    def poll_lines(self, timeout=1.0):
+        for file_path in sorted(self.wait_for_changes(timeout)):
+            result = self.read_appended(file_path)
+            if not result:
+                continue
+            state, data = result
+            lines = state.framer.feed(data)
+            if lines:
+                yield file_path, lines
@@ -0,0 +1,70 @@
+import math
+
+import pytest
+
+import limits
+from limits import ControlLimits, LimitFilter
+from records import BoardRecord
+
+CONFIG = {
+    "board_data": {
+        "allow_control_limits": True,
+        "control_limits": {
+            "P1": {"additional_value": 50, "plus_minus": 10},
+            "T1": {"low_temp_value": 25, "high_temp_value": 145, "plus_minus": 5},
+            "T2": {"low_temp_value": 25, "high_temp_value": 145, "plus_minus": 5}
+        }
+    },
+    "temperature_control": {"ramp_rate": 2.0}
+}
+
+
+def record(board, t, **values):
+    return BoardRecord(board, values, f"Board: {board} " + " ".join(f"{key}:{value}" for key, value in values.items()), t)
+
+
+@pytest.fixture(params=["numpy", "rows"])
+def evaluation(request, monkeypatch):
+    if request.param == "rows":
+        monkeypatch.setattr(limits, "np", None)
+    return request.param
+
+
+# A board that is already at soak temperature when the session starts (or a
+# backlog row read from the start of a log) is checked against the high
+# temperature straight away, not against a ramp from the low one
+def test_hot_board_at_session_start_is_not_flagged(evaluation):
+    limit_filter = LimitFilter(ControlLimits.from_config(CONFIG), "exceptions", labels={"test": f"hot-{evaluation}"})
+    hot = record("01", 1000.0, P1=50.0, T1=144.0, T2=146.0)
+    assert limit_filter.process([hot], now=1000.0) == []
+    assert hot.failed == ()
+    assert hot.limits["T1"] == (140.0, 150.0)
+
+
+def test_temperatures_use_the_nearer_of_low_and_high(evaluation):
+    lower, upper, failed = ControlLimits.from_config(CONFIG).evaluate([[50.0, math.nan, 27.0, 90.0, math.nan, math.nan, math.nan, math.nan]])
+    lower, upper, failed = list(lower[0]), list(upper[0]), list(failed[0])
+    assert (lower[2], upper[2]) == (20.0, 30.0)
+    assert (lower[3], upper[3]) == (140.0, 150.0)
+    assert failed[3] and not failed[2] and not failed[0]
+
+
+def test_reading_outside_limits_is_sent_in_exceptions_mode(evaluation):
+    limit_filter = LimitFilter(ControlLimits.from_config(CONFIG), "exceptions", labels={"test": f"out-{evaluation}"})
+    cold = record("01", 1000.0, P1=50.0, T1=100.0, T2=145.0)
+    assert limit_filter.process([cold], now=1000.0) == [cold]
+    assert cold.failed == ("T1",)
+
+
+# Fields a user-edited sequence adds get limits too, and their readings are
+# summarised rather than sent as an empty "Board: NN " line
+def test_fields_from_a_custom_sequence(evaluation):
+    config = {"board_data": {"sequence": "PA PB", "allow_control_limits": True,
+                             "control_limits": {"PA": {"additional_value": 5, "plus_minus": 1}}},
+              "limit_mode": "exceptions"}
+    limit_filter = LimitFilter.from_config(config, labels={"test": f"custom-{evaluation}"})
+    high = record("01", 1000.0, PA=9.0, PB=2.0)
+    assert limit_filter.process([high, record("01", 1001.0, PA=5.0, PB=2.0)], now=1001.0) == [high]
+    assert high.failed == ("PA",)
+    summary, = limit_filter.flush(final=True)
+    assert summary.message == "Board: 01 PA:5 PB:2"
@@ -0,0 +1,35 @@
+from logparser import TREEBEARD_POSITIONS, LogParser
+
+
+def treebeard_line(columns, **values):
+    parts = ["2024-06-25", "13:20:16.451"] + ["0"] * (columns - 2)
+    for key, value in values.items():
+        parts[TREEBEARD_POSITIONS[key]] = str(value)
+    return " ".join(parts)
+
+
+# A Treebeard row has to reach every field's column, Ct's at 50 included;
+# a shorter one is a partial write and is skipped, not sent with made-up
+# values
+def test_treebeard_rows_must_reach_the_last_field():
+    parser = LogParser("Lot_07_Bench.txt", "", is_treebeard=True)
+    block = parser.parse_lines([treebeard_line(56, P1=99, T1=25.3, Ct=12), treebeard_line(40, P1=99, T1=25.3),
+                                "2024-06-25 13:20:17.000 1 2 3 4 5 6 7 8"])
+    records = block.to_records()
+    assert len(records) == 1
+    assert records[0].board == "07"
+    assert (records[0].values["P1"], records[0].values["T1"], records[0].values["Ct"]) == (99.0, 25.3, 12.0)
+
+
+def test_normal_rows_follow_the_sequence():
+    parser = LogParser("Board03.txt", "P1 T1")
+    records = parser.parse_lines(["2024-06-25 13:20:16.451 <00000> 99 253", "2024-06-25 13:20:17.451 <00000> 99"]).to_records()
+    assert [record.values for record in records] == [{"P1": 99.0, "T1": 253.0}]
+
+
+# The ASCII line carries each value as the log wrote it
+def test_messages_keep_the_log_text():
+    parser = LogParser("Board03.txt", "P1 P2 T1")
+    record, = parser.parse_lines(["2024-06-25 13:20:16.451 <00000> 0.10 99 N/A"]).to_records()
+    assert record.message == "Board: 03 P1:0.10 P2:99 T1:N/A"
+    assert record.values["P1"] == 0.1
@@ -0,0 +1,18 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_counter_cannot_go_down():
+    counter = Registry().counter("things_total", "Things")
+    counter.inc(2)
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+    assert counter.value == 2
+
+
+def test_gauge_can_go_down():
+    gauge = Registry().gauge("things", "Things")
+    gauge.inc(2)
+    gauge.inc(-1)
+    assert gauge.value == 1
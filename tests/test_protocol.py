@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import protocol
+from engine import TransmitterEngine
+from protocol import FIELDS, SCALES, ProtocolError, decode_frame, encode_record
+from uplink import UplinkScheduler
+
+
+def test_golden_vectors():
+    protocol.check_golden_vectors()
+
+
+def test_round_trip():
+    values = {"P1": 101.3, "P2": -7.5, "T1": 144.9, "T2": 25.0, "Vx": 0.123, "Vz": -1.5, "Ct": 3.2, "Vt": 120.0}
+    seq, board, decoded = decode_frame(encode_record(42, values, 300))
+    assert (seq, board) == (300 & 0xFF, 42)
+    assert decoded.keys() == values.keys()
+    for key, scale in zip(FIELDS, SCALES):
+        assert abs(decoded[key] - values[key]) <= 0.5 / scale
+
+
+# Missing values and fields the protocol doesn't know are left out
+def test_missing_and_unknown_fields_are_left_out():
+    _, _, decoded = decode_frame(encode_record(1, {"P1": float("nan"), "T1": 30.0, "XX": 5.0}, 0))
+    assert decoded == {"T1": 30.0}
+
+
+@pytest.mark.parametrize("offset", [2, 6, 9, -1])
+def test_corrupted_frame_fails_its_crc(offset):
+    frame = bytearray(encode_record(3, {"P1": 99.0, "T1": 25.3}, 1))
+    frame[offset] ^= 0x10
+    with pytest.raises(ProtocolError):
+        decode_frame(bytes(frame))
+
+
+def test_truncated_frame_is_rejected():
+    frame = encode_record(3, {"P1": 99.0}, 1)
+    with pytest.raises(ProtocolError):
+        decode_frame(frame[:-1])
+
+
+# Vx and Vz hold 32.767 at most at a scale of 1000; bigger values are
+# clamped and counted
+def test_out_of_range_value_is_clamped_and_counted():
+    before = protocol.CLAMPED.value
+    _, _, decoded = decode_frame(encode_record(1, {"Vx": 40.0, "Vz": -40.0, "P1": 99.0}, 0))
+    assert decoded == {"Vx": 32.767, "Vz": -32.768, "P1": 99.0}
+    assert protocol.CLAMPED.value == before + 2
+
+
+# Plays an ESP32 bridge: every line written is answered with `reply`, if any
+class Bridge:
+    def __init__(self, engine, reply):
+        self.engine = engine
+        self.reply = reply
+
+    async def write(self, data):
+        if self.reply:
+            asyncio.get_running_loop().call_soon(self.engine._dispatch, self.reply)
+
+
+def negotiate(reply, name):
+    async def main():
+        engine = TransmitterEngine("loop://", protocol="binary")
+        engine.loop = asyncio.get_running_loop()
+        engine.stream = Bridge(engine, reply)
+        engine.uplink = UplinkScheduler(engine.stream.write, labels={"test": name})
+        return await engine.negotiate_binary(), engine.uplink.binary
+
+    return asyncio.run(main())
+
+
+def test_binary_is_used_when_the_bridge_agrees():
+    assert negotiate(protocol.NEGOTIATE_OK, "agree") == (True, True)
+
+
+# ArduinoCode.ino doesn't answer PROTO BIN1, so the uplink stays on ASCII
+def test_falls_back_to_ascii_without_an_answer():
+    assert negotiate(None, "silent") == (False, False)
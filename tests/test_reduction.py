@@ -0,0 +1,25 @@
+from records import BoardRecord
+from reduction import Reducer
+
+
+def record(board, t, **values):
+    return BoardRecord(board, values, f"Board: {board} " + " ".join(f"{key}:{value}" for key, value in values.items()), t)
+
+
+# Readings of the fields a user-edited sequence names are folded into windows
+def test_window_keeps_fields_from_a_custom_sequence():
+    reducer = Reducer.from_config({"board_data": {"sequence": "PA PB"}, "reduction": {"window": 60}}, {"test": "custom"})
+    readings = [record("01", 1000.0 + 10 * i, PA=float(i), PB=2.0) for i in range(5)]
+    assert reducer.process(readings) == readings[:1]
+    window, = reducer.flush(final=True)
+    assert window.message == "Board: 01 PA:2.5 PB:2"
+    assert reducer.stats()["released"] == 1
+
+
+# A reading with none of the tracked fields is passed on unchanged
+def test_untracked_reading_is_sent_as_it_is():
+    reducer = Reducer.from_config({"reduction": {"window": 60}}, {"test": "untracked"})
+    readings = [record("01", 1000.0 + i, XX=1.0) for i in range(3)]
+    assert reducer.process(readings) == readings
+    assert reducer.flush(final=True) == []
+    assert reducer.stats()["sent"]["untracked"] == 3
@@ -0,0 +1,64 @@
+import asyncio
+
+from records import summary_record
+from uplink import UplinkScheduler
+
+
+# Plays the ESP32: every line written is echoed twice, except that each line
+# in `drop` loses its echoes the first `drop[line]` times it is written
+def bridge(drop):
+    written = []
+    seen = {}
+    scheduler = None
+
+    async def write(data):
+        loop = asyncio.get_running_loop()
+        for line in data.decode().splitlines():
+            written.append(line)
+            seen[line] = seen.get(line, 0) + 1
+            if seen[line] <= drop.get(line, 0):
+                continue
+            loop.call_soon(scheduler.on_line, line)
+            loop.call_soon(scheduler.on_line, line)
+
+    def attach(uplink):
+        nonlocal scheduler
+        scheduler = uplink
+
+    return write, attach, written
+
+
+def send(drop, count, name, max_retries=3):
+    write, attach, written = bridge(drop)
+    acked = []
+
+    async def main():
+        uplink = UplinkScheduler(write, baudrate=1_000_000, max_retries=max_retries, on_ack=acked.append, labels={"test": name})
+        attach(uplink)
+        task = asyncio.create_task(uplink.run())
+        for value in range(count):
+            await uplink.put(summary_record("01", {"P1": float(value)}), key="01", seq=value)
+        await uplink.drain(10)
+        task.cancel()
+        return uplink.stats()
+
+    return asyncio.run(main()), acked, written
+
+
+# Records ahead of an echoed one lost their echo and are written again, in
+# the order they were first written, without waiting for a timeout
+def test_lost_echoes_are_retried_in_order():
+    stats, acked, written = send({"Board: 01 P1:0": 1, "Board: 01 P1:1": 1}, 4, "lost")
+    assert written[4:] == ["Board: 01 P1:0", "Board: 01 P1:1"]
+    assert sorted(acked) == [0, 1, 2, 3]
+    assert stats["echoes_lost"] == 2 and stats["retries"] == 2 and stats["dropped"] == 0
+
+
+# A record that is never echoed is dropped after max_retries, and still acked
+# so the spool doesn't hold on to it
+def test_unechoed_record_is_dropped_and_acked():
+    stats, acked, written = send({"Board: 01 P1:1": 10}, 2, "dropped", max_retries=1)
+    assert written.count("Board: 01 P1:1") == 2
+    assert sorted(acked) == [0, 1]
+    assert stats["retries"] == 1 and stats["dropped"] == 1
+    assert stats["pending"] == 0 and stats["in_flight"] == 0
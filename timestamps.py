@@ -0,0 +1,212 @@
+import calendar
+import time
+from array import array
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # columns are parsed one value at a time instead
+    np = None
+
+# Timestamps as int64 epoch milliseconds. Board logs carry local times like
+# "2024-06-21 08:59:55.879"; parsing one used to go through datetime and
+# mktime for every row. Here the date part is looked up in a cache of
+# midnights, and on days with a fixed UTC offset (no DST change) the time
+# of day is just added to it. Whole columns of HH:MM:SS.mmm times are
+# parsed with NumPy when it is installed. Formatting works the same way
+# round, with the date prefix cached for the current day.
+#
+# Records carry two times: timestamp, when the source says the reading was
+# taken (epoch seconds), and captured, when the transmitter took it in
+# (time.monotonic()), so latency through the transmitter can be measured.
+
+MISSING = -(1 << 63)  # Stands in for an unparseable timestamp in an int64 column
+DAY_MS = 86400000
+NAN = float("nan")
+TIME_LENGTH = len("08:59:55.879")
+
+# Most distinct date strings a codec keeps
+MAX_DATES = 1024
+
+# Milliseconds for every "HH:MM", "SS" and "mmm", so the usual time of day is
+# three dictionary lookups rather than four int() calls
+MINUTE_MS = {f"{hours:02d}:{minutes:02d}": (hours * 60 + minutes) * 60000 for hours in range(24) for minutes in range(60)}
+SECOND_MS = {f"{seconds:02d}": seconds * 1000 for seconds in range(60)}
+MILLIS = {f"{millis:03d}": millis for millis in range(1000)}
+
+# Where the digits of HH:MM:SS.mmm are and what each is worth in ms
+DIGIT_COLUMNS = [0, 1, 3, 4, 6, 7, 9, 10, 11]
+DIGIT_WEIGHTS = (36000000, 3600000, 600000, 60000, 10000, 1000, 100, 10, 1)
+
+
+# Milliseconds since midnight for "HH:MM:SS", "HH:MM:SS.mmm" or longer
+# fractions (truncated to milliseconds), None if it isn't a time of day
+def parse_time_of_day(time_part):
+    if len(time_part) == TIME_LENGTH and time_part[8] == "." and time_part[2] == ":":
+        try:
+            return MINUTE_MS[time_part[:5]] + SECOND_MS[time_part[6:8]] + MILLIS[time_part[9:]]
+        except KeyError:
+            pass
+    if len(time_part) < 8 or time_part[2] != ":" or time_part[5] != ":":
+        return None
+    try:
+        hours, minutes, seconds = int(time_part[0:2]), int(time_part[3:5]), int(time_part[6:8])
+        millis = 0
+        if len(time_part) > 8:
+            if time_part[8] != "." or not time_part[9:].isdigit():
+                return None
+            millis = int(time_part[9:12].ljust(3, "0"))
+    except ValueError:
+        return None
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis
+
+
+class TimestampCodec:
+    def __init__(self, utc=False):
+        self.utc = utc
+        self.dates = {}  # "YYYY-MM-DD" -> (midnight ms, fixed offset) or None
+        self.day = None  # (start ms, end ms, "YYYY-MM-DD") of the last day formatted
+        self.second = (None, None, None)  # (second ms, sep, "YYYY-MM-DD HH:MM:SS") last formatted
+
+    # Epoch ms of midnight on a date and whether the whole day has one UTC
+    # offset, or None if it isn't a YYYY-MM-DD date
+    def midnight(self, date_part):
+        day = self.dates.get(date_part)
+        if day is not None or date_part in self.dates:
+            return day
+        day = None
+        if len(date_part) == 10 and date_part[4] == "-" and date_part[7] == "-":
+            try:
+                start = datetime(int(date_part[0:4]), int(date_part[5:7]), int(date_part[8:10]))
+                if self.utc:
+                    day = (calendar.timegm(start.timetuple()) * 1000, True)
+                else:
+                    midnight = int(time.mktime(start.timetuple())) * 1000
+                    next_midnight = int(time.mktime(datetime.fromordinal(start.toordinal() + 1).timetuple())) * 1000
+                    day = (midnight, next_midnight - midnight == DAY_MS)
+            except (ValueError, OverflowError, OSError):
+                day = None
+        if len(self.dates) >= MAX_DATES:
+            self.dates.clear()
+        self.dates[date_part] = day
+        return day
+
+    # Epoch ms of "YYYY-MM-DD" "HH:MM:SS.mmm", MISSING if it isn't a timestamp
+    def parse(self, date_part, time_part):
+        day = self.dates.get(date_part) or self.midnight(date_part)
+        if day is None:
+            return MISSING
+        if day[1] and len(time_part) == TIME_LENGTH and time_part[8] == ".":
+            try:
+                return day[0] + MINUTE_MS[time_part[:5]] + SECOND_MS[time_part[6:8]] + MILLIS[time_part[9:]]
+            except KeyError:
+                pass
+        of_day = parse_time_of_day(time_part)
+        if of_day is None:
+            return MISSING
+        midnight, fixed = day
+        if fixed:
+            return midnight + of_day
+        # The offset changes during this day, let datetime work it out
+        return self._parse_slow(date_part, of_day)
+
+    def _parse_slow(self, date_part, of_day):
+        seconds, millis = divmod(of_day, 1000)
+        moment = datetime.fromisoformat(date_part).replace(hour=seconds // 3600, minute=seconds // 60 % 60, second=seconds % 60)
+        if self.utc:
+            return calendar.timegm(moment.timetuple()) * 1000 + millis
+        return int(moment.timestamp()) * 1000 + millis
+
+    # Parse a column of date parts and a column of time parts into an
+    # array('q') of epoch ms (MISSING where a row isn't a timestamp)
+    def parse_column(self, dates, times):
+        if np is not None and len(times) > 1:
+            parsed = self._parse_column_numpy(dates, times)
+            if parsed is not None:
+                return array('q', parsed.tobytes())
+        return array('q', [self.parse(date_part, time_part) for date_part, time_part in zip(dates, times)])
+
+    # Same as parse_column() but in epoch seconds, NaN where missing
+    def parse_column_seconds(self, dates, times):
+        if np is not None and len(times) > 1:
+            parsed = self._parse_column_numpy(dates, times)
+            if parsed is not None:
+                seconds = np.where(parsed == MISSING, np.nan, parsed / 1000.0)
+                return array('d', seconds.tobytes())
+        return array('d', [to_seconds(self.parse(date_part, time_part)) for date_part, time_part in zip(dates, times)])
+
+    # Vectorised parse for the common case: every time HH:MM:SS.mmm and
+    # every date on a fixed-offset day. Returns None to fall back to parse().
+    def _parse_column_numpy(self, dates, times):
+        count = len(times)
+        if len(dates) != count or not all(len(time_part) == TIME_LENGTH for time_part in times):
+            return None
+        if dates.count(dates[0]) == count:
+            day = self.midnight(dates[0])
+            if day is None or not day[1]:
+                return None
+            midnights = day[0]
+        else:
+            days = [self.midnight(date_part) for date_part in dates]
+            if not all(day and day[1] for day in days):
+                return None
+            midnights = np.fromiter((day[0] for day in days), dtype=np.int64, count=count)
+        try:
+            raw = np.frombuffer("".join(times).encode('ascii'), dtype=np.uint8).reshape(count, TIME_LENGTH)
+        except UnicodeEncodeError:
+            return None
+        # Anything that isn't a digit wraps round to above 9
+        digits = raw[:, DIGIT_COLUMNS] - np.uint8(ord("0"))
+        valid = ((raw[:, 2] == ord(":")) & (raw[:, 5] == ord(":")) & (raw[:, 8] == ord("."))
+                 & (digits <= 9).all(axis=1)
+                 & (digits[:, 0] * 10 + digits[:, 1] <= 23) & (digits[:, 2] <= 5) & (digits[:, 4] <= 5))
+        # A float64 dot product is exact at these sizes and much faster than int64
+        of_day = (digits.astype(np.float64) @ np.array(DIGIT_WEIGHTS, dtype=np.float64)).astype(np.int64)
+        return np.where(valid, midnights + of_day, MISSING)
+
+    # "YYYY-MM-DD HH:MM:SS.mmm" for epoch ms; sep goes between the date and
+    # the time, milliseconds=False leaves them off and suffix is appended
+    def format(self, ms, sep=" ", milliseconds=True, suffix=""):
+        second_ms = ms - ms % 1000
+        second = self.second
+        if second[0] == second_ms and second[1] == sep:
+            text = second[2]
+            return (f"{text}.{ms - second_ms:03d}" if milliseconds else text) + suffix
+        day = self.day
+        if day is None or day[0] is None or not day[0] <= ms < day[1]:
+            day = self.day = self._day_of(ms)
+        start, _, date_part = day
+        if start is None:
+            # Not a fixed-offset day, format it the slow way
+            moment = time.gmtime(ms // 1000) if self.utc else time.localtime(ms // 1000)
+            text = time.strftime(f"%Y-%m-%d{sep}%H:%M:%S", moment)
+            self.second = (second_ms, sep, text)
+            return (f"{text}.{ms - second_ms:03d}" if milliseconds else text) + suffix
+        seconds, millis = divmod(ms - start, 1000)
+        text = f"{date_part}{sep}{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+        self.second = (second_ms, sep, text)
+        return (f"{text}.{millis:03d}" if milliseconds else text) + suffix
+
+    # (start ms, end ms, "YYYY-MM-DD") of the day holding ms; start is None
+    # on days whose UTC offset changes
+    def _day_of(self, ms):
+        moment = time.gmtime(ms // 1000) if self.utc else time.localtime(ms // 1000)
+        date_part = f"{moment.tm_year:04d}-{moment.tm_mon:02d}-{moment.tm_mday:02d}"
+        midnight, fixed = self.midnight(date_part) or (None, False)
+        if not fixed:
+            return (None, None, date_part)
+        return (midnight, midnight + DAY_MS, date_part)
+
+
+LOCAL = TimestampCodec()
+UTC = TimestampCodec(utc=True)
+
+
+def to_seconds(ms):
+    return NAN if ms == MISSING else ms / 1000
+
+
+def now_ms():
+    return time.time_ns() // 1000000
@@ -0,0 +1,310 @@
+import tkinter as tk
+from tkinter import messagebox, filedialog, ttk
+from monitor import save_config
+
+# The Tk windows of the transmitter app. Transmitter.py only imports this
+# module when it opens them, so the headless commands don't need Tk.
+
+# UI Class for editing configuration
+class EditConfigWindow(tk.Toplevel):
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("Edit Configuration")
+        self.geometry("400x600")  # Set a fixed window size
+        self.config = master.config
+
+        # Create a canvas to contain the scrollable frame
+        self.canvas = tk.Canvas(self)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Add a vertical scrollbar linked to the canvas
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Create a frame inside the canvas to hold the configuration widgets
+        self.scrollable_frame = tk.Frame(self.canvas)
+        self.scrollable_frame.bind(
+            "<Configure>",
+            lambda e: self.canvas.configure(
+                scrollregion=self.canvas.bbox("all")
+            )
+        )
+
+        # Add the scrollable frame to the canvas
+        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
+
+        # Configure the canvas to respond to scrollbar movement
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+
+        # Add configuration widgets inside the scrollable frame
+        self.create_config_widgets()
+
+    def create_config_widgets(self):
+        # General Settings
+        self.transmitter_frame = tk.LabelFrame(self.scrollable_frame, text="Transmitter Port")
+        self.transmitter_frame.pack(pady=10, fill="x", padx=10)
+
+        self.trans_com_port_var = tk.StringVar(value=self.config["transmitter_com"])
+        self.trans_com_port_entry = tk.Entry(self.transmitter_frame, textvariable=self.trans_com_port_var)
+        self.trans_com_port_entry.pack(fill="x", padx=5, pady=5)  # Display entry field correctly
+
+        # Logging Board Data Checkbox
+        self.logging_frame = tk.LabelFrame(self.scrollable_frame, text="Logging")
+        self.logging_frame.pack(pady=10, fill="x", padx=10)
+        self.log_board_data_var = tk.BooleanVar(value=self.config["log_board_data"])
+        self.log_board_data_checkbox = tk.Checkbutton(self.logging_frame, text="Log Board Data", variable=self.log_board_data_var)
+        self.log_board_data_checkbox.pack(anchor="w", pady=5)
+
+        # Temperature Control Settings
+        self.temperature_frame = tk.LabelFrame(self.scrollable_frame, text="Temperature Control")
+        self.temperature_frame.pack(pady=10, fill="x", padx=10)
+
+        self.allow_control_limits_var = tk.BooleanVar(value=self.config["temperature_control"]["allow_control_limits"])
+        self.allow_control_limits_checkbox = tk.Checkbutton(self.temperature_frame, text="Allow Control Limits", variable=self.allow_control_limits_var)
+        self.allow_control_limits_checkbox.pack(anchor="w", pady=5)
+
+        self.lower_temp_value_var = tk.DoubleVar(value=self.config["temperature_control"]["lower_temp_value"])
+        tk.Label(self.temperature_frame, text="Lower Temp Value").pack(anchor="w")
+        tk.Entry(self.temperature_frame, textvariable=self.lower_temp_value_var).pack(fill="x", pady=5)
+
+        self.high_temp_value_var = tk.DoubleVar(value=self.config["temperature_control"]["high_temp_value"])
+        tk.Label(self.temperature_frame, text="High Temp Value").pack(anchor="w")
+        tk.Entry(self.temperature_frame, textvariable=self.high_temp_value_var).pack(fill="x", pady=5)
+
+        self.temp_limits_plus_minus_var = tk.DoubleVar(value=self.config["temperature_control"]["temp_limits_plus_minus"])
+        tk.Label(self.temperature_frame, text="Temp Limits Plus/Minus").pack(anchor="w")
+        tk.Entry(self.temperature_frame, textvariable=self.temp_limits_plus_minus_var).pack(fill="x", pady=5)
+
+        self.ramp_rate_var = tk.DoubleVar(value=self.config["temperature_control"].get("ramp_rate", 0.0))
+        tk.Label(self.temperature_frame, text="Ramp Rate (Optional)").pack(anchor="w")
+        tk.Entry(self.temperature_frame, textvariable=self.ramp_rate_var).pack(fill="x", pady=5)
+
+        # Board Data Settings
+        self.board_frame = tk.LabelFrame(self.scrollable_frame, text="Board Data")
+        self.board_frame.pack(pady=10, fill="x", padx=10)
+
+        self.modbus_burnsys_var = tk.StringVar(value=self.config["board_data"]["modbus_burnsys"])
+        tk.Label(self.board_frame, text="Board Data Source").pack(anchor="w")
+        self.modbus_burnsys_combobox = ttk.Combobox(self.board_frame, textvariable=self.modbus_burnsys_var, values=["Modbus", "Burnsys"])
+        self.modbus_burnsys_combobox.pack(fill="x", pady=5)
+        self.modbus_burnsys_combobox.bind("<<ComboboxSelected>>", self.update_board_data_options)
+
+        self.is_treebeard_var = tk.BooleanVar(value=self.config["board_data"]["is_treebeard"])
+        self.is_treebeard_checkbox = tk.Checkbutton(self.board_frame, text="Is Treebeard?", variable=self.is_treebeard_var)
+        self.is_treebeard_checkbox.pack(anchor="w", pady=5)
+
+        # Initialize both, but show only the relevant one based on the selection
+        self.sequence_var = tk.StringVar(value=self.config["board_data"]["sequence"])
+        self.sequence_label = tk.Label(self.board_frame, text="ModBus Sequence")
+        self.sequence_entry = tk.Entry(self.board_frame, textvariable=self.sequence_var)
+        self.folder_path_var = tk.StringVar(value=self.config["board_data"]["folder_path"])
+        self.folder_path_label = tk.Label(self.board_frame, text="Folder Path")
+        self.folder_path_entry = tk.Entry(self.board_frame, textvariable=self.folder_path_var)
+        self.folder_path_button = tk.Button(self.board_frame, text="Browse", command=self.browse_folder)
+
+        self.com_port_var = tk.StringVar(value=self.config["board_data"]["com_port"])
+        self.com_port_label = tk.Label(self.board_frame, text="COM Port")
+        self.com_port_entry = tk.Entry(self.board_frame, textvariable=self.com_port_var)
+
+        self.allow_board_control_limits_var = tk.BooleanVar(value=self.config["board_data"]["allow_control_limits"])
+        self.allow_board_control_limits_checkbox = tk.Checkbutton(self.board_frame, text="Allow Control Limits", variable=self.allow_board_control_limits_var)
+        self.allow_board_control_limits_checkbox.pack(anchor="w", pady=5)
+
+        self.update_board_data_options()
+
+        # Control limits for P1, P2, T1, T2, Vx, Vz, Ct, Vt
+        self.control_limits_frame = tk.LabelFrame(self.scrollable_frame, text="Control Limits")
+        self.control_limits_frame.pack(pady=10, fill="x", padx=10)
+
+        self.control_limits_vars = {}
+        for param in ["P1", "P2", "T1", "T2", "Vx", "Vz", "Ct", "Vt"]:
+            param_frame = tk.Frame(self.control_limits_frame)
+            param_frame.pack(fill="x", pady=5)
+
+            tk.Label(param_frame, text=param).pack(side="left", padx=5)
+            plus_minus_var = tk.DoubleVar(value=self.config["board_data"]["control_limits"][param]["plus_minus"])
+            tk.Entry(param_frame, textvariable=plus_minus_var, width=10).pack(side="left", padx=5)
+            self.control_limits_vars[param] = {"plus_minus": plus_minus_var}
+
+            if param in ["T1", "T2"]:
+                low_temp_var = tk.DoubleVar(value=self.config["board_data"]["control_limits"][param]["low_temp_value"])
+                high_temp_var = tk.DoubleVar(value=self.config["board_data"]["control_limits"][param]["high_temp_value"])
+                tk.Label(param_frame, text="Low Temp").pack(side="left", padx=5)
+                tk.Entry(param_frame, textvariable=low_temp_var, width=10).pack(side="left", padx=5)
+                tk.Label(param_frame, text="High Temp").pack(side="left", padx=5)
+                tk.Entry(param_frame, textvariable=high_temp_var, width=10).pack(side="left", padx=5)
+                self.control_limits_vars[param]["low_temp_value"] = low_temp_var
+                self.control_limits_vars[param]["high_temp_value"] = high_temp_var
+            else:
+                # Adding an additional value next to P1, P2, Vx, Vz, Ct, Vt
+                additional_value_var = tk.DoubleVar(value=self.config["board_data"]["control_limits"][param].get("additional_value", 0.0))
+                tk.Label(param_frame, text="Set Value").pack(side="left", padx=5)
+                tk.Entry(param_frame, textvariable=additional_value_var, width=10).pack(side="left", padx=5)
+                self.control_limits_vars[param]["additional_value"] = additional_value_var
+
+        # Save Button
+        self.save_button = tk.Button(self.scrollable_frame, text="Save Configuration", command=self.save_config)
+        self.save_button.pack(pady=20)
+
+    def toggle_treebeard_options(self):
+        pass  # Treebeard is just a checkbox, no additional inputs needed
+
+    def browse_folder(self):
+        folder_selected = filedialog.askdirectory()
+        if folder_selected:
+            self.folder_path_var.set(folder_selected)
+
+    def update_board_data_options(self, event=None):
+        # Remove current inputs
+        self.sequence_label.pack_forget()
+        self.sequence_entry.pack_forget()
+        self.folder_path_label.pack_forget()
+        self.folder_path_entry.pack_forget()
+        self.folder_path_button.pack_forget()
+        self.com_port_label.pack_forget()
+        self.com_port_entry.pack_forget()
+
+        if self.modbus_burnsys_var.get() == "Modbus":
+            # Show folder path input
+            self.folder_path_label.pack(anchor="w")
+            self.folder_path_entry.pack(fill="x", pady=5)
+            self.folder_path_button.pack(anchor="w")
+            self.sequence_label.pack(anchor="w")
+            self.sequence_entry.pack(fill="x", pady=5)
+        elif self.modbus_burnsys_var.get() == "Burnsys":
+            # Show COM port input
+            self.com_port_label.pack(anchor="w")
+            self.com_port_entry.pack(fill="x", pady=5)
+
+    def save_config(self):
+        self.config["transmitter_com"] = self.trans_com_port_var.get()
+        self.config["log_board_data"] = self.log_board_data_var.get()
+        self.config["temperature_control"]["allow_control_limits"] = self.allow_control_limits_var.get()
+        self.config["temperature_control"]["lower_temp_value"] = self.lower_temp_value_var.get()
+        self.config["temperature_control"]["high_temp_value"] = self.high_temp_value_var.get()
+        self.config["temperature_control"]["temp_limits_plus_minus"] = self.temp_limits_plus_minus_var.get()
+        self.config["temperature_control"]["ramp_rate"] = self.ramp_rate_var.get() if self.ramp_rate_var.get() else None
+
+        self.config["board_data"]["modbus_burnsys"] = self.modbus_burnsys_var.get()
+        self.config["board_data"]["is_treebeard"] = self.is_treebeard_var.get()
+
+        if self.modbus_burnsys_var.get() == "Modbus":
+            self.config["board_data"]["folder_path"] = self.folder_path_var.get()
+            self.config["board_data"]["sequence"] = self.sequence_var.get()
+        elif self.modbus_burnsys_var.get() == "Burnsys":
+            self.config["board_data"]["com_port"] = self.com_port_var.get()
+
+        self.config["board_data"]["allow_control_limits"] = self.allow_board_control_limits_var.get()
+
+        for param, vars in self.control_limits_vars.items():
+            self.config["board_data"]["control_limits"][param]["plus_minus"] = vars["plus_minus"].get()
+            if param in ["T1", "T2"]:
+                self.config["board_data"]["control_limits"][param]["low_temp_value"] = vars["low_temp_value"].get()
+                self.config["board_data"]["control_limits"][param]["high_temp_value"] = vars["high_temp_value"].get()
+            else:
+                self.config["board_data"]["control_limits"][param]["additional_value"] = vars["additional_value"].get()
+
+        save_config(self.config)
+        messagebox.showinfo("Save Configuration", "Configuration saved successfully!")
+
+
+# UI Class
+# The monitor is either an OvenMonitor running in this process or a
+# service.ControlClient for a headless service; the app only calls the
+# lifecycle methods and shows what they return.
+class OvenApp(tk.Tk):
+    def __init__(self, monitor, config):
+        super().__init__()
+        self.monitor = monitor
+        self.oven_name = ""
+        self.title("Oven Monitor")
+        self.geometry("300x200")
+        self.config = config
+
+        # Initial connection controls
+        self.oven_name_label = tk.Label(self, text="Oven Name:")
+        self.oven_name_label.pack(pady=5)
+        self.oven_name_entry = tk.Entry(self)
+        self.oven_name_entry.pack(pady=5)
+        self.connect_button = tk.Button(self, text="Establish Connection", command=self.establish_connection)
+        self.connect_button.pack(pady=5)
+        self.disconnect_button = tk.Button(self, text="End Connection", command=self.end_connection)
+        self.disconnect_button.pack(pady=5)
+        self.edit_config_button = tk.Button(self, text="Edit Configuration", command=self.open_edit_window)
+        self.edit_config_button.pack(pady=5)
+
+        # Active session controls (initially hidden)
+        self.start_active_button = tk.Button(self, text="Start Active Session", command=self.start_active_session)
+        self.end_active_button = tk.Button(self, text="End Active Session", command=self.end_active_session)
+
+        # Hide active session controls initially
+        self.hide_active_session_controls()
+
+    def establish_connection(self):
+        self.oven_name = self.oven_name_entry.get()
+        if not self.oven_name:
+            messagebox.showwarning("Input Error", "Please enter the oven name.")
+            return
+        try:
+            message = self.monitor.establish_connection(self.oven_name)
+        except Exception as e:
+            messagebox.showerror("Connection Error", f"Failed to establish connection: {str(e)}")
+            return
+        if message:
+            messagebox.showinfo("Connection", message)
+        self.show_active_session_controls()
+
+    def end_connection(self):
+        try:
+            message = self.monitor.end_connection()
+        except Exception as e:
+            messagebox.showerror("Connection Error", f"Failed to end connection: {str(e)}")
+            return
+        self.show_connection_controls()
+        messagebox.showinfo("Connection", message)
+
+    def start_active_session(self):
+        try:
+            message = self.monitor.start_active_session()
+        except Exception as e:
+            messagebox.showerror("Active Session", f"Failed to start active session: {str(e)}")
+            return
+        messagebox.showinfo("Active Session", message)
+
+    def end_active_session(self):
+        try:
+            message = self.monitor.end_active_session()
+        except Exception as e:
+            messagebox.showerror("Active Session", f"Failed to end active session: {str(e)}")
+            return
+        messagebox.showinfo("Active Session", message)
+        self.show_connection_controls()
+
+
+    def update_temperature_display(self, temperature):
+        self.temperature_label.config(text=f"Current Temperature: {temperature:.2f}°C")
+
+    def show_active_session_controls(self):
+        self.oven_name_label.pack_forget()
+        self.oven_name_entry.pack_forget()
+        self.connect_button.pack_forget()
+        self.disconnect_button.pack_forget()
+        self.edit_config_button.pack_forget()
+
+        self.start_active_button.pack(pady=5)
+        self.end_active_button.pack(pady=5)
+
+    def hide_active_session_controls(self):
+        self.start_active_button.pack_forget()
+        self.end_active_button.pack_forget()
+
+    def show_connection_controls(self):
+        self.oven_name_label.pack(pady=5)
+        self.oven_name_entry.pack(pady=5)
+        self.connect_button.pack(pady=5)
+        self.disconnect_button.pack(pady=5)
+        self.edit_config_button.pack(pady=5)
+        self.hide_active_session_controls()
+
+    def open_edit_window(self):
+        EditConfigWindow(self)
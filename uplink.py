@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+import protocol
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# ArduinoCode.ino prints every line it reads back out, and prints board lines
+# a second time once handleBoardData() has sent them over the websocket
+ECHOES_PER_LINE = 2
+
+
+# Wait for an event for up to `timeout` seconds. asyncio.wait_for() on 3.11
+# can swallow a cancel that lands just as the event is set, which would leave
+# the writer running after the engine has closed the link.
+async def wait_event(event, timeout):
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait((waiter,), timeout=timeout)
+    finally:
+        waiter.cancel()
+
+
+# A record written to the ESP32 that hasn't been acknowledged yet. ack is the
+# line the bridge prints for it, expected `echoes` times; attempts counts the
+# writes before this one.
+class InFlight:
+    def __init__(self, record, seq, ack, echoes, size, sent_at, attempts):
+        self.record = record
+        self.seq = seq
+        self.ack = ack
+        self.expected = echoes
+        self.size = size
+        self.sent_at = sent_at
+        self.attempts = attempts
+        self.echoes = 0
+
+
+# ASCII mode: the record's own "Board: ..." line, echoed back by the bridge
+def encode_ascii(record, seq):
+    return (record.message + "\n").encode('utf-8'), record.message, ECHOES_PER_LINE
+
+
+# Binary mode: a BIN1 frame, acknowledged with "ACK <seq>"
+def encode_binary(record, seq):
+    seq &= 0xFF
+    return protocol.encode_record(record.board_id, record.values, seq), f"{protocol.ACK_PREFIX}{seq}", 1
+
+
+# Paces board records over the 9600 baud link to the ESP32. Records are
+# written several to a serial write, but only while the bytes the bridge
+# hasn't echoed back yet fit in `window_bytes` (its UART buffer is 256 bytes),
+# so the write rate follows how fast the bridge actually drains the link.
+# When more than `coalesce_above` records are waiting, a new record for a
+# board replaces that board's pending one; past `queue_size` producers wait.
+class UplinkScheduler:
+    # on_ack(seq) is called once a record queued with a spool sequence number
+    # has been acknowledged, superseded by a newer reading or dropped. A
+    # record that isn't echoed in time goes back to the front of the queue,
+    # up to max_retries times, and is then dropped (counted, and acked so the
+    # spool can move on). labels (e.g. {"oven": name}) tag this uplink's metrics.
+    def __init__(self, write, baudrate=9600, window_bytes=192, max_batch=8, coalesce_above=64, queue_size=500, max_retries=3, on_ack=None, labels=None):
+        self.write = write
+        self.max_retries = max_retries
+        self.on_ack = on_ack
+        self.paused = False
+        self.window_bytes = window_bytes
+        self.max_batch = max_batch
+        self.coalesce_above = coalesce_above
+        self.queue_size = queue_size
+        self.encode = encode_ascii
+        self.frames_sent = 0
+        self.pending = OrderedDict()
+        self.latest = {}
+        self.in_flight = deque()
+        self.in_flight_bytes = 0
+        self.sequence = 0
+        # Start from the raw line rate (10 bits per byte) until acks come in
+        self.drain_rate = baudrate / 10
+        self.last_ack_at = 0.0
+        self.changed = asyncio.Event()
+        self.records_sent = 0
+        self.bytes_sent = 0
+        self.writes = 0
+        self.acks = 0
+        self.ack_timeouts = 0
+        self.retries = 0
+        self.dropped = 0
+        self.echoes_lost = 0
+        self.coalesced = 0
+        self._register_metrics(labels or {})
+
+    def _register_metrics(self, labels):
+        self.queue_latency = REGISTRY.histogram("uplink_queue_seconds", "Time a record waits in the uplink queue before it is written", **labels)
+        self.write_latency = REGISTRY.histogram("uplink_write_seconds", "Duration of one serial write to the transmitter", **labels)
+        self.ack_latency = REGISTRY.histogram("uplink_ack_seconds", "Time from writing a record to the transmitter acknowledging it", **labels)
+        self.record_latency = REGISTRY.histogram("uplink_record_seconds", "Time from a record being read from its source to the transmitter acknowledging it", **labels)
+        REGISTRY.counter_function("uplink_records_sent_total", "Records written to the transmitter", lambda: self.records_sent, **labels)
+        REGISTRY.counter_function("uplink_bytes_sent_total", "Bytes written to the transmitter", lambda: self.bytes_sent, **labels)
+        REGISTRY.counter_function("uplink_acks_total", "Records acknowledged by the transmitter", lambda: self.acks, **labels)
+        REGISTRY.counter_function("uplink_ack_timeouts_total", "Writes that were not acknowledged in time", lambda: self.ack_timeouts, **labels)
+        REGISTRY.counter_function("uplink_retries_total", "Records written again after their acknowledgement went missing", lambda: self.retries, **labels)
+        REGISTRY.counter_function("uplink_dropped_total", "Records dropped after max_retries writes went unacknowledged", lambda: self.dropped, **labels)
+        REGISTRY.counter_function("uplink_echoes_lost_total", "Writes whose echo was lost because a later record was echoed first", lambda: self.echoes_lost, **labels)
+        REGISTRY.counter_function("uplink_coalesced_total", "Queued records replaced by a newer reading for the same board", lambda: self.coalesced, **labels)
+        REGISTRY.gauge_function("uplink_pending", "Records waiting in the uplink queue", lambda: len(self.pending), **labels)
+        REGISTRY.gauge_function("uplink_in_flight_bytes", "Bytes written but not yet acknowledged", lambda: self.in_flight_bytes, **labels)
+
+    # Switch to BIN1 frames once the bridge has agreed to them
+    def use_binary(self, enabled=True):
+        self.encode = encode_binary if enabled else encode_ascii
+
+    @property
+    def binary(self):
+        return self.encode is encode_binary
+
+    # Queue a BoardRecord. key identifies the board so a backlog can be
+    # coalesced, seq is the record's position in the spool (if any).
+    async def put(self, record, key=None, seq=None):
+        if key is not None and len(self.pending) >= self.coalesce_above:
+            slot = self.latest.get(key)
+            if slot in self.pending:
+                _, replaced_seq, queued_at, _ = self.pending[slot]
+                self.pending[slot] = (record, seq, queued_at, 0)
+                self.coalesced += 1
+                self._done(replaced_seq)
+                return
+        while len(self.pending) >= self.queue_size:
+            self.changed.clear()
+            await self.changed.wait()
+        self.sequence += 1
+        slot = (key, self.sequence)
+        self.pending[slot] = (record, seq, time.monotonic(), 0)
+        if key is not None:
+            self.latest[key] = slot
+        self.changed.set()
+
+    # Called with every line the ESP32 prints; returns True if it was the
+    # acknowledgement of a record we sent. The bridge echoes records in the
+    # order they were written, so records ahead of the one echoed lost their
+    # echo (a dropped or garbled line) and are retried straight away rather
+    # than holding up the window until they time out.
+    def on_line(self, line):
+        for index, entry in enumerate(self.in_flight):
+            if entry.ack == line:
+                break
+        else:
+            return False
+        now = time.monotonic()
+        if index:
+            self._unacknowledged(index, now, lost=True)
+        entry.echoes += 1
+        if entry.echoes >= entry.expected:
+            self._acknowledge(now)
+        return True
+
+    def _done(self, seq):
+        if seq is not None and self.on_ack:
+            self.on_ack(seq)
+
+    # Stop writing, e.g. while the serial link is down
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.changed.set()
+
+    # Forget everything queued or in flight without acknowledging it; the
+    # spool still has those records and replays them after a reconnect
+    def reset(self):
+        self.pending.clear()
+        self.latest.clear()
+        self.in_flight.clear()
+        self.in_flight_bytes = 0
+        self.changed.set()
+
+    def _acknowledge(self, now):
+        head = self.in_flight.popleft()
+        self.in_flight_bytes -= head.size
+        self.acks += 1
+        self.ack_latency.observe(now - head.sent_at)
+        if not math.isnan(head.record.captured):
+            self.record_latency.observe(now - head.record.captured)
+        elapsed = now - max(head.sent_at, self.last_ack_at)
+        if elapsed > 0:
+            # Smoothed bytes per second the bridge is getting through
+            self.drain_rate = 0.8 * self.drain_rate + 0.2 * (head.size / elapsed)
+        self.last_ack_at = now
+        self._done(head.seq)
+        self.changed.set()
+
+    # Take the `count` oldest records off the window without an echo (timed
+    # out, or lost if a later record was echoed first). Each goes back to the
+    # front of the queue, in the order it was written, or is dropped once it
+    # has been retried max_retries times.
+    def _unacknowledged(self, count, now, lost=False):
+        entries = [self.in_flight.popleft() for _ in range(count)]
+        for entry in reversed(entries):
+            self.in_flight_bytes -= entry.size
+            if lost:
+                self.echoes_lost += 1
+            else:
+                self.ack_timeouts += 1
+            if entry.attempts < self.max_retries:
+                self.retries += 1
+                self.sequence += 1
+                slot = (None, self.sequence)
+                self.pending[slot] = (entry.record, entry.seq, now, entry.attempts + 1)
+                self.pending.move_to_end(slot, last=False)
+            else:
+                log.warning("Dropping a record after %d unacknowledged writes: %s", entry.attempts + 1, entry.record.message[:80])
+                self.dropped += 1
+                # Acked so the spool doesn't hold on to it for ever
+                self._done(entry.seq)
+        self.last_ack_at = now
+        self.changed.set()
+
+    # How long to wait for the oldest record before giving up on its echo
+    def ack_timeout(self):
+        return max(1.0, 4 * self.in_flight_bytes / self.drain_rate)
+
+    def _expire(self, now):
+        timeout = self.ack_timeout()
+        count = 0
+        for entry in self.in_flight:
+            if now - entry.sent_at <= timeout:
+                break
+            count += 1
+        if count:
+            self._unacknowledged(count, now)
+
+    # Encode pending records into one write while they fit in the window
+    def _next_batch(self, now):
+        batch = []
+        size = self.in_flight_bytes
+        while self.pending and len(batch) < self.max_batch:
+            key, (record, seq, queued_at, attempts) = next(iter(self.pending.items()))
+            data, ack, echoes = self.encode(record, self.frames_sent)
+            # Always allow one record through on an idle link, however long
+            if (batch or self.in_flight) and size + len(data) > self.window_bytes:
+                break
+            del self.pending[key]
+            self.queue_latency.observe(now - queued_at)
+            self.frames_sent += 1
+            self.in_flight.append(InFlight(record, seq, ack, echoes, len(data), now, attempts))
+            batch.append(data)
+            size += len(data)
+        return batch
+
+    # Writer task: batch pending records into the window as echoes free it up
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            if self.paused:
+                batch = []
+            else:
+                self._expire(now)
+                batch = self._next_batch(now)
+            if not batch:
+                self.changed.clear()
+                timeout = self.ack_timeout() if self.in_flight and not self.paused else None
+                await wait_event(self.changed, timeout)
+                continue
+
+            data = b"".join(batch)
+            self.in_flight_bytes += len(data)
+            self.changed.set()
+            started = time.monotonic()
+            await self.write(data)
+            self.write_latency.observe(time.monotonic() - started)
+            self.writes += 1
+            self.records_sent += len(batch)
+            self.bytes_sent += len(data)
+
+    # Wait until everything queued has been written and echoed (or timed out)
+    async def drain(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.in_flight) and not self.paused and time.monotonic() < deadline:
+            self.changed.clear()
+            await wait_event(self.changed, 0.1)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "in_flight": len(self.in_flight),
+            "in_flight_bytes": self.in_flight_bytes,
+            "records_sent": self.records_sent,
+            "bytes_sent": self.bytes_sent,
+            "writes": self.writes,
+            "acks": self.acks,
+            "ack_timeouts": self.ack_timeouts,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "echoes_lost": self.echoes_lost,
+            "coalesced": self.coalesced,
+            "drain_rate": round(self.drain_rate, 1),
+            "binary": self.binary,
+            "paused": self.paused
+        }